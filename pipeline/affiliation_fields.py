@@ -0,0 +1,36 @@
+"""Pulls the cheap structured fields (email, postcode) out of affiliation text.
+
+Both fields come from one precompiled pattern, applied to a whole column at a time with
+Series.str.extract. Each field sits in its own optional lookahead from the start of the string,
+so every field keeps the leftmost-match result that its own re.search would give. Repeated
+affiliations are only scanned once.
+"""
+import re
+import pandas as pd
+
+EMAIL_PATTERN = r"[\w.]+@[\w.]+\w+"
+# UK style, then US ZIP (+4), then Canadian postcodes, first alternative to match wins
+ZIPCODE_PATTERN = (r"[A-Za-z]{1,2}\d[A-Za-z\d]? ?\d[A-Za-z]{2}"
+                   r"|\d{5}(?:-\d{4})?"
+                   r"|[A-Z]\d[A-Z] \d[A-Z]\d")
+
+EMAIL_REGEX = re.compile(EMAIL_PATTERN)
+ZIPCODE_REGEX = re.compile(ZIPCODE_PATTERN)
+AFFILIATION_FIELDS_REGEX = re.compile(
+    # Texts without an @ skip the email scan entirely
+    rf"(?=(?=[^@]*@).*?(?P<email>{EMAIL_PATTERN}))?"
+    # Every postcode contains a digit, so texts without one skip the postcode scan
+    rf"(?=(?=\D*\d).*?(?P<zipcode>{ZIPCODE_PATTERN}))?",
+    re.DOTALL)
+AFFILIATION_FIELDS = list(AFFILIATION_FIELDS_REGEX.groupindex)
+
+
+def extract_affiliation_fields(affiliations: pd.Series) -> pd.DataFrame:
+    """Returns the email and zipcode of every affiliation, "" where absent."""
+    if affiliations.empty:
+        return pd.DataFrame(columns=AFFILIATION_FIELDS, index=affiliations.index, dtype=object)
+    codes, distinct_texts = pd.factorize(affiliations.fillna("").astype(str))
+    fields = pd.Series(distinct_texts, dtype=object).str.extract(AFFILIATION_FIELDS_REGEX)
+    fields = fields.fillna("").take(codes)
+    fields.index = affiliations.index
+    return fields
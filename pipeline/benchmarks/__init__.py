@@ -0,0 +1 @@
+"""Offline benchmarks for the ETL pipeline, run from the pipeline/ directory with `python -m benchmarks.<name>`."""
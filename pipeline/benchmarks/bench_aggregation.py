@@ -0,0 +1,102 @@
+"""Benchmarks top keywords per country: the original explode/groupby/nlargest against TermCounter.
+
+Builds a synthetic wide output of the requested size, times both in memory, then streams the same
+output from a Parquet file chunk by chunk. Run from the pipeline/ directory:
+    python -m benchmarks.bench_aggregation [rows] [distinct_keywords]
+"""
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from benchmarks.synthetic import PLACES
+from output_store import iter_output_chunks, write_output
+from term_aggregation import TermCounter
+
+ARTICLE_ROWS = 8
+KEYWORDS_PER_ARTICLE = 5
+
+
+def synthetic_output(rows: int, distinct_keywords: int, seed: int = 42) -> pd.DataFrame:
+    """Returns a wide output with rows affiliation rows, ARTICLE_ROWS rows per article."""
+    rng = np.random.default_rng(seed)
+    articles = -(-rows // ARTICLE_ROWS)
+    vocabulary = np.array([f"keyword {index}" for index in range(distinct_keywords)], dtype=object)
+    # Zipf-like frequencies, as real keywords have a few very common terms
+    weights = 1 / np.arange(1, distinct_keywords + 1)
+    keyword_ids = rng.choice(distinct_keywords, size=(articles, KEYWORDS_PER_ARTICLE),
+                             p=weights / weights.sum())
+    keywords = pd.Series([list(vocabulary[ids]) for ids in keyword_ids]).repeat(ARTICLE_ROWS)
+    countries = np.array([country for _, country in PLACES] + [None], dtype=object)
+
+    output_df = pd.DataFrame({
+        "Article PMID": np.repeat(np.arange(articles), ARTICLE_ROWS).astype(str),
+        "Article title": "Synthetic article",
+        "Article keywords": keywords.to_numpy(),
+        "Article MESH identifiers": [[] for _ in range(articles * ARTICLE_ROWS)],
+        "Article Year": rng.choice(["2021", "2022", "2023"], size=articles * ARTICLE_ROWS),
+        "Author full name": "Anna Smith",
+        "Author email": None,
+        "Affiliation name": "Synthetic affiliation",
+        "Affiliation zipcode": None,
+        "Country": rng.choice(countries, size=articles * ARTICLE_ROWS),
+        "Institution GRID name": None,
+        "Institution GRID id": None,
+        "Match status": False,
+    })
+    return output_df.iloc[:rows].reset_index(drop=True)
+
+
+def legacy_top_keywords(pubmed_df: pd.DataFrame, k: int = 5) -> pd.DataFrame:
+    """The original aggregation, returning the rows it used to print."""
+    process_df = pubmed_df[(pubmed_df["Country"].notna()) &
+                           (pubmed_df["Article keywords"].notna())].copy()
+    exploded_df = process_df.explode("Article keywords")
+    keyword_counts = exploded_df.groupby(
+        ["Country", "Article keywords"]).size().reset_index(name="count")
+    # Selecting the columns keeps Country out of apply on every pandas version
+    return (keyword_counts.groupby("Country")[["Article keywords", "count"]]
+            .apply(lambda x: x.nlargest(k, "count"))
+            .reset_index(level=0).reset_index(drop=True))
+
+
+def counter_top_keywords(chunks, k: int = 5) -> pd.DataFrame:
+    """TermCounter over one or more chunks."""
+    counter = TermCounter("Country", "Article keywords")
+    for chunk in chunks:
+        counter.update(chunk)
+    return counter.top_k(k)
+
+
+def timed(name: str, rows: int, function, *args) -> pd.DataFrame:
+    """Prints the rows per second of function and returns its result."""
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    print(f"{name}: {rows} rows in {seconds:.3f}s ({rows / seconds:,.0f} rows/s)")
+    return result
+
+
+def main():
+    """Prints rows per second for each aggregation and checks they agree."""
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    distinct_keywords = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    output_df = synthetic_output(rows, distinct_keywords)
+
+    legacy = timed("legacy groupby", rows, legacy_top_keywords, output_df)
+    counted = timed("term counter", rows, counter_top_keywords, [output_df])
+    with tempfile.TemporaryDirectory() as directory:
+        parquet_file = os.path.join(directory, "output.parquet")
+        write_output(output_df, parquet_file)
+        streamed = timed("term counter, streamed from parquet", rows, counter_top_keywords,
+                         iter_output_chunks(parquet_file, ["Country", "Article keywords"]))
+
+    expected = legacy[["Country", "Article keywords", "count"]].reset_index(drop=True)
+    for name, result in (("in memory", counted), ("streamed", streamed)):
+        agrees = expected.equals(result[["Country", "Article keywords", "count"]])
+        print(f"{name} result {'matches' if agrees else 'DIFFERS from'} the legacy aggregation")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Benchmarks GRID matching: a full extractOne scan against GridMatcher's indexed, tiered and bulk lookups,
+and bulk lookups through a cold, persisted and warm match cache.
+
+Run from the pipeline/ directory:
+    python -m benchmarks.bench_grid [institutes_csv] [query_count] [aliases_csv]
+"""
+import random
+import os
+import sys
+import tempfile
+import time
+import pandas as pd
+from rapidfuzz import process
+from rapidfuzz.distance import Levenshtein
+from cache_store import SQLiteCache, normalise_text
+from grid_matcher import GRID_SCORE_CUTOFF, GridMatcher
+from match_cache import MatchCache
+from shared_grid import SharedGridMatcher, write_grid_table
+
+DEFAULT_INSTITUTES = "../raw_data/institutes.csv"
+DEFAULT_ALIASES = "../raw_data/aliases.csv"
+
+
+def legacy_match(org: str, grid_map: dict[str, str]) -> tuple[str, str] | None:
+    """The original lookup, scanning every GRID name for each org."""
+    match = process.extractOne(org, grid_map.keys(), scorer=Levenshtein.normalized_similarity,
+                               score_cutoff=GRID_SCORE_CUTOFF)
+    if match and match[1] >= GRID_SCORE_CUTOFF:
+        return match[0], grid_map[match[0]]
+    return None
+
+
+def make_queries(names: list[str], query_count: int, seed: int = 42) -> list[str]:
+    """Returns GRID names with a few random single character edits, plus some exact names."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(query_count):
+        name = list(rng.choice(names))
+        for _ in range(rng.randint(0, 3)):
+            position = rng.randrange(len(name) + 1)
+            edit = rng.choice(("insert", "delete", "replace"))
+            if edit == "insert" or not name:
+                name.insert(position, rng.choice("abcdefghijklmnopqrstuvwxyz "))
+            elif edit == "delete" and position < len(name):
+                del name[position]
+            elif position < len(name):
+                name[position] = rng.choice("abcdefghijklmnopqrstuvwxyz ")
+        queries.append("".join(name))
+    return queries
+
+
+def time_lookups(name: str, queries: list[str], lookup) -> list:
+    """Prints the lookups per second of lookup and returns its results."""
+    start = time.perf_counter()
+    results = [lookup(org) for org in queries]
+    seconds = time.perf_counter() - start
+    print(f"{name}: {len(queries)} lookups in {seconds:.4f}s "
+          f"({len(queries) / seconds:,.0f} lookups/s)")
+    return results
+
+
+def cached_bulk_lookups(name: str, matcher: GridMatcher, match_cache: MatchCache,
+                        queries: list[str]) -> list:
+    """Prints the lookups per second of bulk matching only the orgs match_cache misses."""
+    start = time.perf_counter()
+    matches = match_cache.get_many(queries)
+    missing = [org for org in dict.fromkeys(queries) if org not in matches]
+    new_matches = matcher.match_many(missing) if missing else {}
+    match_cache.put_many(new_matches)
+    matches.update(new_matches)
+    results = [matches[org] for org in queries]
+    seconds = time.perf_counter() - start
+    print(f"{name}: {len(queries)} lookups in {seconds:.4f}s "
+          f"({len(queries) / seconds:,.0f} lookups/s), {match_cache.stats()}")
+    return results
+
+
+def count_mismatches(expected: list, actual: list) -> int:
+    """Returns how many lookups disagree."""
+    return sum(left != right for left, right in zip(expected, actual))
+
+
+def main():
+    """Prints lookups per second for each matcher and checks the equivalent ones agree."""
+    institutes_file = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_INSTITUTES
+    query_count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    aliases_file = sys.argv[3] if len(sys.argv) > 3 else DEFAULT_ALIASES
+
+    grid_df = pd.read_csv(institutes_file)
+    grid_map = grid_df.set_index('name').to_dict()['grid_id']
+    alias_df = pd.read_csv(aliases_file)
+    alias_map = alias_df.drop_duplicates("alias").set_index('alias').to_dict()['grid_id']
+    queries = make_queries(list(grid_map) + list(alias_map), query_count)
+
+    start = time.perf_counter()
+    matcher = GridMatcher(grid_map, aliases=alias_map)
+    print(f"index built for {len(grid_map)} names and {len(alias_map)} aliases "
+          f"in {time.perf_counter() - start:.4f}s")
+
+    before = time_lookups("before", queries, lambda org: legacy_match(org, grid_map))
+    indexed = time_lookups("indexed", queries, matcher.match_fuzzy)
+    tiered = time_lookups("tiered", queries, matcher.match)
+    print(f"tiers: {matcher.tier_counts}")
+
+    start = time.perf_counter()
+    bulk_matches = matcher.match_many(queries)
+    bulk = [bulk_matches[org] for org in queries]
+    seconds = time.perf_counter() - start
+    print(f"bulk: {len(queries)} lookups in {seconds:.4f}s "
+          f"({len(queries) / seconds:,.0f} lookups/s)")
+
+    with tempfile.TemporaryDirectory() as directory:
+        shared_matcher = SharedGridMatcher(
+            write_grid_table(matcher, os.path.join(directory, "grid_table.bin")))
+        shared = time_lookups("shared tiered", queries, shared_matcher.match)
+        start = time.perf_counter()
+        shared_bulk_matches = shared_matcher.match_many(queries)
+        print(f"shared bulk: {len(queries)} lookups in {time.perf_counter() - start:.4f}s")
+
+        # A new MatchCache on the same store is a new run, the same one a later chunk
+        cache_queries = [normalise_text(org) for org in queries]
+        expected_matches = matcher.match_many(cache_queries)
+        expected = [expected_matches[org] for org in cache_queries]
+        cache_path = os.path.join(directory, "match_cache.sqlite")
+        cache_mismatches = []
+        for name, match_cache in (
+                ("cold cache", MatchCache(store=SQLiteCache(cache_path, "grid_match", "bench"))),
+                ("persisted cache", MatchCache(store=SQLiteCache(cache_path, "grid_match", "bench")))):
+            cache_mismatches.append(count_mismatches(
+                expected, cached_bulk_lookups(name, matcher, match_cache, cache_queries)))
+            cache_mismatches.append(count_mismatches(
+                expected, cached_bulk_lookups(f"{name}, warm", matcher, match_cache, cache_queries)))
+            match_cache.close()
+
+    print(f"indexed vs before mismatches: {count_mismatches(before, indexed)}")
+    print(f"bulk vs tiered mismatches: {count_mismatches(tiered, bulk)}")
+    print(f"shared vs tiered mismatches: {count_mismatches(tiered, shared)}, bulk: "
+          f"{count_mismatches(bulk, [shared_bulk_matches[org] for org in queries])}")
+    print(f"cached vs bulk mismatches: {sum(cache_mismatches)}")
+    print(f"matched before: {sum(match is not None for match in before)}, "
+          f"tiered: {sum(match is not None for match in tiered)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Benchmarks the bytes per row of the parsed DataFrame before and after compact columns.
+
+Before is the original representation: a Python string per row in object columns and years as
+strings. After is what process_pubmed_xml builds. Both get a Country column from the gazetteer,
+as enrichment would add. Per column bytes come from pandas, the retained total is measured with
+tracemalloc plus Arrow's allocator, so strings shared between rows are only counted once. Run
+from the pipeline/ directory:
+    python -m benchmarks.bench_memory [xml_file]
+A larger corpus can be generated with `python -m benchmarks.synthetic`.
+"""
+import gc
+import sys
+import tracemalloc
+import pandas as pd
+import pyarrow as pa
+import transform
+from benchmarks.bench_parse import DEFAULT_XML, legacy_article_rows
+from compact_columns import bytes_per_row, compact_columns
+
+
+def legacy_frame(xml_file: str) -> pd.DataFrame:
+    """Parses xml_file with the original row builder into object columns."""
+    rows = {column: [] for column in transform.PUBMED_COLUMNS}
+    for article in transform.iter_pubmed_articles(xml_file):
+        for column, values in legacy_article_rows(article).items():
+            rows[column].extend(values)
+    legacy_df = pd.DataFrame(rows, dtype=object)
+    legacy_df["Country"] = transform.get_country_gazetteer().resolve_many(
+        legacy_df["Affiliation name"].astype(str))
+    return legacy_df
+
+
+def compact_frame(xml_file: str) -> pd.DataFrame:
+    """Parses xml_file with process_pubmed_xml, compacting the Country column like enrichment."""
+    pubmed_df = transform.process_pubmed_xml(xml_file)
+    pubmed_df["Country"] = transform.get_country_gazetteer().resolve_many(
+        pubmed_df["Affiliation name"])
+    return compact_columns(pubmed_df)
+
+
+def retained(builder, xml_file: str) -> tuple[pd.DataFrame, int]:
+    """Returns the DataFrame builder makes and the bytes still allocated for it once it is built."""
+    gc.collect()
+    arrow_before = pa.total_allocated_bytes()
+    tracemalloc.start()
+    pubmed_df = builder(xml_file)
+    gc.collect()
+    python_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return pubmed_df, python_bytes + pa.total_allocated_bytes() - arrow_before
+
+
+def main():
+    """Prints bytes per row for each column and in total, before and after."""
+    xml_file = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_XML
+    # Load the gazetteer first, so neither measurement includes it
+    transform.get_country_gazetteer()
+
+    legacy_df, legacy_bytes = retained(legacy_frame, xml_file)
+    compact_df, compact_bytes = retained(compact_frame, xml_file)
+    rows = len(compact_df)
+
+    report = pd.DataFrame({"before": bytes_per_row(legacy_df), "after": bytes_per_row(compact_df)})
+    report.loc["retained"] = [legacy_bytes / rows, compact_bytes / rows]
+    report["ratio"] = report["before"] / report["after"]
+    pd.set_option("display.width", 200)
+    print(f"{rows} rows from {xml_file}, bytes per row:")
+    print(report.round(1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Benchmarks the XML row builder before and after per-article field caching.
+
+Run from the pipeline/ directory:
+    python -m benchmarks.bench_parse [xml_file] [repeats]
+"""
+import sys
+import time
+import xml.etree.ElementTree as ET
+from transform import (PUBMED_COLUMNS, add_contact_fields, build_article_rows, get_email,
+                       get_zipcode, iter_pubmed_articles, parse_author_info)
+
+DEFAULT_XML = "../raw_data/c14-gem-lo-pubmed.xml"
+
+
+def legacy_article_rows(article: ET.Element) -> dict[str, list]:
+    """The original row builder, searching the article with .// once per affiliation row."""
+    rows = {column: [] for column in PUBMED_COLUMNS}
+    pmid_value = article.find(".//PMID").text
+    title_value = article.find(".//ArticleTitle").text
+    year_element = article.find(".//PubDate/Year")
+    year_value = year_element.text if year_element is not None else ""
+
+    for author in article.findall(".//AuthorList/Author"):
+        for affiliation in author.findall("AffiliationInfo/Affiliation"):
+            rows["Article PMID"].append(pmid_value)
+            rows["Article title"].append(title_value)
+            rows["Article Year"].append(year_value)
+            rows["Author full name"].append(parse_author_info(author))
+            affiliation_text = affiliation.text
+            rows["Affiliation name"].append(affiliation_text)
+            rows["Author email"].append(get_email(affiliation_text))
+            rows["Affiliation zipcode"].append(get_zipcode(affiliation_text))
+            keywords = article.findall(".//KeywordList/Keyword")
+            rows["Article keywords"].append(
+                [keyword.text for keyword in keywords] if keywords else [""])
+            mesh = article.findall(".//MeshHeadingList/MeshHeading/DescriptorName")
+            rows["Article MESH identifiers"].append(
+                [item.get("UI") for item in mesh] if mesh else [""])
+
+    return rows
+
+
+def legacy_rows(articles: list[ET.Element]) -> int:
+    """Builds every article's rows with the legacy builder and returns the row count."""
+    return sum(len(legacy_article_rows(article)["Article PMID"]) for article in articles)
+
+
+def current_rows(articles: list[ET.Element]) -> int:
+    """Builds every article's rows, then fills the email and zipcode columns in one batch as
+    iter_pubmed_chunks does, and returns the row count."""
+    data = {column: [] for column in PUBMED_COLUMNS}
+    for article in articles:
+        for column, values in build_article_rows(article).items():
+            data[column].extend(values)
+    return len(add_contact_fields(data)["Article PMID"])
+
+
+def time_row_builder(articles: list[ET.Element], builder, repeats: int) -> tuple[int, float]:
+    """Returns the row count and best wall time of building rows for every article."""
+    best = float("inf")
+    row_count = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        row_count = builder(articles)
+        best = min(best, time.perf_counter() - start)
+    return row_count, best
+
+
+def main():
+    """Prints rows per second for the legacy and cached row builders."""
+    xml_file = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_XML
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    # Keep the articles alive, the streaming reader clears them after each yield
+    articles = [ET.fromstring(ET.tostring(article))
+                for article in iter_pubmed_articles(xml_file)]
+
+    for name, builder in (("before", legacy_rows), ("after", current_rows)):
+        row_count, seconds = time_row_builder(articles, builder, repeats)
+        print(f"{name}: {row_count} rows in {seconds:.4f}s "
+              f"({row_count / seconds:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
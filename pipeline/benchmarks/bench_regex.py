@@ -0,0 +1,50 @@
+"""Benchmarks affiliation field extraction: per-row get_email/get_zipcode against the combined column pass.
+
+Run from the pipeline/ directory:
+    python -m benchmarks.bench_regex [xml_file] [repeats]
+"""
+import sys
+import time
+import pandas as pd
+from affiliation_fields import extract_affiliation_fields
+from transform import get_email, get_zipcode, process_pubmed_xml
+
+DEFAULT_XML = "../raw_data/c14-gem-lo-pubmed.xml"
+
+
+def per_row_fields(affiliations: pd.Series) -> pd.DataFrame:
+    """The original extraction, two separate searches per row."""
+    return pd.DataFrame({"email": affiliations.map(get_email),
+                         "zipcode": affiliations.map(get_zipcode)})
+
+
+def time_extractor(affiliations: pd.Series, extractor, repeats: int) -> tuple[pd.DataFrame, float]:
+    """Returns the extracted fields and the best wall time over repeats."""
+    best = float("inf")
+    fields = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fields = extractor(affiliations)
+        best = min(best, time.perf_counter() - start)
+    return fields, best
+
+
+def main():
+    """Prints rows per second for both extractors and checks they agree."""
+    xml_file = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_XML
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    affiliations = process_pubmed_xml(xml_file)["Affiliation name"]
+
+    before, before_seconds = time_extractor(affiliations, per_row_fields, repeats)
+    after, after_seconds = time_extractor(affiliations, extract_affiliation_fields, repeats)
+    for name, seconds in (("before", before_seconds), ("after", after_seconds)):
+        print(f"{name}: {len(affiliations)} rows in {seconds:.4f}s "
+              f"({len(affiliations) / seconds:,.0f} rows/s)")
+
+    mismatches = int((before["email"] != after["email"]).sum()
+                     + (before["zipcode"] != after["zipcode"]).sum())
+    print(f"{mismatches} email/zipcode mismatches")
+
+
+if __name__ == "__main__":
+    main()
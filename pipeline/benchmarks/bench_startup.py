@@ -0,0 +1,51 @@
+"""Benchmarks transform startup: importing the module and loading the GRID/country reference data.
+
+Run from the pipeline/ directory:
+    python -m benchmarks.bench_startup [repeats]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from grid_matcher import GridMatcher
+from reference_data import (ALIASES_PATH, INSTITUTES_PATH, build_reference_data, grid_table_path,
+                            load_reference_data, read_alias_map, read_grid_map)
+
+
+def best_time(function, repeats: int) -> float:
+    """Returns the best wall time of calling function."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def import_transform():
+    """Imports transform in a fresh interpreter, as every CLI run does."""
+    subprocess.run([sys.executable, "-c", "import transform"], check=True)
+
+
+def main():
+    """Prints import time and reference data load times from CSV and from the compiled artifact."""
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    print(f"import transform: {best_time(import_transform, repeats):.4f}s")
+
+    from_csv = best_time(lambda: GridMatcher(read_grid_map(INSTITUTES_PATH),
+                                             aliases=read_alias_map(ALIASES_PATH)), repeats)
+    print(f"reference data from csv: {from_csv:.4f}s")
+
+    with tempfile.TemporaryDirectory() as directory:
+        artifact = os.path.join(directory, "reference_data.pickle")
+        build_reference_data(output_path=artifact)
+        from_artifact = best_time(lambda: load_reference_data(path=artifact), repeats)
+        print(f"reference data from artifact: {from_artifact:.4f}s "
+              f"({os.path.getsize(artifact) / 1e6:.1f} MB pickle, "
+              f"{os.path.getsize(grid_table_path(artifact)) / 1e6:.1f} MB GRID table)")
+
+
+if __name__ == "__main__":
+    main()
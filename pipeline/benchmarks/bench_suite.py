@@ -0,0 +1,157 @@
+"""Runs the transform stages on synthetic PubMed corpora, one at a time and end to end, and stores the results.
+
+Everything runs offline: no S3, no SES, only the local spaCy model and GRID files.
+Run from the pipeline/ directory:
+    python -m benchmarks.bench_suite --articles 1000 10000
+    python -m benchmarks.bench_suite --articles 10000 --compare benchmarks/results/<earlier run>.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from executors import EXECUTOR_BACKENDS, available_cpus
+from instrumentation import RunReport
+from output_store import write_output
+from benchmarks.synthetic import SyntheticCorpus
+import transform
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+STAGES = ["parse", "ner", "country", "grid_rows", "grid_bulk", "write_csv", "write_parquet", "end_to_end"]
+
+
+def current_commit() -> str:
+    """Returns the short hash of the checked out commit, or "unknown" outside git."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def grid_institutions(count: int = 200, seed: int = 42) -> list[str]:
+    """Returns GRID names for the synthetic affiliations, so GRID matching finds real hits."""
+    names = transform.get_grid_matcher().names
+    return random.Random(seed).sample(names, min(count, len(names)))
+
+
+def run_stages(xml_file: str, work_dir: str, stages: list[str],
+               executor_backend: str = None) -> RunReport:
+    """Times each selected stage in isolation, feeding it the previous stage's output."""
+    report = RunReport()
+    with report.stage("parse", log=False) as metrics:
+        pubmed_df = transform.process_pubmed_xml(xml_file)
+        metrics.rows_out += len(pubmed_df)
+    rows = len(pubmed_df)
+
+    affiliations = pubmed_df["Affiliation name"].astype(str)
+    with report.stage("ner", rows_in=rows, log=False) as metrics:
+        entities = transform.resolve_affiliation_entities(affiliations)
+        metrics.rows_out += len(entities)
+    org_entities = entities.apply(transform.extract_org_entities)
+
+    if "country" in stages:
+        with report.stage("country", rows_in=rows, log=False) as metrics:
+            countries, _ = transform.resolve_countries(affiliations, entities=entities)
+            metrics.rows_out += int(countries.notna().sum())
+
+    if "grid_rows" in stages:
+        with report.stage("grid_rows", rows_in=rows, log=False) as metrics:
+            matches = org_entities.map(transform.match_org_to_grid)
+            metrics.rows_out += int(matches.map(lambda match: match[1] is not None).sum())
+    if "grid_bulk" in stages:
+        with report.stage("grid_bulk", rows_in=rows, log=False) as metrics:
+            matches = transform.match_orgs_to_grid_bulk(org_entities, backend=executor_backend)
+            metrics.rows_out += sum(match[1] is not None for match in matches)
+
+    for stage, extension in (("write_csv", "csv"), ("write_parquet", "parquet")):
+        if stage in stages:
+            output_df = pubmed_df.assign(Country=None, **{"Institution GRID name": None,
+                                                          "Institution GRID id": None,
+                                                          "Match status": False})
+            with report.stage(stage, rows_in=rows, log=False) as metrics:
+                write_output(output_df, os.path.join(work_dir, f"output.{extension}"))
+                metrics.rows_out += rows
+
+    if "end_to_end" in stages:
+        with report.stage("end_to_end", log=False) as metrics:
+            pubmed_df = transform.process_pubmed_xml(xml_file)
+            transform.enrich_affiliations(pubmed_df, executor_backend=executor_backend)
+            pubmed_df["Match status"] = pubmed_df["Institution GRID id"].notna()
+            pubmed_df.drop(columns=transform.HELPER_COLUMNS, inplace=True)
+            write_output(pubmed_df, os.path.join(work_dir, "end_to_end.parquet"))
+            metrics.rows_in += rows
+            metrics.rows_out += len(pubmed_df)
+
+    # parse and ner always run to feed the later stages, only keep them when selected
+    report.stages = {name: metrics for name, metrics in report.stages.items() if name in stages}
+    return report
+
+
+def compare(results: dict, baseline_file: str):
+    """Prints each stage's wall time against the same corpus size and stage in a baseline run."""
+    with open(baseline_file, encoding="utf-8") as file:
+        baseline = json.load(file)
+    baseline_times = {(run["corpus"]["articles"], stage["stage"]): stage["wall_seconds"]
+                      for run in baseline["runs"] for stage in run["stages"]}
+
+    print(f"\nAgainst {baseline['commit']} ({os.path.basename(baseline_file)}):")
+    for run in results["runs"]:
+        for stage in run["stages"]:
+            before = baseline_times.get((run["corpus"]["articles"], stage["stage"]))
+            if before:
+                print(f"{run['corpus']['articles']:>8} articles {stage['stage']:<14}"
+                      f"{before:>9.3f}s -> {stage['wall_seconds']:>9.3f}s "
+                      f"({stage['wall_seconds'] / before:.2f}x)")
+
+
+def main():
+    """Generates each corpus, runs the stages and writes the results to RESULTS_DIR."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--articles", type=int, nargs="+", default=[1000])
+    parser.add_argument("--authors-per-article", type=int, default=8)
+    parser.add_argument("--affiliation-repeat-rate", type=float, default=0.7)
+    parser.add_argument("--keywords-per-article", type=int, default=5)
+    parser.add_argument("--mesh-per-article", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--executor-backend", choices=EXECUTOR_BACKENDS,
+                        help="backend for GRID matching, defaults to EXECUTOR_BACKEND")
+    parser.add_argument("--results-dir", default=RESULTS_DIR)
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    results = {"commit": current_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "python": platform.python_version(), "cpu_count": os.cpu_count(),
+               "available_cpus": available_cpus(), "executor_backend": args.executor_backend,
+               "runs": []}
+    institutions = grid_institutions(seed=args.seed)
+
+    for articles in args.articles:
+        corpus = SyntheticCorpus(articles, args.authors_per_article, args.affiliation_repeat_rate,
+                                 args.keywords_per_article, args.mesh_per_article, args.seed,
+                                 institutions=institutions)
+        with tempfile.TemporaryDirectory() as work_dir:
+            xml_file = corpus.write(os.path.join(work_dir, "synthetic.xml"))
+            report = run_stages(xml_file, work_dir, args.stages, args.executor_backend)
+
+        print(f"\n{articles} articles:\n{report.summary()}")
+        results["runs"].append({"corpus": corpus.to_dict(),
+                                "stages": [metrics.to_dict() for metrics in report.stages.values()]})
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    results_file = os.path.join(
+        args.results_dir, f"{results['timestamp'].replace(':', '')}-{results['commit']}.json")
+    with open(results_file, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print(f"\nResults saved to {results_file}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
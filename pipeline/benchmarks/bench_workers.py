@@ -0,0 +1,90 @@
+"""Benchmarks per-worker memory of the GRID reference data: a pickled GridMatcher in every worker
+against workers attached to the shared memory-mapped GRID table.
+
+Run from the pipeline/ directory:
+    python -m benchmarks.bench_workers [workers] [query_count]
+"""
+import multiprocessing
+import os
+import pickle
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from benchmarks.bench_grid import make_queries
+from grid_matcher import GridMatcher
+from reference_data import ALIASES_PATH, INSTITUTES_PATH, read_alias_map, read_grid_map
+from shared_grid import SharedGridMatcher, write_grid_table
+
+worker_state = {}
+
+
+def process_memory_mb() -> tuple[float, float]:
+    """Returns this process's resident and private (unshared) memory in MB, Linux only."""
+    memory = {}
+    with open("/proc/self/smaps_rollup", encoding="utf-8") as file:
+        for line in file:
+            key, _, value = line.partition(":")
+            if value.strip().endswith("kB"):
+                memory[key] = int(value.split()[0]) / 1024
+    return memory["Rss"], memory["Private_Clean"] + memory["Private_Dirty"]
+
+
+def load_nothing():
+    """Worker initializer: no GRID data, the baseline memory of a worker."""
+    worker_state.pop("matcher", None)
+
+
+def load_pickled(matcher_bytes: bytes):
+    """Worker initializer: unpickles a private copy of the whole GridMatcher."""
+    worker_state["matcher"] = pickle.loads(matcher_bytes)
+
+
+def attach_shared(path: str):
+    """Worker initializer: attaches to the shared GRID table."""
+    worker_state["matcher"] = SharedGridMatcher(path)
+
+
+def match_and_measure(queries: list[str]) -> tuple[int, float, float]:
+    """Matches queries in a worker and returns its pid and memory afterwards."""
+    if "matcher" in worker_state:
+        worker_state["matcher"].match_many(queries, workers=1)
+        for org in queries[:200]:
+            worker_state["matcher"].match(org)
+    return (os.getpid(), *process_memory_mb())
+
+
+def measure(initializer, initargs: tuple, workers: int, queries: list[str]) -> dict[int, tuple]:
+    """Returns each worker's (rss, private) memory after it has matched its share of queries."""
+    chunks = [queries[index::workers] for index in range(workers)]
+    # Spawned workers start empty, forked ones would share and dirty the parent's pages
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs,
+                             mp_context=multiprocessing.get_context("spawn")) as executor:
+        return {pid: (rss, private)
+                for pid, rss, private in executor.map(match_and_measure, chunks)}
+
+
+def main():
+    """Prints the memory each worker adds on top of an empty worker with private and shared GRID data."""
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    query_count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    matcher = GridMatcher(read_grid_map(INSTITUTES_PATH), aliases=read_alias_map(ALIASES_PATH))
+    queries = make_queries(matcher.names, query_count)
+
+    with tempfile.TemporaryDirectory() as directory:
+        table_path = write_grid_table(matcher, os.path.join(directory, "grid_table.bin"))
+        baseline = None
+        for name, initializer, initargs in (
+                ("no GRID data", load_nothing, ()),
+                ("pickled", load_pickled, (pickle.dumps(matcher),)),
+                ("shared", attach_shared, (table_path,))):
+            memory = measure(initializer, initargs, workers, queries)
+            rss = sum(rss for rss, _ in memory.values()) / len(memory)
+            private = sum(private for _, private in memory.values()) / len(memory)
+            baseline = baseline if baseline is not None else private
+            print(f"{name}: rss {rss:.1f} MB, private {private:.1f} MB per worker, "
+                  f"{private - baseline:+.1f} MB private over an empty worker, "
+                  f"{(private - baseline) * workers:+.1f} MB for {workers} workers")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Generates synthetic PubMed XML with the structure the transform reads, at any size.
+
+Run from the pipeline/ directory:
+    python -m benchmarks.synthetic output.xml [articles] [authors_per_article] [affiliation_repeat_rate]
+"""
+import random
+import sys
+from xml.sax.saxutils import escape, quoteattr
+
+DEPARTMENTS = ["Department of Rheumatology", "Department of Immunology", "Department of Medicine",
+               "Division of Pulmonary Medicine", "Department of Pathophysiology", "School of Medicine",
+               "Department of Radiology and Nuclear Medicine", "Institute of Clinical Sciences"]
+PLACES = [("Athens", "Greece"), ("Amsterdam", "Netherlands"), ("Paris", "France"),
+          ("Boston, MA 02115", "USA"), ("London WC1E 6BT", "United Kingdom"), ("Berlin", "Germany"),
+          ("Tokyo", "Japan"), ("Toronto, ON M5G 2C4", "Canada"), ("Bergen", "Norway"), ("Milan", "Italy")]
+INSTITUTIONS = ["University of Athens", "Vrije Universiteit Amsterdam", "Sorbonne University",
+                "Harvard Medical School", "University College London", "Charite University Hospital",
+                "University of Tokyo", "University of Toronto", "University of Bergen", "University of Milan"]
+WORDS = ["syndrome", "primary", "salivary", "gland", "lymphoma", "autoimmune", "interstitial", "lung",
+         "disease", "cohort", "therapy", "biomarker", "inflammation", "fibrosis", "patients", "risk",
+         "clinical", "outcomes", "sicca", "antibodies", "B-cell", "interferon", "signature", "trial"]
+SURNAMES = ["Smith", "Papadopoulos", "de Vries", "Martin", "Nguyen", "Tanaka", "Rossi", "Hansen",
+            "Muller", "Brown", "Garcia", "Kowalski", "Olsen", "Dubois", "Ivanova", "Chen"]
+FORENAMES = ["Anna", "Ben", "Maria", "Jan", "Sofia", "Kenji", "Luca", "Ingrid", "Tom", "Eve"]
+
+
+class SyntheticCorpus:
+    """Settings for a synthetic corpus, every choice comes from one seeded random generator."""
+
+    def __init__(self, articles: int = 1000, authors_per_article: int = 8,
+                 affiliation_repeat_rate: float = 0.7, keywords_per_article: int = 5,
+                 mesh_per_article: int = 8, seed: int = 42, institutions: list[str] = None):
+        self.articles = articles
+        self.authors_per_article = authors_per_article
+        self.affiliation_repeat_rate = affiliation_repeat_rate
+        self.keywords_per_article = keywords_per_article
+        self.mesh_per_article = mesh_per_article
+        self.seed = seed
+        self.institutions = institutions or INSTITUTIONS
+
+    def to_dict(self) -> dict:
+        """Returns the settings, stored alongside benchmark results."""
+        return {key: value for key, value in vars(self).items() if key != "institutions"}
+
+    def new_affiliation(self, rng: random.Random) -> str:
+        """Returns a fresh affiliation string, sometimes with an email address."""
+        city, country = rng.choice(PLACES)
+        affiliation = (f"{rng.choice(DEPARTMENTS)}, {rng.choice(self.institutions)}, "
+                       f"{city}, {country}.")
+        if rng.random() < 0.2:
+            affiliation += f" {rng.choice(FORENAMES).lower()}.{rng.randrange(10_000)}@example.org"
+        return affiliation
+
+    def article_xml(self, rng: random.Random, pmid: int, affiliation_pool: list[str]) -> str:
+        """Returns one PubmedArticle element as text."""
+        authors = []
+        for _ in range(max(1, round(rng.gauss(self.authors_per_article, 2)))):
+            if affiliation_pool and rng.random() < self.affiliation_repeat_rate:
+                affiliation = rng.choice(affiliation_pool)
+            else:
+                affiliation = self.new_affiliation(rng)
+                affiliation_pool.append(affiliation)
+            authors.append(
+                f"<Author><LastName>{escape(rng.choice(SURNAMES))}</LastName>"
+                f"<ForeName>{rng.choice(FORENAMES)}</ForeName>"
+                f"<AffiliationInfo><Affiliation>{escape(affiliation)}</Affiliation></AffiliationInfo>"
+                "</Author>")
+
+        title = " ".join(rng.choices(WORDS, k=rng.randint(6, 14))).capitalize() + "."
+        keywords = "".join(f"<Keyword>{word}</Keyword>"
+                           for word in rng.sample(WORDS, min(self.keywords_per_article, len(WORDS))))
+        mesh = "".join(
+            f"<MeshHeading><DescriptorName UI={quoteattr(f'D{rng.randrange(1_000_000):06d}')}>"
+            f"{rng.choice(WORDS)}</DescriptorName></MeshHeading>"
+            for _ in range(self.mesh_per_article))
+
+        return (f"<PubmedArticle><MedlineCitation><PMID>{pmid}</PMID><Article>"
+                f"<Journal><JournalIssue><PubDate><Year>{rng.randint(1990, 2024)}</Year>"
+                "</PubDate></JournalIssue></Journal>"
+                f"<ArticleTitle>{escape(title)}</ArticleTitle>"
+                f"<AuthorList>{''.join(authors)}</AuthorList></Article>"
+                f"<MeshHeadingList>{mesh}</MeshHeadingList>"
+                f"<KeywordList>{keywords}</KeywordList>"
+                "</MedlineCitation></PubmedArticle>\n")
+
+    def write(self, path: str) -> str:
+        """Writes the corpus to path one article at a time and returns path."""
+        rng = random.Random(self.seed)
+        affiliation_pool = []
+        with open(path, "w", encoding="utf-8") as file:
+            file.write('<?xml version="1.0" encoding="UTF-8"?>\n<PubmedArticleSet>\n')
+            for index in range(self.articles):
+                file.write(self.article_xml(rng, 40_000_000 + index, affiliation_pool))
+            file.write("</PubmedArticleSet>\n")
+        return path
+
+
+if __name__ == "__main__":
+    corpus = SyntheticCorpus(
+        articles=int(sys.argv[2]) if len(sys.argv) > 2 else 1000,
+        authors_per_article=int(sys.argv[3]) if len(sys.argv) > 3 else 8,
+        affiliation_repeat_rate=float(sys.argv[4]) if len(sys.argv) > 4 else 0.7)
+    print(f"Wrote {corpus.write(sys.argv[1])}")
@@ -0,0 +1,144 @@
+"""SQLite backed cache for pipeline results that are expensive to recompute (e.g. NER on affiliations)."""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections.abc import Iterable
+
+SQLITE_VARIABLE_LIMIT = 500
+# Seconds to wait on another process's write lock, e.g. parallel transform workers
+SQLITE_BUSY_TIMEOUT = 60
+
+
+def normalise_text(text: str) -> str:
+    """Collapses whitespace, so texts differing only in spacing share one cache entry."""
+    return " ".join(text.split())
+
+
+class SQLiteCache:
+    """Persistent, size-bounded cache of JSON values keyed on a content hash of the text.
+
+    Entries belong to a namespace and are dropped whenever the namespace version
+    changes (e.g. a new model release). Once max_entries is exceeded, the least
+    recently used entries are evicted.
+    """
+
+    def __init__(self, path: str, namespace: str, version: str, max_entries: int = 500_000):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.namespace = namespace
+        self.version = version
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self.connection = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS cache_meta (
+                namespace TEXT PRIMARY KEY,
+                version TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS cache_entries_last_used
+                ON cache_entries (namespace, last_used);
+        """)
+        self._check_version()
+
+    @staticmethod
+    def make_key(text: str) -> str:
+        """Returns the content hash used as the cache key for text."""
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+    def _check_version(self):
+        """Clears the namespace if it was written by a different version."""
+        row = self.connection.execute(
+            "SELECT version FROM cache_meta WHERE namespace = ?", (self.namespace,)).fetchone()
+        if row is not None and row[0] == self.version:
+            return
+
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO cache_meta (namespace, version) VALUES (?, ?)",
+                (self.namespace, self.version))
+
+    def get_many(self, texts: Iterable[str]) -> dict:
+        """Returns the cached values for every text that has an entry."""
+        keys = {self.make_key(text): text for text in texts}
+        found = {}
+        key_list = list(keys)
+
+        for start in range(0, len(key_list), SQLITE_VARIABLE_LIMIT):
+            batch = key_list[start:start + SQLITE_VARIABLE_LIMIT]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.connection.execute(
+                f"SELECT key, value FROM cache_entries WHERE namespace = ? AND key IN ({placeholders})",
+                (self.namespace, *batch))
+            for key, value in rows:
+                found[keys[key]] = json.loads(value)
+
+        if found:
+            now = time.time()
+            with self.connection:
+                self.connection.executemany(
+                    "UPDATE cache_entries SET last_used = ? WHERE namespace = ? AND key = ?",
+                    ((now, self.namespace, self.make_key(text)) for text in found))
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: dict):
+        """Stores JSON serialisable values keyed by text, then evicts down to max_entries."""
+        if not items:
+            return
+
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, last_used) VALUES (?, ?, ?, ?)",
+                ((self.namespace, self.make_key(text), json.dumps(value), now)
+                 for text, value in items.items()))
+        self._evict()
+
+    def _evict(self):
+        """Deletes the least recently used entries above max_entries."""
+        excess = len(self) - self.max_entries
+        if excess <= 0:
+            return
+
+        with self.connection:
+            self.connection.execute("""
+                DELETE FROM cache_entries WHERE namespace = ? AND key IN (
+                    SELECT key FROM cache_entries WHERE namespace = ?
+                    ORDER BY last_used LIMIT ?
+                )""", (self.namespace, self.namespace, excess))
+
+    def __len__(self) -> int:
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (self.namespace,)).fetchone()[0]
+
+    def stats(self) -> dict:
+        """Returns hit/miss counters for this process and the current entry count."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self),
+        }
+
+    def close(self):
+        """Closes the underlying SQLite connection."""
+        self.connection.close()
@@ -0,0 +1,88 @@
+"""Compact in-memory representation of the repeated columns of the wide PubMed DataFrame.
+
+Titles, affiliation texts, countries and GRID names repeat on many rows, so they are held as
+categoricals: each distinct string is stored once and rows hold small integer codes. Years are
+nullable integers, <NA> where an article has none, rather than strings. Strings that stay in
+object columns, such as author names, keywords and MeSH identifiers, are interned while parsing
+so repeated values share one object.
+"""
+import sys
+import numpy as np
+import pandas as pd
+
+CATEGORY_COLUMNS = ["Article title", "Affiliation name", "Country", "Country source",
+                    "Institution GRID name", "Institution GRID id"]
+YEAR_COLUMN = "Article Year"
+YEAR_DTYPE = "Int16"
+
+
+def intern_text(text: str | None) -> str | None:
+    """Returns the interned copy of text, so equal strings parsed apart share one object."""
+    return sys.intern(text) if text is not None else None
+
+
+def parse_year(text: str | None) -> int | None:
+    """Returns a publication year as an int, None when it is missing or not a number."""
+    return int(text) if text and text.strip().isdigit() else None
+
+
+def year_values(values: pd.Series) -> pd.Series:
+    """Returns years given as ints, floats or strings as nullable integers."""
+    return pd.to_numeric(values, errors="coerce").astype(YEAR_DTYPE)
+
+
+def compact_columns(pubmed_df: pd.DataFrame) -> pd.DataFrame:
+    """Converts the repeated columns present in pubmed_df to categoricals and years to integers."""
+    for column in CATEGORY_COLUMNS:
+        if column in pubmed_df and not isinstance(pubmed_df[column].dtype, pd.CategoricalDtype):
+            pubmed_df[column] = pubmed_df[column].astype("category")
+    if YEAR_COLUMN in pubmed_df and pubmed_df[YEAR_COLUMN].dtype != YEAR_DTYPE:
+        pubmed_df[YEAR_COLUMN] = year_values(pubmed_df[YEAR_COLUMN])
+    return pubmed_df
+
+
+def as_text(values: pd.Series) -> pd.Series:
+    """Returns values as strings like astype(str), keeping a categorical column categorical."""
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype(str)
+    values = values.cat.rename_categories(values.cat.categories.astype(str))
+    if values.isna().any():
+        # astype(str) turns a None into "None", so missing texts do here too
+        if "None" not in values.cat.categories:
+            values = values.cat.add_categories("None")
+        values = values.fillna("None")
+    return values
+
+
+def union_categorical(columns: list[pd.Series]) -> pd.Categorical:
+    """Concatenates categorical columns whose categories differ, without going through strings."""
+    categories = list(dict.fromkeys(category for column in columns
+                                    for category in column.cat.categories))
+    positions = {category: position for position, category in enumerate(categories)}
+    # Each column's codes are remapped to the union, code -1 (missing) picks the appended -1
+    codes = [np.append(np.array([positions[category] for category in column.cat.categories],
+                                dtype=np.int64), -1)[column.cat.codes.to_numpy()]
+             for column in columns]
+    return pd.Categorical.from_codes(np.concatenate(codes), categories=categories)
+
+
+def concat_compact(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenates frames like pd.concat, keeping columns categorical when their categories differ.
+
+    pd.concat turns those back into object strings, so every merge would undo the compaction.
+    """
+    columns = list(dict.fromkeys(column for frame in frames for column in frame.columns))
+    categorical = [column for column in columns
+                   if all(column in frame and isinstance(frame[column].dtype, pd.CategoricalDtype)
+                          for frame in frames)]
+    combined = pd.concat([frame.drop(columns=categorical) for frame in frames], ignore_index=True)
+    for column in categorical:
+        combined[column] = union_categorical([frame[column] for frame in frames])
+    return combined[columns]
+
+
+def bytes_per_row(pubmed_df: pd.DataFrame) -> pd.Series:
+    """Returns the deep memory of each column per row, and the total."""
+    column_bytes = pubmed_df.memory_usage(deep=True, index=False)
+    column_bytes["total"] = column_bytes.sum()
+    return column_bytes / max(len(pubmed_df), 1)
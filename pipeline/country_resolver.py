@@ -0,0 +1,88 @@
+"""Resolves affiliation countries with a gazetteer of pycountry names, common names and aliases.
+
+Most affiliations end with their country ("..., Boston, MA 02115, USA."), so the last few comma
+separated segments are looked up first and NER only needs to run for the rest. Names are matched
+after normalisation, so "USA", "U.S.A." and "United States of America" all resolve to the
+pycountry name "United States".
+"""
+import re
+import unicodedata
+import pandas as pd
+import pycountry
+
+# Segments checked from the end of the affiliation, e.g. "..., Milan, Lombardy, Italy"
+TRAILING_SEGMENTS = 3
+COUNTRY_SOURCES = ("gazetteer", "ner", "unresolved")
+
+# Spellings seen in affiliations that pycountry does not list, by alpha_2 code
+COUNTRY_ALIASES = {
+    "USA": "US", "US": "US", "America": "US",
+    "UK": "GB", "Great Britain": "GB", "England": "GB", "Scotland": "GB", "Wales": "GB",
+    "Northern Ireland": "GB",
+    "PR China": "CN", "PRC": "CN", "Mainland China": "CN",
+    "Korea": "KR", "Republic of Korea": "KR",
+    "Russia": "RU",
+    "Holland": "NL",
+    "Turkey": "TR",
+    "Macedonia": "MK", "Republic of Macedonia": "MK",
+    "Ivory Coast": "CI",
+    "Brunei": "BN",
+    "Palestine": "PS",
+    "Vatican": "VA", "Vatican City": "VA",
+    "Hong Kong SAR": "HK", "Macau": "MO",
+    "UAE": "AE",
+    "DR Congo": "CD", "Democratic Republic of Congo": "CD",
+    "Democratic Republic of the Congo": "CD",
+    # Native names, common in non-English journals
+    "España": "ES", "Polska": "PL", "Deutschland": "DE", "Italia": "IT", "Brasil": "BR",
+    "Nederland": "NL", "Schweiz": "CH", "Suisse": "CH", "Österreich": "AT", "Sverige": "SE",
+    "Norge": "NO", "Danmark": "DK", "Suomi": "FI", "Česká republika": "CZ",
+}
+
+SEGMENT_SEPARATORS = re.compile(r"[,;]")
+# Emails, "Electronic address:" and tokens holding a digit (postcodes, street numbers) are noise
+SEGMENT_NOISE = re.compile(r"Electronic address:?|\S*[@\d]\S*", re.IGNORECASE)
+
+
+def normalise_country(text: str) -> str:
+    """Strips accents, case, full stops, apostrophes and a leading "the" from a country name."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char)).casefold()
+    text = re.sub(r"[.'’]", "", text)
+    words = re.sub(r"\W+", " ", text).split()
+    if words[:1] == ["the"]:
+        words = words[1:]
+    return " ".join(words)
+
+
+class CountryGazetteer:
+    """Normalised country name -> pycountry country name."""
+
+    def __init__(self, aliases: dict[str, str] = None):
+        self.names = {}
+        for country in pycountry.countries:
+            for attribute in ("name", "common_name", "official_name"):
+                value = getattr(country, attribute, None)
+                if value:
+                    self.names.setdefault(normalise_country(value), country.name)
+        for alias, alpha_2 in (COUNTRY_ALIASES if aliases is None else aliases).items():
+            self.names[normalise_country(alias)] = pycountry.countries.get(alpha_2=alpha_2).name
+        self.names.pop("", None)
+
+    def lookup(self, text: str) -> str | None:
+        """Returns the country name text refers to, or None."""
+        return self.names.get(normalise_country(text))
+
+    def resolve(self, affiliation_text: str) -> str | None:
+        """Returns the country named by one of the affiliation's trailing segments, or None."""
+        segments = SEGMENT_SEPARATORS.split(affiliation_text)
+        for segment in reversed(segments[-TRAILING_SEGMENTS:]):
+            country = self.lookup(SEGMENT_NOISE.sub(" ", segment))
+            if country is not None:
+                return country
+        return None
+
+    def resolve_many(self, affiliations: pd.Series) -> pd.Series:
+        """Returns resolve for every affiliation, resolving each distinct text once."""
+        countries = {text: self.resolve(text) for text in affiliations.unique()}
+        return affiliations.map(countries).astype(object)
@@ -1,9 +1,15 @@
 """Complete ETL pipeline"""
+import json
 import boto3
 from dotenv import load_dotenv
 from extract import main_extract
 from transform import main_transform
-from load import main_load
+from load import OUTPUT_BUCKET, connect_to_s3, download_output, main_load
+from streaming_pipeline import main_streaming
+from manifest import ProcessedManifest
+from instrumentation import run_report
+from output_store import processed_output_file
+import os
 from os import environ as ENV
 
 
@@ -45,6 +51,41 @@ def send_plain_email(subject, body, sender, recipient):
         print(f"Error sending email: {e}")
 
 
+def restore_output(manifest: ProcessedManifest):
+    """Makes sure the output the manifest describes is there for new articles to be merged into.
+
+    The manifest and output are local files that a new container may not have. When the manifest
+    lists processed articles but the output is missing, the uploaded output is downloaded, or if
+    there is none the manifest is reset so the run processes everything again. Otherwise only the
+    new rows would be written and uploaded over the full output.
+    """
+    output_file = processed_output_file()
+    if manifest.is_empty() or os.path.exists(output_file):
+        return
+    if download_output(connect_to_s3(), OUTPUT_BUCKET, output_file):
+        return
+    print(f"{output_file} is missing and was never uploaded, processing every file again")
+    manifest.reset()
+
+
+def run_incremental_etl():
+    """Runs the ETL steps one after another, only new or changed files and articles are processed"""
+    manifest = ProcessedManifest()
+    try:
+        restore_output(manifest)
+        with run_report.stage("extract") as metrics:
+            pubmed_raw_files = main_extract(manifest)
+            # Counted in files, the transform stages count rows
+            metrics.rows_out += len(pubmed_raw_files)
+        main_transform(pubmed_raw_files, manifest=manifest)
+        with run_report.stage("upload"):
+            main_load()
+        # Only remember what was processed once the output is uploaded
+        manifest.commit()
+    finally:
+        manifest.close()
+
+
 def run_etl_pipeline():
     """Downloads, cleans, processes the data, and uploads it to the S3 output bucket"""
     load_dotenv()
@@ -64,15 +105,21 @@ def run_etl_pipeline():
             recipient=recipient_email,
         )
 
-        # Run the ETL steps
-        main_extract()
-        main_transform()
-        main_load()
+        if ENV.get("PIPELINE_MODE") == "streaming":
+            # Download, parse, enrich and upload overlap, the whole output is rebuilt
+            main_streaming()
+        else:
+            run_incremental_etl()
+
+        print(json.dumps({"event": "run_finished", **run_report.to_dict()}))
+        if ENV.get("RUN_REPORT_PATH"):
+            run_report.write(ENV["RUN_REPORT_PATH"])
 
         # Notify that the task has completed
         send_plain_email(
             subject="ETL Pipeline Completed",
-            body="The ETL pipeline has successfully completed.",
+            body=("The ETL pipeline has successfully completed.\n\n"
+                  f"Stage summary:\n{run_report.summary()}"),
             sender=sender_email,
             recipient=recipient_email,
         )
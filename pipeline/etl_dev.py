@@ -1,5 +1,11 @@
 """Development script for running the ETL pipeline without AWS (local filesystem only)."""
+from os import environ as ENV
+from instrumentation import run_report
 from transform import main_transform
 
 if __name__ == "__main__":
     main_transform()
+
+    print(run_report.summary())
+    if ENV.get("RUN_REPORT_PATH"):
+        run_report.write(ENV["RUN_REPORT_PATH"])
@@ -0,0 +1,112 @@
+"""Pluggable executors for the CPU-bound transform stages, sized to the container's CPU quota.
+
+EXECUTOR_BACKEND selects the backend and EXECUTOR_WORKERS the worker count (default: the CPU quota):
+- serial: runs every task inline, the default
+- thread: a thread pool, for rapidfuzz and other native code that releases the GIL
+- process: a process pool, each worker loading shared state once through an initializer
+- loky: joblib's reusable loky process pool, only available when joblib is installed
+"""
+import math
+import os
+from collections.abc import Callable
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+EXECUTOR_BACKENDS = ("serial", "thread", "process", "loky")
+EXECUTOR_BACKEND = os.environ.get("EXECUTOR_BACKEND", "serial")
+EXECUTOR_WORKERS = int(os.environ.get("EXECUTOR_WORKERS", "0"))
+
+CGROUP_V2_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+CGROUP_V1_CPU_QUOTA = "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+CGROUP_V1_CPU_PERIOD = "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
+
+
+def read_first_line(path: str) -> str:
+    """Returns the first line of a small file, stripped."""
+    with open(path, encoding="utf-8") as file:
+        return file.readline().strip()
+
+
+def cgroup_cpu_quota() -> float | None:
+    """Returns the container's CPU limit in cores from cgroup v2 or v1, or None if there is none."""
+    try:
+        quota, period = read_first_line(CGROUP_V2_CPU_MAX).split()
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        quota = int(read_first_line(CGROUP_V1_CPU_QUOTA))
+        # A quota of -1 means unlimited
+        return quota / int(read_first_line(CGROUP_V1_CPU_PERIOD)) if quota > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus() -> int:
+    """Returns the CPUs this process may use: its affinity mask, capped by the cgroup quota."""
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    quota = cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, math.ceil(quota))
+    return max(1, cpus)
+
+
+def default_workers() -> int:
+    """Returns EXECUTOR_WORKERS if set, else available_cpus()."""
+    return EXECUTOR_WORKERS or available_cpus()
+
+
+class SerialExecutor(Executor):
+    """Runs each task inline on submit, so the serial backend has the same interface as the pools."""
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:  # pylint: disable=arguments-differ
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as error:  # pylint: disable=broad-except
+            future.set_exception(error)
+        return future
+
+
+def create_executor(backend: str = None, workers: int = None,
+                    initializer: Callable = None, initargs: tuple = ()) -> Executor:
+    """Returns an executor for backend, running initializer once per process that executes tasks."""
+    backend = backend or EXECUTOR_BACKEND
+    workers = workers or default_workers()
+
+    if backend in ("serial", "thread"):
+        # Threads share this process's memory, so its state only needs loading once
+        if initializer is not None:
+            initializer(*initargs)
+        if backend == "serial":
+            return SerialExecutor()
+        return ThreadPoolExecutor(max_workers=workers)
+    if backend == "process":
+        return ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+    if backend == "loky":
+        try:
+            from joblib.externals.loky import get_reusable_executor  # pylint: disable=import-outside-toplevel
+        except ImportError as error:
+            raise ImportError("The loky executor backend needs joblib: pip install joblib") from error
+        return get_reusable_executor(max_workers=workers, initializer=initializer, initargs=initargs)
+    raise ValueError(f"Unknown executor backend {backend!r}, expected one of {EXECUTOR_BACKENDS}")
+
+
+def map_in_chunks(function: Callable[[list], object], items: list, chunk_size: int,
+                  backend: str = None, workers: int = None,
+                  initializer: Callable = None, initargs: tuple = (),
+                  executor: Executor = None) -> list:
+    """Applies function to consecutive chunk_size slices of items, returning the results in order.
+
+    Only the chunks and results are pickled for process backends, shared state such as the
+    GRID index should be loaded by initializer rather than passed in. A caller calling this
+    repeatedly can pass its own executor, which is reused rather than started and shut down
+    on every call.
+    """
+    chunks = [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+    if executor is not None:
+        return list(executor.map(function, chunks))
+    with create_executor(backend, workers, initializer, initargs) as own_executor:
+        return list(own_executor.map(function, chunks))
@@ -2,10 +2,24 @@
 Connects to an AWS S3 bucket, downloads relevant PubMed XML files based on a prefix and file extension,
 and saves them locally to the raw_data/ directory for further processing.
 """
+import hashlib
 import os
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from os import environ
 from boto3 import client
+from boto3.s3.transfer import TransferConfig
 from dotenv import load_dotenv
+from manifest import ProcessedManifest, SourceObject
+
+MB = 1024 * 1024
+RAW_DATA_DIR = "../raw_data"
+INPUT_BUCKET = "sigma-pharmazer-input"
+INPUT_PREFIX = "c14-gem-lo"
+DOWNLOAD_WORKERS = 4
+# Files are downloaded in parallel too, so DOWNLOAD_WORKERS * max_concurrency threads in total
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=16 * MB, multipart_chunksize=16 * MB,
+                                 max_concurrency=4, use_threads=True)
 
 
 def connect_to_s3():
@@ -19,43 +33,141 @@ def connect_to_s3():
 def upload_initial_xml(s3, bucket_name, file_name):
     """Upload initial Pubmed XML file to s3 input bucket."""
     output_file = "c14-gem-lo-pubmed.xml"
-    s3.upload_file(file_name, bucket_name, output_file)
+    s3.upload_file(file_name, bucket_name, output_file, Config=TRANSFER_CONFIG)
 
     print(f"{output_file} uploaded successfully")
 
 
-def download_pubmed_data_files(s3, bucket_name, file_prefix, file_extension):
-    """Downloads relevant files from S3 to raw_data folder."""
+def list_pubmed_objects(s3, bucket_name, file_prefix, file_extension) -> list[dict]:
+    """Returns every object under file_prefix ending in file_extension, across all listing pages."""
+    paginator = s3.get_paginator("list_objects_v2")
+    return [
+        s3_object
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=file_prefix)
+        for s3_object in page.get("Contents", [])
+        if s3_object["Key"].endswith(file_extension)
+    ]
+
+
+def s3_source(bucket_name, s3_object) -> SourceObject:
+    """Returns the manifest entry for an object from an S3 listing."""
+    return SourceObject(f"s3://{bucket_name}/{s3_object['Key']}", s3_object["ETag"],
+                        s3_object["Size"], s3_object["LastModified"].isoformat())
+
+
+def local_etag(local_path: str, part_count: int, chunk_size: int) -> str:
+    """Returns the S3 style ETag of a local file, single part or multipart."""
+    # Read chunk_size bytes at a time either way, a single part object can be up to 5 GB
+    with open(local_path, "rb") as file:
+        parts = iter(lambda: file.read(chunk_size), b"")
+        if part_count <= 1:
+            digest = hashlib.md5()
+            for part in parts:
+                digest.update(part)
+            return f'"{digest.hexdigest()}"'
+        part_digests = b"".join(hashlib.md5(part).digest() for part in parts)
+    return f'"{hashlib.md5(part_digests).hexdigest()}-{part_count}"'
+
+
+def is_local_copy_current(local_path: str, s3_object: dict,
+                          chunk_size: int = TRANSFER_CONFIG.multipart_chunksize) -> bool:
+    """Returns True if local_path already holds the object, by size and ETag."""
+    if not os.path.exists(local_path) or os.path.getsize(local_path) != s3_object["Size"]:
+        return False
+
+    etag = s3_object["ETag"]
+    part_count = int(etag.strip('"').partition("-")[2] or 1)
+    # A multipart ETag depends on the uploader's part size, on a mismatch we just download again
+    return local_etag(local_path, part_count, chunk_size) == etag
+
+
+def download_pubmed_object(s3, bucket_name, s3_object, local_dir: str = RAW_DATA_DIR) -> str:
+    """Downloads one object to local_dir unless an identical copy is already there."""
+    local_path = os.path.join(local_dir, os.path.basename(s3_object["Key"]))
+    if is_local_copy_current(local_path, s3_object):
+        print(f"{s3_object['Key']} already up to date at {local_path}")
+        return local_path
+
+    s3.download_file(bucket_name, s3_object["Key"], local_path, Config=TRANSFER_CONFIG)
+    print(f"{s3_object['Key']} downloaded successfully to {local_path}")
+    return local_path
+
+
+def select_unprocessed(bucket_name, s3_objects: list[dict],
+                       manifest: ProcessedManifest = None) -> list[dict]:
+    """Drops the objects whose ETag and size the manifest has already processed."""
+    if manifest is None:
+        return s3_objects
+
+    selected = []
+    for s3_object in s3_objects:
+        source = s3_source(bucket_name, s3_object)
+        if manifest.is_source_unchanged(source):
+            print(f"{s3_object['Key']} unchanged since last run, skipping")
+            continue
+        manifest.stage_source(source)
+        selected.append(s3_object)
+    return selected
+
+
+def download_pubmed_data_files(s3, bucket_name, file_prefix, file_extension,
+                               manifest: ProcessedManifest = None,
+                               workers: int = DOWNLOAD_WORKERS,
+                               local_dir: str = RAW_DATA_DIR) -> list[str]:
+    """Downloads relevant files from S3 to raw_data folder and returns their local paths.
+
+    With a manifest, objects whose ETag and size were already processed are not downloaded.
+    """
+    files_needed = select_unprocessed(
+        bucket_name, list_pubmed_objects(s3, bucket_name, file_prefix, file_extension), manifest)
+
+    if not files_needed:
+        print("No data was uploaded")
+        return []
+
+    os.makedirs(local_dir, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(
+            lambda s3_object: download_pubmed_object(s3, bucket_name, s3_object, local_dir),
+            files_needed))
 
-    bucket = s3.list_objects(Bucket=bucket_name)
-    contents = bucket.get("Contents", [])
-    files_needed = []
 
-    for file in contents:
-        data = file["Key"]
-        if data.startswith(file_prefix) and data.endswith(file_extension):
-            files_needed.append(data)
+def stream_pubmed_data_files(s3, bucket_name, file_prefix, file_extension,
+                             manifest: ProcessedManifest = None) -> Iterator:
+    """Yields each relevant object's body as a readable stream, without saving it to disk.
 
-    if files_needed:
-        for file in files_needed:
-            local_path = os.path.join("../raw_data", os.path.basename(file))
-            s3.download_file(bucket_name, file, local_path)
-            print(f"{file} downloaded successfully to {local_path}")
-    else:
-        print("No data was uploaded")
+    The bodies can be passed straight to the transform stage, whose XML reader accepts file objects.
+    """
+    files_needed = select_unprocessed(
+        bucket_name, list_pubmed_objects(s3, bucket_name, file_prefix, file_extension), manifest)
 
+    for s3_object in files_needed:
+        body = s3.get_object(Bucket=bucket_name, Key=s3_object["Key"])["Body"]
+        print(f"Streaming {s3_object['Key']}")
+        try:
+            yield body
+        finally:
+            body.close()
 
-def main_extract():
-    """Connects to bucket and download relevant files"""
 
-    bucket = "sigma-pharmazer-input"
+def main_extract(manifest: ProcessedManifest = None, stream: bool = False):
+    """Connects to bucket and download relevant files
+
+    Returns the local paths, or with stream=True an iterator of object bodies to parse directly.
+    """
+
+    bucket = INPUT_BUCKET
 
     client = connect_to_s3()
 
     # upload_initial_xml(client, bucket, "../raw_data/c14-gem-lo-pubmed.xml")
 
-    download_pubmed_data_files(
-        client, bucket, "c14-gem-lo", ".xml")
+    if stream:
+        return stream_pubmed_data_files(
+            client, bucket, INPUT_PREFIX, ".xml", manifest=manifest)
+
+    return download_pubmed_data_files(
+        client, bucket, INPUT_PREFIX, ".xml", manifest=manifest)
 
 
 if __name__ == "__main__":
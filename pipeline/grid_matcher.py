@@ -0,0 +1,168 @@
+"""Indexed fuzzy matching of organisation names against the GRID institutes table."""
+import math
+import os
+import re
+from collections.abc import Iterable
+import numpy as np
+from rapidfuzz import process
+from rapidfuzz.distance import Levenshtein
+
+GRID_SCORE_CUTOFF = 0.9
+# Memory one cdist score matrix may take, each process pool worker scores its own blocks
+CDIST_MEMORY_MB = int(os.environ.get("CDIST_MEMORY_MB", "16"))
+# Score matrices are float64, so 16 MB holds about 2M cells: ~126 orgs against 16.6k GRID names
+CDIST_MAX_CELLS = CDIST_MEMORY_MB * 1024 * 1024 // np.dtype(np.float64).itemsize
+MATCH_TIERS = ("exact_name", "exact_alias", "fuzzy", "unmatched")
+
+NON_ALPHANUMERIC = re.compile(r"[\W_]+")
+
+
+def normalise_name(name: str) -> str:
+    """Returns a case and punctuation insensitive key for exact name lookups."""
+    return NON_ALPHANUMERIC.sub(" ", name.casefold()).strip()
+
+
+class GridMatcher:
+    """Matches organisation names to GRID institutes in tiers, fuzzy scoring only on an exact miss.
+
+    Names and aliases are first looked up by their normalised form in a hash
+    index. On a miss, fuzzy matching scores only names of a compatible length:
+    a normalized Levenshtein similarity of at least score_cutoff needs
+    |len(a) - len(b)| <= (1 - score_cutoff) * max(len(a), len(b)), so names are
+    bucketed by length once and each lookup only scores the buckets that can
+    reach the cutoff. Fuzzy results match process.extractOne over the whole
+    table, including which name wins a tie.
+    """
+
+    def __init__(self, grid_map: dict[str, str], aliases: dict[str, str] = None,
+                 score_cutoff: float = GRID_SCORE_CUTOFF):
+        self.grid_map = grid_map
+        self.score_cutoff = score_cutoff
+        self.tier_counts = dict.fromkeys(MATCH_TIERS, 0)
+        # length -> (names, positions in grid_map), both kept in grid_map order
+        self.buckets: dict[int, tuple[list[str], list[int]]] = {}
+
+        self.names = list(grid_map)
+        for position, name in enumerate(self.names):
+            names, positions = self.buckets.setdefault(len(name), ([], []))
+            names.append(name)
+            positions.append(position)
+
+        # normalised name or alias -> (tier, (GRID name, GRID id)), institute names take priority
+        self.exact_index: dict[str, tuple[str, tuple[str, str]]] = {}
+        grid_names = {}
+        for name, grid_id in grid_map.items():
+            grid_names.setdefault(grid_id, name)
+            self.exact_index.setdefault(
+                normalise_name(name), ("exact_name", (name, grid_id)))
+
+        for alias, grid_id in (aliases or {}).items():
+            if grid_id in grid_names:
+                self.exact_index.setdefault(
+                    normalise_name(alias), ("exact_alias", (grid_names[grid_id], grid_id)))
+        # Names made only of punctuation must not match each other
+        self.exact_index.pop("", None)
+
+    def candidate_lengths(self, length: int) -> range:
+        """Returns the name lengths that can reach the cutoff against a query of this length."""
+        # Widened by one on each side so float rounding never drops a valid candidate
+        shortest = math.floor(length * self.score_cutoff) - 1
+        longest = math.ceil(length / self.score_cutoff) + 1 if self.score_cutoff else length
+        return range(max(shortest, 0), longest + 1)
+
+    def match_exact(self, org: str) -> tuple[str, tuple[str, str]] | None:
+        """Returns (tier, match) when org is a GRID name or alias up to normalisation."""
+        if org in self.grid_map:
+            return "exact_name", (org, self.grid_map[org])
+        return self.exact_index.get(normalise_name(org))
+
+    def match_fuzzy(self, org: str) -> tuple[str, str] | None:
+        """Returns the best fuzzy (GRID name, GRID id) for org, or None below the cutoff."""
+        best = None
+        for length in self.candidate_lengths(len(org)):
+            bucket = self.buckets.get(length)
+            if bucket is None:
+                continue
+
+            names, positions = bucket
+            match = process.extractOne(org, names, scorer=Levenshtein.normalized_similarity,
+                                       processor=None, score_cutoff=self.score_cutoff)
+            if match is None:
+                continue
+
+            name, score, index = match
+            # Ties go to the name that comes first in grid_map, as in a full scan
+            candidate = (score, -positions[index], name)
+            if best is None or candidate > best:
+                best = candidate
+
+        if best is None or best[0] < self.score_cutoff:
+            return None
+        return best[2], self.grid_map[best[2]]
+
+    def match(self, org: str) -> tuple[str, str] | None:
+        """Returns the best (GRID name, GRID id) for org, or None when no tier resolves it."""
+        exact = self.match_exact(org)
+        if exact is not None:
+            tier, match = exact
+        else:
+            match = self.match_fuzzy(org)
+            tier = "fuzzy" if match is not None else "unmatched"
+
+        self.tier_counts[tier] += 1
+        return match
+
+    def scoring_names(self) -> list[str]:
+        """Returns every GRID name in grid_map order, as the choices cdist scores against."""
+        return self.names
+
+    def match_many(self, orgs: Iterable[str], workers: int = -1) -> dict[str, tuple[str, str] | None]:
+        """Returns the match for every distinct org, fuzzy scoring the exact misses in bulk with cdist.
+
+        Each row of the score matrix is resolved with argmax, which keeps the
+        first best name in grid_map order exactly like match_fuzzy().
+        """
+        matches = {}
+        fuzzy_orgs = []
+        for org in dict.fromkeys(orgs):
+            exact = self.match_exact(org)
+            if exact is not None:
+                tier, matches[org] = exact
+                self.tier_counts[tier] += 1
+            else:
+                fuzzy_orgs.append(org)
+
+        if not fuzzy_orgs or not self.names:
+            matches.update(dict.fromkeys(fuzzy_orgs))
+            self.tier_counts["unmatched"] += len(fuzzy_orgs)
+            return matches
+
+        names = self.scoring_names()
+        rows_per_call = max(1, CDIST_MAX_CELLS // len(names))
+        for start in range(0, len(fuzzy_orgs), rows_per_call):
+            batch = fuzzy_orgs[start:start + rows_per_call]
+            # float64 so scores compare exactly as they do in extractOne
+            scores = process.cdist(batch, names, scorer=Levenshtein.normalized_similarity,
+                                   processor=None, score_cutoff=self.score_cutoff,
+                                   dtype=np.float64, workers=workers)
+            best_indexes = scores.argmax(axis=1)
+            best_scores = scores[np.arange(len(batch)), best_indexes]
+
+            for org, index, score in zip(batch, best_indexes, best_scores):
+                if score >= self.score_cutoff:
+                    name = names[index]
+                    matches[org] = (name, self.grid_map[name])
+                    self.tier_counts["fuzzy"] += 1
+                else:
+                    matches[org] = None
+                    self.tier_counts["unmatched"] += 1
+
+        return matches
+
+    def match_entities(self, org_entities: set[str]) -> tuple[str, str]:
+        """Returns the match for the first org entity that any tier resolves, else (None, None)."""
+        for org in org_entities:
+            match = self.match(org)
+            if match is not None:
+                return match
+        return (None, None)
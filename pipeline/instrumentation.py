@@ -0,0 +1,219 @@
+"""Stage-level wall time, CPU time, peak memory and throughput instrumentation for the ETL.
+
+Wrap each stage in run_report.stage(name). Every stage logs one JSON line
+when it finishes, and the report can be summarised (e.g. for the completion
+email) or written out as JSON. A stage's peak memory is the highest resident
+set size reached while it ran, see StagePeaks. With PROFILE_DIR set, or after
+run_report.enable_profiling(), every stage is also profiled (see profiling.py).
+"""
+import itertools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager, nullcontext
+from profiling import StageProfiler
+
+
+PROC_STATUS = "/proc/self/status"
+# Writing 5 resets the VmHWM high water mark to the current RSS (Linux 4.0+)
+PROC_CLEAR_REFS = "/proc/self/clear_refs"
+
+
+def maxrss_mb(who: int) -> float:
+    """Returns ru_maxrss of RUSAGE_SELF or RUSAGE_CHILDREN in MB."""
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return resource.getrusage(who).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def proc_status_mb(field: str) -> float | None:
+    """Returns a kB field of /proc/self/status such as VmHWM in MB, or None without /proc."""
+    try:
+        with open(PROC_STATUS, encoding="ascii") as status:
+            for line in status:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def cpu_seconds() -> float:
+    """Returns the user + system CPU time of this process and its finished children."""
+    return sum(usage.ru_utime + usage.ru_stime
+               for usage in (resource.getrusage(resource.RUSAGE_SELF),
+                             resource.getrusage(resource.RUSAGE_CHILDREN)))
+
+
+class StagePeaks:
+    """Tracks the peak RSS of this process while each open stage runs, nested or concurrent.
+
+    The kernel's high water mark (VmHWM) is read at every stage start and end, credited to every
+    stage still open, and then reset through /proc/self/clear_refs. Each stage so gets the peak
+    over its own run rather than over the process lifetime. Where VmHWM cannot be reset, the
+    values fall back to the process peak so far, and without /proc to ru_maxrss. Resetting VmHWM
+    resets ru_maxrss too, so the process peak is kept here as well.
+    """
+
+    def __init__(self):
+        self.resettable = True
+        self.reset()
+        # A forked worker starts with no open stages and a lock nobody holds
+        os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        """Forgets every open stage and the peak so far."""
+        self.lock = threading.Lock()
+        self.process_peak = 0.0
+        # Token of each open stage -> its peak RSS so far, in MB
+        self.open: dict[int, float] = {}
+        self.tokens = itertools.count()
+
+    @staticmethod
+    def high_water_mark() -> float:
+        """Returns the peak RSS of this process since the last reset, in MB."""
+        high_water_mark = proc_status_mb("VmHWM")
+        return high_water_mark if high_water_mark is not None else maxrss_mb(resource.RUSAGE_SELF)
+
+    def checkpoint(self):
+        """Credits the peak since the last checkpoint to every open stage, then resets it."""
+        high_water_mark = self.high_water_mark()
+        self.process_peak = max(self.process_peak, high_water_mark)
+        for token, peak in self.open.items():
+            self.open[token] = max(peak, high_water_mark)
+        if self.resettable:
+            try:
+                with open(PROC_CLEAR_REFS, "w", encoding="ascii") as clear_refs:
+                    clear_refs.write("5")
+            except OSError:
+                self.resettable = False
+
+    def start(self) -> int:
+        """Opens a stage, returning the token to stop it with."""
+        with self.lock:
+            self.checkpoint()
+            token = next(self.tokens)
+            rss = proc_status_mb("VmRSS")
+            self.open[token] = rss if rss is not None else 0.0
+            return token
+
+    def stop(self, token: int) -> float:
+        """Closes a stage, returning its peak RSS in MB."""
+        with self.lock:
+            self.checkpoint()
+            return self.open.pop(token)
+
+    def peak_rss_mb(self) -> float:
+        """Returns the peak RSS so far of this process or any finished child, in MB."""
+        with self.lock:
+            return max(self.process_peak, self.high_water_mark(),
+                       maxrss_mb(resource.RUSAGE_CHILDREN))
+
+
+class StageMetrics:
+    """Accumulated metrics of one stage, which may run several times (e.g. once per chunk)."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_rss_mb = 0.0
+        self.rows_in = 0
+        self.rows_out = 0
+
+    @property
+    def rows_per_second(self) -> float:
+        """Returns rows in (or rows out if no input was counted) per wall clock second."""
+        rows = self.rows_in or self.rows_out
+        return rows / self.wall_seconds if self.wall_seconds else 0.0
+
+    def to_dict(self) -> dict:
+        """Returns the metrics as a JSON serialisable dict."""
+        return {
+            "stage": self.name,
+            "calls": self.calls,
+            "wall_seconds": round(self.wall_seconds, 4),
+            "cpu_seconds": round(self.cpu_seconds, 4),
+            "peak_rss_mb": round(self.peak_rss_mb, 1),
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "rows_per_second": round(self.rows_per_second, 1),
+        }
+
+
+class RunReport:
+    """Collects StageMetrics for one ETL run, in the order stages first ran."""
+
+    def __init__(self, profiler: StageProfiler = None):
+        self.stages: dict[str, StageMetrics] = {}
+        self.started_at = time.time()
+        self.profiler = profiler
+        self.peaks = StagePeaks()
+
+    def enable_profiling(self, output_dir: str) -> StageProfiler:
+        """Profiles every stage from now on, here and in worker processes started afterwards."""
+        # Workers read PROFILE_DIR when they import this module
+        os.environ["PROFILE_DIR"] = os.path.abspath(output_dir)
+        self.profiler = StageProfiler(os.environ["PROFILE_DIR"])
+        print(f"Profiling stages into {os.environ['PROFILE_DIR']}")
+        return self.profiler
+
+    @contextmanager
+    def stage(self, name: str, rows_in: int = 0, log: bool = True) -> Iterator[StageMetrics]:
+        """Times the wrapped block as stage name, the caller may add to rows_out on the yielded metrics."""
+        metrics = self.stages.setdefault(name, StageMetrics(name))
+        profile = self.profiler.stage(name) if self.profiler is not None else nullcontext()
+        wall_start = time.perf_counter()
+        cpu_start = cpu_seconds()
+        peak_token = self.peaks.start()
+        children_start = maxrss_mb(resource.RUSAGE_CHILDREN)
+        try:
+            with profile:
+                yield metrics
+        finally:
+            metrics.calls += 1
+            metrics.wall_seconds += time.perf_counter() - wall_start
+            metrics.cpu_seconds += cpu_seconds() - cpu_start
+            stage_peak = self.peaks.stop(peak_token)
+            # A child that finished during the stage and raised the children's peak ran in it
+            children_peak = maxrss_mb(resource.RUSAGE_CHILDREN)
+            if children_peak > children_start:
+                stage_peak = max(stage_peak, children_peak)
+            metrics.peak_rss_mb = max(metrics.peak_rss_mb, stage_peak)
+            metrics.rows_in += rows_in
+            if log:
+                print(json.dumps({"event": "stage_finished", **metrics.to_dict()}), flush=True)
+
+    def to_dict(self) -> dict:
+        """Returns the whole run as a JSON serialisable dict."""
+        return {
+            "started_at": self.started_at,
+            "wall_seconds": round(time.time() - self.started_at, 4),
+            "peak_rss_mb": round(self.peaks.peak_rss_mb(), 1),
+            "stages": [metrics.to_dict() for metrics in self.stages.values()],
+        }
+
+    def summary(self) -> str:
+        """Returns a plain text table of every stage, e.g. for an email body."""
+        lines = [f"{'stage':<20}{'wall s':>10}{'cpu s':>10}{'peak MB':>10}"
+                 f"{'rows in':>10}{'rows out':>10}{'rows/s':>12}"]
+        for metrics in self.stages.values():
+            lines.append(f"{metrics.name:<20}{metrics.wall_seconds:>10.2f}{metrics.cpu_seconds:>10.2f}"
+                         f"{metrics.peak_rss_mb:>10.0f}{metrics.rows_in:>10}{metrics.rows_out:>10}"
+                         f"{metrics.rows_per_second:>12,.0f}")
+        return "\n".join(lines)
+
+    def write(self, path: str):
+        """Writes the run report as JSON to path."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+
+run_report = RunReport(StageProfiler.from_env())
@@ -1,7 +1,11 @@
-"""Uploads the processed data (csv file) to an s3 bucket."""
+"""Uploads the processed data (csv or parquet file) to an s3 bucket."""
+import os
 from os import environ
 from boto3 import client
 from dotenv import load_dotenv
+from output_store import processed_output_file
+
+OUTPUT_BUCKET = "sigma-pharmazer-output"
 
 
 def connect_to_s3():
@@ -12,14 +16,49 @@ def connect_to_s3():
     return s3
 
 
+def output_key(file_name: str) -> str:
+    """Returns the S3 key of the processed output, keeping the local file's extension."""
+    return f"c14-gem-lo-processed-pubmed{os.path.splitext(file_name)[1]}"
+
+
 def upload_csv_file(s3, bucket_name, file_name):
-    """Upload the processed csv file to s3 output bucket."""
-    output_file = "c14-gem-lo-processed-pubmed.csv"
-    s3.upload_file(file_name, bucket_name, output_file)
+    """Upload the processed csv or parquet file, or normalised table directory, to s3 output bucket."""
+    output_file = output_key(file_name)
+
+    if os.path.isdir(file_name):
+        for table_file in sorted(os.listdir(file_name)):
+            s3.upload_file(os.path.join(file_name, table_file),
+                           bucket_name, f"{output_file}/{table_file}")
+    else:
+        s3.upload_file(file_name, bucket_name, output_file)
 
     print(f"{file_name} uploaded successfully as {output_file}")
 
 
+def download_output(s3, bucket_name, file_name) -> bool:
+    """Downloads the uploaded output, file or normalised table directory, to file_name.
+
+    Returns False when the bucket holds no output for file_name's format.
+    """
+    output_file = output_key(file_name)
+    paginator = s3.get_paginator("list_objects_v2")
+    keys = [s3_object["Key"]
+            for page in paginator.paginate(Bucket=bucket_name, Prefix=output_file)
+            for s3_object in page.get("Contents", [])
+            if s3_object["Key"] == output_file or s3_object["Key"].startswith(f"{output_file}/")]
+    if not keys:
+        return False
+
+    for key in keys:
+        # Table files sit under output_file/, a file output is output_file itself
+        local_path = os.path.normpath(os.path.join(file_name, os.path.relpath(key, output_file)))
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        s3.download_file(bucket_name, key, local_path)
+
+    print(f"{output_file} downloaded successfully as {file_name}")
+    return True
+
+
 def download_csv_file(s3, bucket_name, file_prefix, file_extension):
     """Downloads relevant files from S3 to a data/folder."""
 
@@ -45,12 +84,12 @@ def download_csv_file(s3, bucket_name, file_prefix, file_extension):
 def main_load():
     """Connects to bucket and download relevant files"""
 
-    bucket = "sigma-pharmazer-output"
+    bucket = OUTPUT_BUCKET
 
     client = connect_to_s3()
 
     # Full dataset use "../cleaned_data/pubmed_output2.csv"
-    upload_csv_file(client, bucket, "../cleaned_data/pubmed_output.csv")
+    upload_csv_file(client, bucket, processed_output_file())
 
     # download_csv_file(client, bucket, "c14-gem", ".csv")
 
@@ -0,0 +1,122 @@
+"""SQLite manifest of the source files and PubMed articles already processed, for incremental runs."""
+import hashlib
+import os
+import sqlite3
+from typing import NamedTuple
+
+PIPELINE_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_PATH = os.path.join(PIPELINE_DIR, "..", "cache", "manifest.sqlite")
+
+
+class SourceObject(NamedTuple):
+    """A processed source file: an S3 object (etag set) or a local file (etag empty)."""
+    key: str
+    etag: str
+    size: int
+    mtime: str
+
+
+def local_source(path: str) -> SourceObject:
+    """Returns the SourceObject describing a local file as it is now."""
+    stat = os.stat(path)
+    return SourceObject(os.path.abspath(path), "", stat.st_size, str(stat.st_mtime_ns))
+
+
+def content_hash(content: bytes) -> str:
+    """Returns the hash stored for an article's content."""
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+class ProcessedManifest:
+    """Records which sources and article versions have been processed.
+
+    Lookups read the committed state; new sources and articles are staged and
+    only written by commit(), which should run once their output is saved, so
+    a failed run is retried in full next time.
+    """
+
+    def __init__(self, path: str = MANIFEST_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.pending_sources: dict[str, SourceObject] = {}
+        self.pending_articles: dict[str, str] = {}
+        self.skipped_articles = 0
+
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS sources (
+                key TEXT PRIMARY KEY,
+                etag TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS articles (
+                pmid TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL
+            ) WITHOUT ROWID;
+        """)
+
+    def is_empty(self) -> bool:
+        """Returns True when no source or article has been committed yet."""
+        return not any(
+            self.connection.execute(f"SELECT EXISTS (SELECT 1 FROM {table})").fetchone()[0]
+            for table in ("sources", "articles"))
+
+    def reset(self):
+        """Forgets every committed and staged source and article, so all are processed again."""
+        with self.connection:
+            self.connection.execute("DELETE FROM sources")
+            self.connection.execute("DELETE FROM articles")
+        self.pending_sources.clear()
+        self.pending_articles.clear()
+        self.skipped_articles = 0
+
+    def is_source_unchanged(self, source: SourceObject) -> bool:
+        """Returns True if this exact version of the source was already processed."""
+        row = self.connection.execute(
+            "SELECT etag, size, mtime FROM sources WHERE key = ?", (source.key,)).fetchone()
+        if row is None:
+            return False
+        etag, size, mtime = row
+        if source.etag:
+            # S3 objects are identified by content, LastModified changes on identical re-uploads
+            return etag == source.etag and size == source.size
+        return size == source.size and mtime == source.mtime
+
+    def stage_source(self, source: SourceObject):
+        """Marks a source as processed once commit() runs."""
+        self.pending_sources[source.key] = source
+
+    def should_process_article(self, pmid: str, article_hash: str) -> bool:
+        """Returns True for a new or changed article and stages it, else counts it as skipped."""
+        if self.pending_articles.get(pmid) == article_hash:
+            # Already taken from an earlier file in this run
+            self.skipped_articles += 1
+            return False
+
+        row = self.connection.execute(
+            "SELECT content_hash FROM articles WHERE pmid = ?", (pmid,)).fetchone()
+        if row is not None and row[0] == article_hash:
+            self.skipped_articles += 1
+            return False
+        self.pending_articles[pmid] = article_hash
+        return True
+
+    def commit(self):
+        """Writes every staged source and article to the manifest."""
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO sources (key, etag, size, mtime) VALUES (?, ?, ?, ?)",
+                self.pending_sources.values())
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO articles (pmid, content_hash) VALUES (?, ?)",
+                self.pending_articles.items())
+        self.pending_sources.clear()
+        self.pending_articles.clear()
+
+    def close(self):
+        """Closes the underlying SQLite connection, dropping anything not committed."""
+        self.connection.close()
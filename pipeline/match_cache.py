@@ -0,0 +1,90 @@
+"""Cache of ORG -> GRID match results, bounded in process and optionally persisted across runs.
+
+Lookups go to an in-process LRU first, then to an optional SQLiteCache, so an institution seen in
+an earlier chunk costs one dictionary lookup and one seen in an earlier run a batched SQLite read.
+Orgs that matched nothing are cached too, as explicit negative entries. The persistent entries
+are versioned on the GRID reference data fingerprint and score cutoff, so they are dropped as soon
+as either changes.
+"""
+import json
+from collections import OrderedDict
+from collections.abc import Iterable
+from cache_store import SQLiteCache
+
+MATCH_CACHE_MAX_ENTRIES = 200_000
+# Bump whenever the matching rules change, so persisted results are recomputed
+MATCH_CACHE_FORMAT = 1
+
+
+def match_cache_version(fingerprint: dict, score_cutoff: float) -> str:
+    """Returns the version that persisted matches were computed under."""
+    return SQLiteCache.make_key(json.dumps(
+        [MATCH_CACHE_FORMAT, fingerprint, score_cutoff], sort_keys=True))
+
+
+class MatchCache:
+    """LRU of normalised org -> (GRID name, GRID id), or None for an org that matched nothing."""
+
+    def __init__(self, max_entries: int = MATCH_CACHE_MAX_ENTRIES, store: SQLiteCache = None):
+        self.max_entries = max_entries
+        self.store = store
+        self.entries: OrderedDict[str, tuple[str, str] | None] = OrderedDict()
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    def get_many(self, orgs: Iterable[str]) -> dict[str, tuple[str, str] | None]:
+        """Returns the cached result of every normalised org that has one, negative ones included."""
+        found = {}
+        missing = []
+        for org in dict.fromkeys(orgs):
+            if org in self.entries:
+                self.entries.move_to_end(org)
+                found[org] = self.entries[org]
+            else:
+                missing.append(org)
+        self.memory_hits += len(found)
+
+        stored = {}
+        if missing and self.store is not None:
+            # JSON turns the (name, id) tuples into lists
+            stored = {org: tuple(match) if match is not None else None
+                      for org, match in self.store.get_many(missing).items()}
+            self.remember(stored)
+            found.update(stored)
+        self.store_hits += len(stored)
+        self.misses += len(missing) - len(stored)
+        return found
+
+    def put_many(self, matches: dict[str, tuple[str, str] | None]):
+        """Caches new results, None meaning the org matched nothing."""
+        self.remember(matches)
+        if self.store is not None:
+            self.store.put_many(matches)
+
+    def remember(self, matches: dict[str, tuple[str, str] | None]):
+        """Adds results to the LRU, evicting the least recently used above max_entries."""
+        self.entries.update(matches)
+        for org in matches:
+            self.entries.move_to_end(org)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Returns hit/miss counters for this process and the current entry counts."""
+        hits = self.memory_hits + self.store_hits
+        lookups = hits + self.misses
+        return {
+            "hits": hits,
+            "memory_hits": self.memory_hits,
+            "store_hits": self.store_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+            "stored_entries": len(self.store) if self.store is not None else 0,
+        }
+
+    def close(self):
+        """Closes the persistent store, if any."""
+        if self.store is not None:
+            self.store.close()
@@ -0,0 +1,112 @@
+"""Splits the wide one-row-per-affiliation output into article, author, affiliation and term tables.
+
+The wide layout repeats the article title, keywords and MeSH identifiers on
+every author affiliation row. Here each is stored once and rows reference it
+through integer surrogate keys; denormalize_output() joins the tables back into
+the wide layout for consumers that still want it.
+"""
+import os
+import pandas as pd
+
+ARTICLE_COLUMNS = {"Article PMID": "pmid", "Article title": "title", "Article Year": "year"}
+AUTHOR_COLUMNS = {"Author full name": "full_name"}
+AFFILIATION_COLUMNS = {
+    "Affiliation name": "name",
+    "Author email": "email",
+    "Affiliation zipcode": "zipcode",
+    "Country": "country",
+    "Country source": "country_source",
+    "Institution GRID name": "grid_name",
+    "Institution GRID id": "grid_id",
+    "Match status": "match_status",
+}
+# Article list column -> (table name, value column)
+TERM_TABLES = {
+    "Article keywords": ("article_keywords", "keyword"),
+    "Article MESH identifiers": ("article_mesh", "mesh_ui"),
+}
+# Years are already compact nullable integers
+CATEGORY_COLUMNS = {"affiliations": ["name", "country", "country_source", "grid_name", "grid_id"]}
+PARQUET_COMPRESSION = "zstd"
+
+
+def explode_terms(articles: pd.DataFrame, list_column: str, value_column: str) -> pd.DataFrame:
+    """Returns one (article_id, position, value) row per item of an article list column."""
+    terms = articles[["article_id", list_column]].explode(list_column)
+    terms = terms.rename(columns={list_column: value_column})
+    terms.insert(1, "position", terms.groupby("article_id").cumcount())
+    return terms.reset_index(drop=True)
+
+
+def normalize_output(pubmed_df: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    """Returns the normalised tables for a wide output DataFrame."""
+    article_ids = pd.Series(pd.factorize(pubmed_df["Article PMID"])[0], index=pubmed_df.index)
+    # Authors are identified by name within an article, the wide layout has no author position
+    author_ids = pubmed_df.groupby([article_ids, pubmed_df["Author full name"]],
+                                   sort=False, dropna=False).ngroup()
+
+    first_of_article = ~article_ids.duplicated()
+    articles = pubmed_df.loc[first_of_article, [*ARTICLE_COLUMNS, *TERM_TABLES]]
+    articles.insert(0, "article_id", article_ids[first_of_article])
+
+    first_of_author = ~author_ids.duplicated()
+    authors = pubmed_df.loc[first_of_author, list(AUTHOR_COLUMNS)].rename(columns=AUTHOR_COLUMNS)
+    authors.insert(0, "author_id", author_ids[first_of_author])
+    authors.insert(1, "article_id", article_ids[first_of_author])
+
+    affiliations = pubmed_df.reindex(columns=list(AFFILIATION_COLUMNS)).rename(
+        columns=AFFILIATION_COLUMNS)
+    affiliations.insert(0, "affiliation_id", range(len(pubmed_df)))
+    affiliations.insert(1, "author_id", author_ids)
+
+    tables = {
+        "articles": articles[["article_id", *ARTICLE_COLUMNS]].rename(columns=ARTICLE_COLUMNS),
+        "authors": authors,
+        "affiliations": affiliations,
+    }
+    for list_column, (table_name, value_column) in TERM_TABLES.items():
+        tables[table_name] = explode_terms(articles, list_column, value_column)
+
+    for table_name, table in tables.items():
+        table.reset_index(drop=True, inplace=True)
+        for column in CATEGORY_COLUMNS.get(table_name, []):
+            table[column] = table[column].astype("category")
+    return tables
+
+
+def denormalize_output(tables: dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """Joins the normalised tables back into the wide one-row-per-affiliation layout."""
+    articles = tables["articles"].rename(columns={v: k for k, v in ARTICLE_COLUMNS.items()})
+    for list_column, (table_name, value_column) in TERM_TABLES.items():
+        terms = tables[table_name].sort_values(["article_id", "position"])
+        articles = articles.merge(
+            terms.groupby("article_id")[value_column].agg(list).rename(list_column),
+            left_on="article_id", right_index=True, how="left")
+
+    authors = tables["authors"].rename(columns={v: k for k, v in AUTHOR_COLUMNS.items()})
+    affiliations = tables["affiliations"].rename(
+        columns={v: k for k, v in AFFILIATION_COLUMNS.items()})
+
+    wide = (affiliations.sort_values("affiliation_id")
+            .merge(authors, on="author_id", how="left")
+            .merge(articles, on="article_id", how="left"))
+    # Tables written before a column was added are missing it, its values become missing
+    columns = [*ARTICLE_COLUMNS, *TERM_TABLES, *AUTHOR_COLUMNS, *AFFILIATION_COLUMNS]
+    return wide.reindex(columns=columns).reset_index(drop=True)
+
+
+def write_normalized(pubmed_df: pd.DataFrame, output_dir: str):
+    """Writes each normalised table to output_dir as <table>.parquet."""
+    os.makedirs(output_dir, exist_ok=True)
+    for table_name, table in normalize_output(pubmed_df).items():
+        table.to_parquet(os.path.join(output_dir, f"{table_name}.parquet"),
+                         index=False, compression=PARQUET_COMPRESSION)
+
+
+def read_normalized(output_dir: str, wide: bool = True):
+    """Reads the normalised tables, joined back into the wide layout unless wide is False."""
+    table_names = ["articles", "authors", "affiliations",
+                   *(table_name for table_name, _ in TERM_TABLES.values())]
+    tables = {table_name: pd.read_parquet(os.path.join(output_dir, f"{table_name}.parquet"))
+              for table_name in table_names}
+    return denormalize_output(tables) if wide else tables
@@ -0,0 +1,186 @@
+"""Reads and writes the processed PubMed output as CSV, typed Parquet or normalised Parquet tables."""
+import os
+from collections.abc import Iterator
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from compact_columns import YEAR_DTYPE, compact_columns
+from normalized_output import read_normalized, write_normalized
+
+OUTPUT_FORMAT = os.environ.get("OUTPUT_FORMAT", "csv")
+PROCESSED_OUTPUT_FILES = {
+    "csv": "../cleaned_data/pubmed_output.csv",
+    "parquet": "../cleaned_data/pubmed_output.parquet",
+    # A directory of article, author, affiliation, keyword and MeSH tables
+    "normalized": "../cleaned_data/pubmed_output.tables",
+}
+PARQUET_COMPRESSION = "zstd"
+# Rows per chunk when an output file is read back one chunk at a time
+OUTPUT_CHUNK_ROWS = 100_000
+# PMIDs stay strings, years are read as nullable integers so missing ones stay <NA>
+CSV_DTYPES = {"Article PMID": str, "Article Year": YEAR_DTYPE}
+
+# Repeated columns are dictionary encoded, so readers get them back as categoricals
+DICTIONARY_STRING = pa.dictionary(pa.int32(), pa.string())
+OUTPUT_SCHEMA = pa.schema([
+    ("Article PMID", pa.string()),
+    ("Article title", DICTIONARY_STRING),
+    ("Article keywords", pa.list_(pa.string())),
+    ("Article MESH identifiers", pa.list_(pa.string())),
+    ("Article Year", pa.int16()),
+    ("Author full name", pa.string()),
+    ("Author email", pa.string()),
+    ("Affiliation name", DICTIONARY_STRING),
+    ("Affiliation zipcode", pa.string()),
+    ("Country", DICTIONARY_STRING),
+    # gazetteer, ner or unresolved
+    ("Country source", DICTIONARY_STRING),
+    ("Institution GRID name", DICTIONARY_STRING),
+    ("Institution GRID id", DICTIONARY_STRING),
+    ("Match status", pa.bool_()),
+])
+
+
+def processed_output_file(output_format: str = OUTPUT_FORMAT) -> str:
+    """Returns the processed output path for a format."""
+    return PROCESSED_OUTPUT_FILES[output_format]
+
+
+def output_format_of(output_file: str) -> str:
+    """Returns the output format of a path, from its extension."""
+    if output_file.endswith(".tables"):
+        return "normalized"
+    return "parquet" if output_file.endswith(".parquet") else "csv"
+
+
+def temporary_output_file(output_file: str, tag: str) -> str:
+    """Returns a path beside output_file with the same extension, so its format is kept."""
+    base, extension = os.path.splitext(output_file)
+    return f"{base}.{tag}-{os.getpid()}{extension}"
+
+
+def to_arrow_column(values: pd.Series, data_type: pa.DataType) -> pa.Array:
+    """Converts a DataFrame column to an Arrow array of data_type, missing values becoming nulls."""
+    if isinstance(values.dtype, pd.CategoricalDtype) and pa.types.is_dictionary(data_type):
+        # Categories and codes carry over as they are, without a string per row
+        return pa.array(values, from_pandas=True).cast(data_type)
+    if pa.types.is_integer(data_type):
+        # Outputs written before years were integers hold them as strings
+        values = pd.to_numeric(values, errors="coerce").astype("Int64")
+    values = values.astype(object).where(values.notna(), None)
+    if pa.types.is_dictionary(data_type):
+        return pa.array(values, type=data_type.value_type, from_pandas=True).dictionary_encode()
+    if pa.types.is_list(data_type):
+        # Lists read back from Parquet arrive as numpy arrays
+        values = values.map(lambda items: None if items is None else list(items))
+    return pa.array(values, type=data_type, from_pandas=True)
+
+
+def to_arrow_table(pubmed_df: pd.DataFrame) -> pa.Table:
+    """Returns the output DataFrame as an Arrow table with OUTPUT_SCHEMA."""
+    # Outputs written before a column was added are missing it, its values become nulls
+    pubmed_df = pubmed_df.reindex(columns=OUTPUT_SCHEMA.names)
+    return pa.Table.from_arrays(
+        [to_arrow_column(pubmed_df[field.name], field.type) for field in OUTPUT_SCHEMA],
+        schema=OUTPUT_SCHEMA)
+
+
+def write_output(pubmed_df: pd.DataFrame, output_file: str):
+    """Writes the output as normalised tables (.tables), Parquet (.parquet) or CSV."""
+    if output_file.endswith(".tables"):
+        write_normalized(pubmed_df, output_file)
+    elif output_file.endswith(".parquet"):
+        pq.write_table(to_arrow_table(pubmed_df), output_file, compression=PARQUET_COMPRESSION)
+    else:
+        pubmed_df.to_csv(output_file, index=False)
+
+
+class OutputWriter:
+    """Writes the output one chunk at a time: a Parquet row group per chunk, or appended CSV rows.
+
+    sink is a path or a binary file object. Normalised tables need every row at once, so they
+    cannot be written this way.
+    """
+
+    def __init__(self, sink, output_format: str = None):
+        output_format = output_format or output_format_of(sink)
+        if output_format not in ("parquet", "csv"):
+            raise ValueError(f"Chunked output must be parquet or csv, not {output_format}")
+        self.output_format = output_format
+        self.owns_file = isinstance(sink, str)
+        self.file = open(sink, "wb") if self.owns_file else sink  # pylint: disable=consider-using-with
+        self.parquet_writer = None
+        self.header_written = False
+        self.rows = 0
+
+    def write(self, chunk_df: pd.DataFrame):
+        """Appends chunk_df to the output."""
+        if self.output_format == "parquet":
+            if self.parquet_writer is None:
+                self.parquet_writer = pq.ParquetWriter(self.file, OUTPUT_SCHEMA,
+                                                       compression=PARQUET_COMPRESSION)
+            self.parquet_writer.write_table(to_arrow_table(chunk_df))
+        else:
+            # Chunks of an older output line up under the header, missing columns left empty
+            self.file.write(chunk_df.reindex(columns=OUTPUT_SCHEMA.names)
+                            .to_csv(index=False, header=not self.header_written).encode("utf-8"))
+            self.header_written = True
+        self.rows += len(chunk_df)
+
+    def close(self):
+        """Finishes the output, an output without rows is still a valid file with the columns."""
+        if self.output_format == "parquet":
+            if self.parquet_writer is None:
+                self.parquet_writer = pq.ParquetWriter(self.file, OUTPUT_SCHEMA,
+                                                       compression=PARQUET_COMPRESSION)
+            self.parquet_writer.close()
+        elif not self.header_written:
+            self.file.write(pd.DataFrame(columns=OUTPUT_SCHEMA.names).to_csv(index=False)
+                            .encode("utf-8"))
+            self.header_written = True
+        if self.owns_file:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_output(output_file: str, columns: list[str] = None, filters=None) -> pd.DataFrame:
+    """Reads an output file back in the wide layout.
+
+    Parquet only loads the requested columns and matching row groups. Normalised tables are
+    joined back together first, so columns and filters only trim the result.
+    """
+    if output_file.endswith(".tables"):
+        if not os.path.isdir(output_file):
+            raise FileNotFoundError(output_file)
+        # The same column order as the CSV and Parquet outputs
+        wide_df = read_normalized(output_file).reindex(columns=OUTPUT_SCHEMA.names)
+        if filters:
+            wide_df = pd.DataFrame(pa.Table.from_pandas(wide_df, preserve_index=False)
+                                   .filter(pq.filters_to_expression(filters)).to_pandas())
+        return compact_columns(wide_df[columns] if columns else wide_df)
+    if output_file.endswith(".parquet"):
+        return compact_columns(pd.read_parquet(output_file, columns=columns, filters=filters))
+    return compact_columns(pd.read_csv(output_file, usecols=columns, dtype=CSV_DTYPES))
+
+
+def iter_output_chunks(output_file: str, columns: list[str] = None,
+                       chunk_rows: int = OUTPUT_CHUNK_ROWS) -> Iterator:
+    """Yields an output file's columns chunk_rows rows at a time.
+
+    Parquet yields Arrow record batches and CSV yields DataFrames, neither loads the whole file.
+    Normalised tables have to be joined first, so they are read whole and then sliced.
+    """
+    if output_file.endswith(".parquet"):
+        yield from pq.ParquetFile(output_file).iter_batches(batch_size=chunk_rows, columns=columns)
+    elif output_file.endswith(".tables"):
+        output_df = read_output(output_file, columns=columns)
+        for start in range(0, len(output_df), chunk_rows):
+            yield output_df.iloc[start:start + chunk_rows]
+    else:
+        yield from pd.read_csv(output_file, usecols=columns, chunksize=chunk_rows,
+                               dtype=CSV_DTYPES)
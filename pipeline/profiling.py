@@ -0,0 +1,253 @@
+"""Per-stage cProfile stats, sampled call stacks and top allocators for the ETL stages.
+
+With profiling enabled, every run_report.stage runs under its own cProfile profiler, a background
+thread samples the call stack of every thread inside a stage, and the parse and NER stages also
+record the lines that allocated the memory they still hold, with tracemalloc. Each process writes
+its own files into the profile directory:
+    <stage>-<pid>.pstats     cProfile stats of one stage, for pstats, snakeviz or the compare below
+    stacks-<pid>.collapsed   sampled "stage;frame;...;frame count" lines for flamegraph.pl,
+                             inferno or speedscope
+    profile-<pid>.json       profiled seconds, top functions and top allocators of every stage
+Worker processes inherit PROFILE_DIR and write beside the parent. One cProfile profiler runs per
+thread at a time, so a nested stage pauses its parent's and its time is only in its own stats.
+Compare two runs, stage by stage, from the pipeline/ directory:
+    python profiling.py ../profiles/<before> ../profiles/<after> [top]
+"""
+import atexit
+import cProfile
+import glob
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+PROFILES_DIR = "../profiles"
+SAMPLE_INTERVAL = 0.005
+# Stages whose allocations are traced, tracemalloc slows everything it watches
+MEMORY_STAGES = {"xml parse", "ner"}
+TOP_FUNCTIONS = 20
+TOP_ALLOCATORS = 25
+
+
+def default_profile_dir() -> str:
+    """Returns a new directory under PROFILES_DIR named after the current time."""
+    return os.path.join(PROFILES_DIR, time.strftime("%Y-%m-%dT%H%M%S"))
+
+
+def stage_slug(name: str) -> str:
+    """Returns a stage name usable in file names and collapsed stacks."""
+    return name.replace(" ", "_")
+
+
+def frame_label(frame) -> str:
+    """Returns file:function for one frame of a sampled stack."""
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}"
+
+
+def function_label(function: tuple[str, int, str]) -> str:
+    """Returns file:line(function) for a pstats function key."""
+    filename, line, name = function
+    return f"{os.path.basename(filename)}:{line}({name})"
+
+
+def top_functions(stats: pstats.Stats, top: int = TOP_FUNCTIONS) -> list[dict]:
+    """Returns the functions with the most time of their own, with call counts and times."""
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+    return [{"function": function_label(function), "calls": calls,
+             "own_seconds": round(own_seconds, 4),
+             "cumulative_seconds": round(cumulative_seconds, 4)}
+            for function, (_, calls, own_seconds, cumulative_seconds, _) in rows]
+
+
+class StageProfiler:
+    """Profiles every stage entered through run_report.stage, writing the results to output_dir."""
+
+    def __init__(self, output_dir: str, sample_interval: float = SAMPLE_INTERVAL,
+                 memory_stages: set[str] = None):
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.memory_stages = MEMORY_STAGES if memory_stages is None else memory_stages
+        self.lock = threading.Lock()
+        self.reset()
+        # A forked worker starts empty rather than writing its parent's results again
+        os.register_at_fork(after_in_child=self.reset)
+        atexit.register(self.write)
+
+    @classmethod
+    def from_env(cls) -> "StageProfiler | None":
+        """Returns a profiler writing to PROFILE_DIR, or None when it is not set."""
+        output_dir = os.environ.get("PROFILE_DIR")
+        return cls(output_dir) if output_dir else None
+
+    def reset(self):
+        """Forgets everything profiled so far."""
+        # (stage, thread id) -> profiler, as a cProfile profiler follows one thread
+        self.profiles: dict[tuple[str, int], cProfile.Profile] = {}
+        # Thread id -> the stages it is inside, innermost last
+        self.active: dict[int, list[str]] = defaultdict(list)
+        self.stacks = Counter()
+        self.allocations: dict[str, Counter] = defaultdict(Counter)
+        self.tracing_stages = 0
+        self.started_tracing = False
+        self.sampler = None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Profiles the wrapped block as stage name, on the current thread."""
+        thread_id = threading.get_ident()
+        stages = self.active[thread_id]
+        outer = self.profiles[(stages[-1], thread_id)] if stages else None
+        if outer is not None:
+            outer.disable()
+        profile = self.profiles.setdefault((name, thread_id), cProfile.Profile())
+        stages.append(name)
+        self.start_sampler()
+        snapshot = self.start_tracing() if name in self.memory_stages else None
+        enabled = self.enable(profile)
+        try:
+            yield
+        finally:
+            if enabled:
+                profile.disable()
+            if snapshot is not None:
+                self.stop_tracing(name, snapshot)
+            stages.pop()
+            if outer is not None:
+                self.enable(outer)
+
+    @staticmethod
+    def enable(profile: cProfile.Profile) -> bool:
+        """Enables profile, False when Python 3.12+ has a profiler active on another thread."""
+        try:
+            profile.enable()
+        except ValueError:
+            return False
+        return True
+
+    def start_sampler(self):
+        """Starts the stack sampling thread on the first stage of this process."""
+        with self.lock:
+            if self.sampler is None:
+                self.sampler = threading.Thread(target=self.sample, name="stage-sampler",
+                                                daemon=True)
+                self.sampler.start()
+
+    def sample(self):
+        """Counts the call stack of every thread inside a stage, every sample_interval seconds."""
+        while True:
+            time.sleep(self.sample_interval)
+            frames = sys._current_frames()  # pylint: disable=protected-access
+            for thread_id, stages in list(self.active.items()):
+                stages = list(stages)
+                frame = frames.get(thread_id)
+                if not stages or frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_label(frame))
+                    frame = frame.f_back
+                self.stacks[";".join([stage_slug(stages[-1]), *reversed(stack)])] += 1
+
+    def start_tracing(self) -> tracemalloc.Snapshot:
+        """Starts tracemalloc if no stage has, returning a snapshot to compare the end with."""
+        with self.lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracing = True
+            self.tracing_stages += 1
+        return tracemalloc.take_snapshot()
+
+    def stop_tracing(self, name: str, start: tracemalloc.Snapshot):
+        """Adds the bytes each line allocated during the stage and still held at its end."""
+        ignored = [tracemalloc.Filter(False, tracemalloc.__file__),
+                   tracemalloc.Filter(False, __file__)]
+        end = tracemalloc.take_snapshot().filter_traces(ignored)
+        for stat in end.compare_to(start.filter_traces(ignored), "lineno"):
+            if stat.size_diff > 0:
+                frame = stat.traceback[0]
+                self.allocations[name][f"{frame.filename}:{frame.lineno}"] += stat.size_diff
+        with self.lock:
+            self.tracing_stages -= 1
+            if not self.tracing_stages and self.started_tracing:
+                tracemalloc.stop()
+                self.started_tracing = False
+
+    def stage_stats(self) -> dict[str, pstats.Stats]:
+        """Returns each stage's stats, merged over the threads it ran on."""
+        merged = {}
+        for (name, _), profile in list(self.profiles.items()):
+            profile.create_stats()
+            if not profile.stats:
+                continue
+            if name in merged:
+                merged[name].add(profile)
+            else:
+                merged[name] = pstats.Stats(profile)
+        return merged
+
+    def write(self):
+        """Writes every stage's pstats, the sampled stacks and the JSON summary of this process."""
+        stage_stats = self.stage_stats()
+        if not stage_stats and not self.stacks:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        pid = os.getpid()
+        summary = {"pid": pid, "stages": {}}
+        for name, stats in stage_stats.items():
+            stats.dump_stats(os.path.join(self.output_dir, f"{stage_slug(name)}-{pid}.pstats"))
+            summary["stages"][name] = {
+                "profiled_seconds": round(stats.total_tt, 4),
+                "samples": sum(count for stack, count in self.stacks.items()
+                               if stack.split(";", 1)[0] == stage_slug(name)),
+                "top_functions": top_functions(stats),
+                "top_allocators": [{"line": line, "bytes": size} for line, size in
+                                   self.allocations[name].most_common(TOP_ALLOCATORS)],
+            }
+
+        with open(os.path.join(self.output_dir, f"stacks-{pid}.collapsed"), "w",
+                  encoding="utf-8") as file:
+            file.writelines(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+        with open(os.path.join(self.output_dir, f"profile-{pid}.json"), "w",
+                  encoding="utf-8") as file:
+            json.dump(summary, file, indent=2)
+
+
+def load_stage_stats(profile_dir: str) -> dict[str, pstats.Stats]:
+    """Returns each stage's stats in a profile directory, merged over every process."""
+    paths = defaultdict(list)
+    for path in sorted(glob.glob(os.path.join(profile_dir, "*.pstats"))):
+        paths[os.path.basename(path).rsplit("-", 1)[0]].append(path)
+    return {slug: pstats.Stats(*stage_paths) for slug, stage_paths in paths.items()}
+
+
+def compare_profiles(before_dir: str, after_dir: str, top: int = 10) -> str:
+    """Returns a plain text comparison of two runs' profiled time per stage and per function."""
+    before, after = load_stage_stats(before_dir), load_stage_stats(after_dir)
+    lines = []
+    for slug in dict.fromkeys([*before, *after]):
+        before_stats = before[slug].stats if slug in before else {}
+        after_stats = after[slug].stats if slug in after else {}
+        before_total = sum(row[2] for row in before_stats.values())
+        after_total = sum(row[2] for row in after_stats.values())
+        lines.append(f"\n{slug}: {before_total:.3f}s -> {after_total:.3f}s "
+                     f"({after_total - before_total:+.3f}s)")
+        lines.append(f"{'function':<60}{'before s':>10}{'after s':>10}{'delta s':>10}")
+        # The functions whose own time changed the most, in either direction
+        functions = sorted(set(before_stats) | set(after_stats), key=lambda function: -abs(
+            after_stats.get(function, (0, 0, 0))[2] - before_stats.get(function, (0, 0, 0))[2]))
+        for function in functions[:top]:
+            before_seconds = before_stats.get(function, (0, 0, 0))[2]
+            after_seconds = after_stats.get(function, (0, 0, 0))[2]
+            lines.append(f"{function_label(function)[:59]:<60}{before_seconds:>10.3f}"
+                         f"{after_seconds:>10.3f}{after_seconds - before_seconds:>+10.3f}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    print(compare_profiles(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 10))
@@ -0,0 +1,99 @@
+"""Compiles the GRID institutes, GRID aliases and pycountry gazetteer into reference data artifacts.
+
+The GRID names, ids and match index go into a memory-mapped table (see shared_grid.py) that every
+worker process shares, the country data into a small pickle. Building the GridMatcher from the
+CSVs takes a few hundred milliseconds, attaching to the artifacts takes a few milliseconds.
+Run this module to rebuild them:
+    python reference_data.py
+"""
+import os
+import pickle
+from importlib import metadata
+import pandas as pd
+from country_resolver import CountryGazetteer
+from grid_matcher import GridMatcher
+from shared_grid import SharedGridMatcher, read_grid_table_header, write_grid_table
+
+PIPELINE_DIR = os.path.dirname(os.path.abspath(__file__))
+INSTITUTES_PATH = os.path.join(PIPELINE_DIR, "..", "raw_data", "institutes.csv")
+ALIASES_PATH = os.path.join(PIPELINE_DIR, "..", "raw_data", "aliases.csv")
+REFERENCE_DATA_PATH = os.path.join(PIPELINE_DIR, "..", "cache", "reference_data.pickle")
+# Bump whenever the artifact layout or GridMatcher's attributes change
+REFERENCE_DATA_FORMAT = 4
+
+
+def source_fingerprint(institutes_path: str, aliases_path: str) -> dict:
+    """Returns what the artifact was built from, so a stale artifact can be detected."""
+    files = {}
+    for path in (institutes_path, aliases_path):
+        stat = os.stat(path)
+        # A list rather than a tuple, so it compares equal after a JSON round trip
+        files[os.path.basename(path)] = [stat.st_size, stat.st_mtime_ns]
+    return {
+        "format": REFERENCE_DATA_FORMAT,
+        "files": files,
+        "pycountry": metadata.version("pycountry"),
+    }
+
+
+def read_grid_map(institutes_path: str) -> dict[str, str]:
+    """Returns GRID institute name -> GRID id."""
+    grid_df = pd.read_csv(institutes_path)
+    return grid_df.set_index('name').to_dict()['grid_id']
+
+
+def read_alias_map(aliases_path: str) -> dict[str, str]:
+    """Returns GRID alias -> GRID id, keeping the first id of a repeated alias."""
+    alias_df = pd.read_csv(aliases_path)
+    return alias_df.drop_duplicates("alias").set_index('alias').to_dict()['grid_id']
+
+
+def grid_table_path(path: str) -> str:
+    """Returns the GRID table stored alongside the reference data pickle at path."""
+    return os.path.join(os.path.dirname(path), "grid_table.bin")
+
+
+def build_reference_data(institutes_path: str = INSTITUTES_PATH, aliases_path: str = ALIASES_PATH,
+                         output_path: str = REFERENCE_DATA_PATH) -> dict:
+    """Builds the reference data from its sources, writing the GRID table and output_path."""
+    fingerprint = source_fingerprint(institutes_path, aliases_path)
+    grid_matcher = GridMatcher(read_grid_map(institutes_path), aliases=read_alias_map(aliases_path))
+    write_grid_table(grid_matcher, grid_table_path(output_path), fingerprint)
+
+    reference_data = {
+        "fingerprint": fingerprint,
+        "country_gazetteer": CountryGazetteer(),
+    }
+
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Write then rename so a concurrent reader never sees a partial file
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as file:
+        pickle.dump(reference_data, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, output_path)
+
+    return {**reference_data, "grid_matcher": SharedGridMatcher(grid_table_path(output_path))}
+
+
+def load_reference_data(institutes_path: str = INSTITUTES_PATH, aliases_path: str = ALIASES_PATH,
+                        path: str = REFERENCE_DATA_PATH) -> dict:
+    """Loads the reference data, rebuilding it first if the pickle or GRID table is missing or stale."""
+    fingerprint = source_fingerprint(institutes_path, aliases_path)
+    try:
+        with open(path, "rb") as file:
+            reference_data = pickle.load(file)
+        grid_header, _ = read_grid_table_header(grid_table_path(path))
+        if reference_data.get("fingerprint") == grid_header.get("fingerprint") == fingerprint:
+            return {**reference_data, "grid_matcher": SharedGridMatcher(grid_table_path(path))}
+    except (OSError, ValueError, pickle.UnpicklingError, EOFError, AttributeError):
+        pass
+
+    print(f"Rebuilding reference data at {path}")
+    return build_reference_data(institutes_path, aliases_path, path)
+
+
+if __name__ == "__main__":
+    data = build_reference_data()
+    print(f"{REFERENCE_DATA_PATH} built with {len(data['grid_matcher'].grid_map)} GRID names")
@@ -0,0 +1,68 @@
+"""Match statistics and samples accumulated one chunk of enriched rows at a time.
+
+Chunked and streaming runs never hold the whole output, so the match percentage comes from running
+counters and the matched/unmatched samples from reservoir sampling: every row seen has the same
+chance of ending up in a sample, however many chunks there are.
+"""
+import numpy as np
+import pandas as pd
+
+SAMPLE_SIZE = 20
+SAMPLE_SEED = 42
+
+
+class ReservoirSample:
+    """A uniform random sample of at most size rows from every row passed to update (algorithm R)."""
+
+    def __init__(self, size: int = SAMPLE_SIZE, seed: int = SAMPLE_SEED):
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.seen = 0
+        self.sample = pd.DataFrame()
+
+    def update(self, chunk_df: pd.DataFrame):
+        """Offers every row of chunk_df to the sample."""
+        # The first size rows fill the sample
+        fill = min(max(self.size - self.seen, 0), len(chunk_df))
+        if fill:
+            self.append(self.sample, chunk_df.iloc[:fill])
+
+        # Row i of the whole stream then replaces a random slot with probability size / (i + 1)
+        positions = np.arange(fill, len(chunk_df))
+        slots = self.rng.integers(0, self.seen + positions + 1) if len(positions) else positions
+        taken = slots < self.size
+        # A later row taking the same slot wins, as it would one row at a time
+        replaced = dict(zip(slots[taken].tolist(), positions[taken].tolist()))
+        if replaced:
+            kept = [slot for slot in range(len(self.sample)) if slot not in replaced]
+            self.append(self.sample.iloc[kept], chunk_df.iloc[list(replaced.values())])
+        self.seen += len(chunk_df)
+
+    def append(self, kept_df: pd.DataFrame, new_df: pd.DataFrame):
+        """Sets the sample to kept_df's rows followed by new_df's."""
+        self.sample = (new_df.reset_index(drop=True) if kept_df.empty
+                       else pd.concat([kept_df, new_df], ignore_index=True))
+
+
+class MatchStats:
+    """Running matched and total row counts, with matched and unmatched reservoir samples."""
+
+    def __init__(self, size: int = SAMPLE_SIZE, seed: int = SAMPLE_SEED):
+        self.total = 0
+        self.matched = 0
+        self.matched_sample = ReservoirSample(size, seed)
+        self.unmatched_sample = ReservoirSample(size, seed + 1)
+
+    def update(self, chunk_df: pd.DataFrame):
+        """Counts the rows of chunk_df, which needs a Match status column, and samples them."""
+        status = chunk_df["Match status"].astype(bool)
+        self.total += len(chunk_df)
+        self.matched += int(status.sum())
+        self.matched_sample.update(chunk_df[status])
+        self.unmatched_sample.update(chunk_df[~status])
+
+    def match_percentage(self) -> float:
+        """Calculate and print the percentage of matched records."""
+        match_percentage = self.matched / self.total * 100 if self.total else 0.0
+        print(f"Percentage of matched records: {match_percentage:.2f}%")
+        return match_percentage
@@ -0,0 +1,257 @@
+"""Memory-mapped GRID reference table that worker processes attach to without copying it.
+
+The GRID names, ids, exact match index and fuzzy length buckets are written once to a single
+file of flat arrays. Strings are stored as one UTF-8 byte array plus an int64 offsets array.
+Every worker maps the file read-only, so the operating system keeps one copy in its page cache
+however many workers attach. Each process only decodes the strings it actually compares.
+"""
+import bisect
+import json
+import os
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from functools import lru_cache
+import numpy as np
+from grid_matcher import MATCH_TIERS, GridMatcher
+
+# Bump whenever the arrays or header layout change
+GRID_TABLE_FORMAT = 1
+HEADER_SIZE = np.dtype("<u8")
+ARRAY_ALIGNMENT = 8
+EXACT_TIERS = ("exact_name", "exact_alias")
+# Length buckets kept decoded per process for row by row fuzzy matching
+DECODED_BUCKETS = 64
+
+
+class StringArray(Sequence):
+    """Read-only sequence of strings backed by a UTF-8 byte array and an offsets array."""
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = memoryview(data)
+        # A memoryview hands back plain ints, indexing the numpy array would box numpy ints
+        self.offsets = memoryview(offsets)
+
+    @staticmethod
+    def encode(strings: Iterable[str]) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the UTF-8 byte array and offsets array that store strings."""
+        encoded = [string.encode("utf-8") for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(item) for item in encoded], out=offsets[1:])
+        return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(len(self)))]
+        index = int(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("StringArray index out of range")
+        return str(self.data[self.offsets[index]:self.offsets[index + 1]], "utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        data, offsets = self.data, self.offsets
+        for index in range(len(self)):
+            yield str(data[offsets[index]:offsets[index + 1]], "utf-8")
+
+
+class SortedView(Sequence):
+    """The strings of a StringArray in the order given by a permutation, for binary search."""
+
+    def __init__(self, strings: StringArray, order: np.ndarray):
+        self.strings = strings
+        self.order = memoryview(order)
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def __getitem__(self, index) -> str:
+        return self.strings[self.order[index]]
+
+
+class SharedGridMap(Mapping):
+    """GRID name -> GRID id, looked up by binary search over the names in sorted order."""
+
+    def __init__(self, names: StringArray, ids: StringArray, name_order: np.ndarray):
+        self.names = names
+        self.ids = ids
+        self.sorted_names = SortedView(names, name_order)
+
+    def position(self, name: str) -> int | None:
+        """Returns the position of name in the table, or None."""
+        index = bisect.bisect_left(self.sorted_names, name)
+        if index < len(self.sorted_names) and self.sorted_names[index] == name:
+            return self.sorted_names.order[index]
+        return None
+
+    def __getitem__(self, name: str) -> str:
+        position = self.position(name)
+        if position is None:
+            raise KeyError(name)
+        return self.ids[position]
+
+    def __contains__(self, name) -> bool:
+        return isinstance(name, str) and self.position(name) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+class SharedExactIndex(Mapping):
+    """Normalised name or alias -> (tier, (GRID name, GRID id)), as in GridMatcher.exact_index."""
+
+    def __init__(self, keys: StringArray, positions: np.ndarray, tiers: np.ndarray,
+                 names: StringArray, ids: StringArray):
+        self.keys = keys
+        self.positions = memoryview(positions)
+        self.tiers = memoryview(tiers)
+        self.names = names
+        self.ids = ids
+
+    def __getitem__(self, key: str) -> tuple[str, tuple[str, str]]:
+        index = bisect.bisect_left(self.keys, key)
+        if index == len(self.keys) or self.keys[index] != key:
+            raise KeyError(key)
+        position = self.positions[index]
+        return EXACT_TIERS[self.tiers[index]], (self.names[position], self.ids[position])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+
+class SharedBuckets(Mapping):
+    """Name length -> (names, positions in grid_map order), decoded on first use."""
+
+    def __init__(self, names: StringArray, bucket_positions: np.ndarray, bucket_lengths: np.ndarray):
+        self.names = names
+        self.bucket_positions = bucket_positions
+        self.bucket_lengths = bucket_lengths
+        self.decode = lru_cache(maxsize=DECODED_BUCKETS)(self.decode_bucket)
+
+    def decode_bucket(self, length: int) -> tuple[list[str], list[int]] | None:
+        """Returns the names and positions of one length bucket, or None if it is empty."""
+        start, end = np.searchsorted(self.bucket_lengths, [length, length + 1])
+        if start == end:
+            return None
+        positions = self.bucket_positions[start:end].tolist()
+        return [self.names[position] for position in positions], positions
+
+    def __getitem__(self, length: int) -> tuple[list[str], list[int]]:
+        bucket = self.decode(length)
+        if bucket is None:
+            raise KeyError(length)
+        return bucket
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(np.unique(self.bucket_lengths).tolist())
+
+    def __len__(self) -> int:
+        return len(np.unique(self.bucket_lengths))
+
+
+class SharedGridMatcher(GridMatcher):
+    """GridMatcher over a memory-mapped GRID table, matching exactly like the in-memory one."""
+
+    def __init__(self, path: str):  # pylint: disable=super-init-not-called
+        self.path = path
+        self.header, arrays = map_grid_table(path)
+        self.score_cutoff = self.header["score_cutoff"]
+        self.tier_counts = dict.fromkeys(MATCH_TIERS, 0)
+
+        self.names = StringArray(arrays["names_data"], arrays["names_offsets"])
+        ids = StringArray(arrays["ids_data"], arrays["ids_offsets"])
+        self.grid_map = SharedGridMap(self.names, ids, arrays["name_order"])
+        self.exact_index = SharedExactIndex(
+            StringArray(arrays["exact_keys_data"], arrays["exact_keys_offsets"]),
+            arrays["exact_positions"], arrays["exact_tiers"], self.names, ids)
+        self.buckets = SharedBuckets(self.names, arrays["bucket_positions"],
+                                     arrays["bucket_lengths"])
+
+    def __reduce__(self):
+        # Process pools re-attach to the file instead of pickling the table
+        return SharedGridMatcher, (self.path,)
+
+    def scoring_names(self) -> list[str]:
+        """Decodes every name for one cdist call, the list is freed once the call returns."""
+        return list(self.names)
+
+
+def grid_table_arrays(matcher: GridMatcher) -> dict[str, np.ndarray]:
+    """Returns the flat arrays that store matcher's names, ids, exact index and length buckets."""
+    names = matcher.names
+    name_positions = {name: position for position, name in enumerate(names)}
+    arrays = {}
+    arrays["names_data"], arrays["names_offsets"] = StringArray.encode(names)
+    arrays["ids_data"], arrays["ids_offsets"] = StringArray.encode(
+        matcher.grid_map[name] for name in names)
+    arrays["name_order"] = np.array(sorted(range(len(names)), key=names.__getitem__),
+                                    dtype=np.int32)
+
+    exact_keys = sorted(matcher.exact_index)
+    arrays["exact_keys_data"], arrays["exact_keys_offsets"] = StringArray.encode(exact_keys)
+    arrays["exact_positions"] = np.array(
+        [name_positions[matcher.exact_index[key][1][0]] for key in exact_keys], dtype=np.int32)
+    arrays["exact_tiers"] = np.array(
+        [EXACT_TIERS.index(matcher.exact_index[key][0]) for key in exact_keys], dtype=np.int8)
+
+    lengths = np.array([len(name) for name in names], dtype=np.int32)
+    # Stable, so each bucket keeps grid_map order and fuzzy ties resolve as before
+    arrays["bucket_positions"] = np.argsort(lengths, kind="stable").astype(np.int32)
+    arrays["bucket_lengths"] = lengths[arrays["bucket_positions"]]
+    return arrays
+
+
+def write_grid_table(matcher: GridMatcher, path: str, fingerprint: dict = None) -> str:
+    """Writes matcher's table to path: a header length, a JSON header, then aligned arrays."""
+    arrays = grid_table_arrays(matcher)
+    header = {"format": GRID_TABLE_FORMAT, "fingerprint": fingerprint,
+              "score_cutoff": matcher.score_cutoff, "arrays": {}}
+    offset = 0
+    for name, array in arrays.items():
+        header["arrays"][name] = [array.dtype.str, offset, len(array)]
+        offset += -(-array.nbytes // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+    header_bytes = json.dumps(header).encode("utf-8")
+    header_bytes += b" " * (-(HEADER_SIZE.itemsize + len(header_bytes)) % ARRAY_ALIGNMENT)
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Write then rename, workers still mapping the old file keep reading it safely
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(np.array(len(header_bytes), dtype=HEADER_SIZE).tobytes())
+        file.write(header_bytes)
+        for array in arrays.values():
+            file.write(array.tobytes())
+            file.write(b"\0" * (-array.nbytes % ARRAY_ALIGNMENT))
+    os.replace(temp_path, path)
+    return path
+
+
+def read_grid_table_header(path: str) -> tuple[dict, int]:
+    """Returns the JSON header of a GRID table file and the offset where its arrays start."""
+    with open(path, "rb") as file:
+        header_length = int(np.frombuffer(file.read(HEADER_SIZE.itemsize), dtype=HEADER_SIZE)[0])
+        return json.loads(file.read(header_length)), HEADER_SIZE.itemsize + header_length
+
+
+def map_grid_table(path: str) -> tuple[dict, dict[str, np.ndarray]]:
+    """Maps a GRID table file read-only and returns its header and zero-copy array views."""
+    header, start = read_grid_table_header(path)
+    if header.get("format") != GRID_TABLE_FORMAT:
+        raise ValueError(f"{path} has GRID table format {header.get('format')}, "
+                         f"expected {GRID_TABLE_FORMAT}")
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    arrays = {}
+    for name, (dtype, offset, count) in header["arrays"].items():
+        dtype = np.dtype(dtype)
+        arrays[name] = buffer[start + offset:start + offset + count * dtype.itemsize].view(dtype)
+    return header, arrays
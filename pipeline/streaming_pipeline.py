@@ -0,0 +1,244 @@
+"""Streaming ETL mode: download -> parse -> enrich -> upload, with bounded queues between stages.
+
+Each file is parsed as soon as its download finishes, each parsed chunk is enriched as soon as it
+is parsed, and enriched chunks are written straight into a multipart S3 upload. Blocking work
+runs in executors, so the stages overlap and a run takes about as long as its slowest stage
+rather than the sum of all of them. At most QUEUE_SIZE items wait between two stages, so memory
+stays flat however many files there are. Files are downloaded into a temporary directory and
+deleted once parsed, so disk use stays flat too.
+
+A streaming run rebuilds the output from every input file, it does not merge new articles into an
+earlier output like incremental runs do. Output is Parquet or CSV, normalised tables need the
+whole dataset at once. Run from the pipeline/ directory:
+    python streaming_pipeline.py
+"""
+import asyncio
+import io
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from dotenv import load_dotenv
+import transform
+from executors import create_executor
+from extract import (DOWNLOAD_WORKERS, INPUT_BUCKET, INPUT_PREFIX, MB, RAW_DATA_DIR,
+                     connect_to_s3, download_pubmed_object, list_pubmed_objects)
+from instrumentation import run_report
+from load import OUTPUT_BUCKET, output_key
+from output_store import OUTPUT_FORMAT, OutputWriter, processed_output_file
+from running_stats import MatchStats
+
+QUEUE_SIZE = 4
+# S3 needs every part but the last to be at least 5 MB
+UPLOAD_PART_SIZE = 16 * MB
+# Marks the end of a queue
+DONE = None
+
+
+class UploadBuffer(io.RawIOBase):
+    """Write-only sink for the Parquet or CSV writer, handing over the bytes written so far."""
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        # The Parquet writer records offsets from here, so it counts every byte ever written
+        return self.position
+
+    def drain(self) -> bytes:
+        """Returns and forgets the bytes written since the last drain."""
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+class ChunkEncoder:
+    """Encodes enriched chunks into one Parquet file (a row group per chunk) or one CSV file."""
+
+    def __init__(self, output_format: str = OUTPUT_FORMAT):
+        if output_format not in ("parquet", "csv"):
+            raise ValueError(f"Streaming output must be parquet or csv, not {output_format}")
+        self.buffer = UploadBuffer()
+        self.writer = OutputWriter(self.buffer, output_format)
+
+    def encode(self, chunk_df: pd.DataFrame) -> bytes:
+        """Returns the bytes that chunk_df adds to the output."""
+        self.writer.write(chunk_df)
+        return self.buffer.drain()
+
+    def close(self) -> bytes:
+        """Returns the bytes that end the output, e.g. the Parquet footer."""
+        self.writer.close()
+        return self.buffer.drain()
+
+
+def parse_next_chunk(chunks_iterator) -> pd.DataFrame | None:
+    """Parses the next chunk of a file, or returns None at the end of the file."""
+    with run_report.stage("xml parse", log=False) as metrics:
+        chunk_df = next(chunks_iterator, None)
+        metrics.rows_out += 0 if chunk_df is None else len(chunk_df)
+    return chunk_df
+
+
+def enrich_chunk(chunk_df: pd.DataFrame, ner_cache, match_cache, grid_executor) -> pd.DataFrame:
+    """Enriches one parsed chunk and returns it with the output columns only."""
+    transform.enrich_affiliations(chunk_df, ner_cache=ner_cache,
+                                  batch_size=transform.NER_BATCH_SIZE,
+                                  n_process=transform.NER_PROCESSES, match_cache=match_cache,
+                                  grid_executor=grid_executor)
+    chunk_df["Match status"] = chunk_df["Institution GRID id"].notna()
+    return chunk_df.drop(columns=transform.HELPER_COLUMNS)
+
+
+async def download_stage(s3, bucket_name: str, s3_objects: list[dict], local_dir: str,
+                         paths: asyncio.Queue, workers: int = DOWNLOAD_WORKERS):
+    """Downloads up to workers files at once, queuing each path in listing order as it completes."""
+    in_flight = deque()
+    try:
+        for s3_object in s3_objects:
+            if len(in_flight) == workers:
+                await paths.put(await in_flight.popleft())
+            in_flight.append(asyncio.create_task(asyncio.to_thread(
+                download_pubmed_object, s3, bucket_name, s3_object, local_dir)))
+        while in_flight:
+            await paths.put(await in_flight.popleft())
+    finally:
+        # The download tasks are not in the TaskGroup, so they are stopped here when a stage fails
+        for task in in_flight:
+            task.cancel()
+    await paths.put(DONE)
+
+
+async def parse_stage(paths: asyncio.Queue, chunks: asyncio.Queue, executor: ThreadPoolExecutor):
+    """Parses each downloaded file into chunks as soon as it arrives, deleting it once parsed."""
+    loop = asyncio.get_running_loop()
+    while (path := await paths.get()) is not DONE:
+        chunks_iterator = transform.iter_pubmed_chunks(path)
+        while (chunk_df := await loop.run_in_executor(
+                executor, parse_next_chunk, chunks_iterator)) is not None:
+            await chunks.put(chunk_df)
+        os.remove(path)
+    await chunks.put(DONE)
+
+
+async def enrich_stage(chunks: asyncio.Queue, enriched: asyncio.Queue,
+                       executor: ThreadPoolExecutor, stats: MatchStats):
+    """Enriches each parsed chunk, on one thread since the cache connections belong to it."""
+    loop = asyncio.get_running_loop()
+    ner_cache = await loop.run_in_executor(executor, transform.open_ner_cache)
+    match_cache = await loop.run_in_executor(executor, transform.open_match_cache)
+    # One GRID matching pool for every chunk, its workers load the reference data once
+    grid_executor = create_executor(initializer=transform.get_reference_data)
+    try:
+        while (chunk_df := await chunks.get()) is not DONE:
+            chunk_df = await loop.run_in_executor(
+                executor, enrich_chunk, chunk_df, ner_cache, match_cache, grid_executor)
+            stats.update(chunk_df)
+            await enriched.put(chunk_df)
+        # stats counts the stored entries, so it runs on the thread that owns the connection
+        print(f"GRID match cache: {await loop.run_in_executor(executor, match_cache.stats)}")
+    finally:
+        await loop.run_in_executor(executor, grid_executor.shutdown)
+        await loop.run_in_executor(executor, ner_cache.close)
+        await loop.run_in_executor(executor, match_cache.close)
+    await enriched.put(DONE)
+
+
+async def upload_stage(s3, bucket_name: str, key: str, enriched: asyncio.Queue,
+                       executor: ThreadPoolExecutor, output_format: str = OUTPUT_FORMAT,
+                       part_size: int = UPLOAD_PART_SIZE) -> int:
+    """Encodes each enriched chunk and uploads the output in part_size parts, returning the rows."""
+    loop = asyncio.get_running_loop()
+    encoder = ChunkEncoder(output_format)
+    upload_id = (await asyncio.to_thread(
+        s3.create_multipart_upload, Bucket=bucket_name, Key=key))["UploadId"]
+    parts = []
+    pending = bytearray()
+    rows = 0
+
+    async def upload_part(data: bytes):
+        with run_report.stage("upload", log=False):
+            response = await asyncio.to_thread(
+                s3.upload_part, Bucket=bucket_name, Key=key, UploadId=upload_id,
+                PartNumber=len(parts) + 1, Body=data)
+        parts.append({"PartNumber": len(parts) + 1, "ETag": response["ETag"]})
+
+    try:
+        while (chunk_df := await enriched.get()) is not DONE:
+            pending += await loop.run_in_executor(executor, encoder.encode, chunk_df)
+            rows += len(chunk_df)
+            while len(pending) >= part_size:
+                await upload_part(bytes(pending[:part_size]))
+                del pending[:part_size]
+
+        pending += await loop.run_in_executor(executor, encoder.close)
+        # The last part may be smaller than 5 MB, and an upload needs at least one part
+        if pending or not parts:
+            await upload_part(bytes(pending))
+        await asyncio.to_thread(s3.complete_multipart_upload, Bucket=bucket_name, Key=key,
+                                UploadId=upload_id, MultipartUpload={"Parts": parts})
+    except BaseException:
+        await asyncio.to_thread(s3.abort_multipart_upload, Bucket=bucket_name, Key=key,
+                                UploadId=upload_id)
+        raise
+
+    print(f"{rows} rows uploaded to s3://{bucket_name}/{key} in {len(parts)} parts")
+    return rows
+
+
+async def run_streaming_pipeline(s3, input_bucket: str = INPUT_BUCKET,
+                                 input_prefix: str = INPUT_PREFIX,
+                                 output_bucket: str = OUTPUT_BUCKET,
+                                 output_format: str = OUTPUT_FORMAT,
+                                 local_dir: str = RAW_DATA_DIR) -> int:
+    """Streams every input XML file through the pipeline into one uploaded output, returning its rows."""
+    s3_objects = list_pubmed_objects(s3, input_bucket, input_prefix, ".xml")
+    key = output_key(processed_output_file(output_format))
+    print(f"Streaming {len(s3_objects)} files to s3://{output_bucket}/{key}")
+    # Build the reference data before the stages start racing to load it
+    await asyncio.to_thread(transform.get_reference_data)
+
+    paths = asyncio.Queue(maxsize=QUEUE_SIZE)
+    chunks = asyncio.Queue(maxsize=QUEUE_SIZE)
+    enriched = asyncio.Queue(maxsize=QUEUE_SIZE)
+    stats = MatchStats()
+    os.makedirs(local_dir, exist_ok=True)
+    # Stage wall times are busy times and overlap, CPU times are process wide and so overcount
+    # One thread per CPU stage, so they overlap but each keeps its own state on one thread
+    # A directory of its own, so deleting parsed files never touches raw files kept in local_dir
+    with tempfile.TemporaryDirectory(prefix="streaming-", dir=local_dir,
+                                     ignore_cleanup_errors=True) as download_dir, \
+            ThreadPoolExecutor(1) as parse_executor, ThreadPoolExecutor(1) as enrich_executor, \
+            ThreadPoolExecutor(1) as encode_executor:
+        async with asyncio.TaskGroup() as task_group:
+            task_group.create_task(download_stage(s3, input_bucket, s3_objects, download_dir,
+                                                  paths))
+            task_group.create_task(parse_stage(paths, chunks, parse_executor))
+            task_group.create_task(enrich_stage(chunks, enriched, enrich_executor, stats))
+            upload = task_group.create_task(upload_stage(
+                s3, output_bucket, key, enriched, encode_executor, output_format))
+
+    stats.match_percentage()
+    transform.save_samples(stats.matched_sample.sample, stats.unmatched_sample.sample)
+    return upload.result()
+
+
+def main_streaming(output_format: str = OUTPUT_FORMAT) -> int:
+    """Connects to S3 and runs the streaming pipeline."""
+    return asyncio.run(run_streaming_pipeline(connect_to_s3(), output_format=output_format))
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    main_streaming()
@@ -0,0 +1,172 @@
+"""Top keywords, MeSH terms and institutions per country or year, counted over integer term ids.
+
+Each chunk of the output is flattened into (row, term code) arrays, its distinct terms are mapped
+to ids from a vocabulary that grows across chunks, and the (group id, term id) pairs are counted
+as packed int64 keys. Only the distinct pairs are kept between chunks, so an output of any size
+can be streamed through a TermCounter chunk by chunk. Parquet is read as Arrow record batches,
+whose list columns flatten without building a Python list per row.
+
+Counts are per output row, like the original top_keywords_by_country: an article's keywords
+count once for every affiliation row in a country. Run from the pipeline/ directory:
+    python term_aggregation.py [output_file] [k]
+"""
+import ast
+import sys
+from collections.abc import Iterable
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from output_store import OUTPUT_CHUNK_ROWS, OUTPUT_SCHEMA, iter_output_chunks, processed_output_file
+
+TOP_K = 5
+GROUP_COLUMNS = ["Country", "Article Year"]
+TERM_COLUMNS = ["Article keywords", "Article MESH identifiers", "Institution GRID name"]
+LIST_COLUMNS = {field.name for field in OUTPUT_SCHEMA if pa.types.is_list(field.type)}
+# Pair keys pack the group id above the term id
+TERM_ID_BITS = 32
+
+
+def parse_terms(terms) -> list:
+    """Returns a list column value as a list: CSV stores lists as their Python repr."""
+    if isinstance(terms, str):
+        try:
+            terms = ast.literal_eval(terms)
+        except (ValueError, SyntaxError):
+            terms = terms.strip("[]").replace("'", "").split(", ")
+        return terms if isinstance(terms, list) else []
+    if isinstance(terms, (list, np.ndarray)):
+        # List columns read back from Parquet arrive as numpy arrays
+        return list(terms)
+    return []
+
+
+def column_codes(values: pd.Series | pa.Array | pa.ChunkedArray,
+                 is_list: bool) -> tuple[np.ndarray, np.ndarray, list]:
+    """Returns the row and chunk local code of every term in a column, and the distinct terms.
+
+    Missing values get code -1. A scalar column has exactly one term per row.
+    """
+    if isinstance(values, pd.Series):
+        if not is_list:
+            codes, uniques = pd.factorize(values)
+            return np.arange(len(values)), codes, list(uniques)
+        if pd.api.types.infer_dtype(values, skipna=True) == "string":
+            values = values.map(parse_terms)
+        # Arrow converts the lists in C, then they flatten like a Parquet column
+        values = pa.array(values, type=pa.list_(pa.string()), from_pandas=True)
+
+    if isinstance(values, pa.ChunkedArray):
+        values = values.combine_chunks()
+    rows = np.arange(len(values))
+    if is_list:
+        rows = pc.list_parent_indices(values).to_numpy()
+        values = pc.list_flatten(values)
+    if not pa.types.is_dictionary(values.type):
+        values = values.dictionary_encode()
+    codes = values.indices.fill_null(-1).to_numpy(zero_copy_only=False).astype(np.int64)
+    return rows, codes, values.dictionary.to_pylist()
+
+
+class TermCounter:
+    """Counts term_column values per group_column value over any number of output chunks."""
+
+    def __init__(self, group_column: str = "Country", term_column: str = "Article keywords"):
+        self.group_column = group_column
+        self.term_column = term_column
+        self.group_ids = {}
+        self.term_ids = {}
+        self.keys = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+
+    @staticmethod
+    def vocabulary_ids(vocabulary: dict, values: list) -> np.ndarray:
+        """Returns the id of each distinct chunk value, adding new ones, with -1 for empty values."""
+        return np.array([-1 if value is None or value == "" else
+                         vocabulary.setdefault(str(value), len(vocabulary))
+                         for value in values], dtype=np.int64)
+
+    def update(self, chunk: pd.DataFrame | pa.RecordBatch | pa.Table):
+        """Adds the (group, term) pairs of one output chunk to the counts."""
+        _, group_codes, group_values = column_codes(chunk[self.group_column], is_list=False)
+        term_rows, term_codes, term_values = column_codes(
+            chunk[self.term_column], is_list=self.term_column in LIST_COLUMNS)
+
+        # Look up the few distinct values in Python, then map every code through numpy
+        group_ids = np.append(self.vocabulary_ids(self.group_ids, group_values), -1)
+        term_ids = np.append(self.vocabulary_ids(self.term_ids, term_values), -1)
+        groups = group_ids[group_codes[term_rows]]
+        terms = term_ids[term_codes]
+        keep = (groups >= 0) & (terms >= 0)
+
+        keys, counts = np.unique((groups[keep] << TERM_ID_BITS) | terms[keep], return_counts=True)
+        self.merge(keys, counts)
+
+    def merge(self, keys: np.ndarray, counts: np.ndarray):
+        """Adds counts for packed (group, term) keys to the running totals."""
+        self.keys, positions = np.unique(np.concatenate([self.keys, keys]), return_inverse=True)
+        self.counts = np.bincount(positions, weights=np.concatenate([self.counts, counts]),
+                                  minlength=len(self.keys)).astype(np.int64)
+
+    def top_k(self, k: int = TOP_K) -> pd.DataFrame:
+        """Returns the k most frequent terms per group, ties broken alphabetically."""
+        group_names = np.array(list(self.group_ids), dtype=object)
+        term_names = np.array(list(self.term_ids), dtype=object)
+        groups = self.keys >> TERM_ID_BITS
+        terms = self.keys & ((1 << TERM_ID_BITS) - 1)
+
+        order = np.lexsort((alphabetical_ranks(term_names)[terms], -self.counts,
+                            alphabetical_ranks(group_names)[groups]))
+        groups, terms, counts = groups[order], terms[order], self.counts[order]
+        # Position within the group: distance from the group's first row in sorted order
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        ranks = np.arange(len(groups)) - np.repeat(starts, np.diff(np.r_[starts, len(groups)]))
+        keep = ranks < k
+
+        return pd.DataFrame({
+            self.group_column: group_names[groups[keep]],
+            self.term_column: term_names[terms[keep]],
+            "count": counts[keep],
+            "rank": ranks[keep] + 1,
+        })
+
+
+def alphabetical_ranks(names: np.ndarray) -> np.ndarray:
+    """Returns each name's position in sorted order."""
+    ranks = np.empty(len(names), dtype=np.int64)
+    ranks[np.argsort(names, kind="stable")] = np.arange(len(names))
+    return ranks
+
+
+def top_terms(chunks: Iterable, group_columns: list[str] = None, term_columns: list[str] = None,
+              k: int = TOP_K) -> pd.DataFrame:
+    """Returns the top k terms of each term column per value of each group column, in one pass.
+
+    One row per (group column, group, term column, term), ranked from 1 within its group.
+    """
+    counters = [TermCounter(group_column, term_column)
+                for group_column in group_columns or GROUP_COLUMNS
+                for term_column in term_columns or TERM_COLUMNS]
+    for chunk in chunks:
+        for counter in counters:
+            counter.update(chunk)
+
+    frames = [counter.top_k(k).set_axis(["group", "term", "count", "rank"], axis=1)
+              .assign(group_column=counter.group_column, term_column=counter.term_column)
+              for counter in counters]
+    return pd.concat(frames, ignore_index=True)[
+        ["group_column", "group", "term_column", "term", "count", "rank"]]
+
+
+def top_terms_in_output(output_file: str = None, k: int = TOP_K,
+                        chunk_rows: int = OUTPUT_CHUNK_ROWS) -> pd.DataFrame:
+    """Streams the processed output file through top_terms."""
+    output_file = output_file or processed_output_file()
+    return top_terms(iter_output_chunks(output_file, GROUP_COLUMNS + TERM_COLUMNS, chunk_rows), k=k)
+
+
+if __name__ == "__main__":
+    pd.set_option("display.max_rows", None)
+    pd.set_option("display.width", 200)
+    print(top_terms_in_output(sys.argv[1] if len(sys.argv) > 1 else None,
+                              int(sys.argv[2]) if len(sys.argv) > 2 else TOP_K))
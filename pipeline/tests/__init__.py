@@ -0,0 +1 @@
+"""Tests for the ETL pipeline, run from the pipeline/ directory with `python -m pytest tests`."""
@@ -0,0 +1,123 @@
+"""Tests the extract stage against S3 mocked with moto."""
+import pytest
+from boto3 import client
+from boto3.s3.transfer import TransferConfig
+from moto import mock_aws
+import extract
+from manifest import ProcessedManifest
+
+BUCKET = "pubmed-test-input"
+# S3 parts other than the last must be at least 5 MB
+PART_SIZE = 5 * extract.MB
+
+
+@pytest.fixture(name="s3")
+def s3_client(monkeypatch):
+    """Yields a client for a mocked S3 holding an empty BUCKET."""
+    monkeypatch.setenv("ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        s3 = client("s3")
+        s3.create_bucket(Bucket=BUCKET)
+        yield s3
+
+
+@pytest.fixture(name="manifest")
+def processed_manifest(tmp_path):
+    """Yields an empty manifest in a temporary directory."""
+    manifest = ProcessedManifest(str(tmp_path / "manifest.sqlite"))
+    yield manifest
+    manifest.close()
+
+
+def listed_object(s3, key: str) -> dict:
+    """Returns the listing entry of one object, as the extract stage sees it."""
+    return next(s3_object for s3_object in extract.list_pubmed_objects(s3, BUCKET, key, "")
+                if s3_object["Key"] == key)
+
+
+def test_listing_paginates_past_1000_keys(s3):
+    for index in range(1005):
+        s3.put_object(Bucket=BUCKET, Key=f"c14-gem-lo-{index:04}.xml", Body=b"<x/>")
+    s3.put_object(Bucket=BUCKET, Key="c14-gem-lo-notes.txt", Body=b"")
+    s3.put_object(Bucket=BUCKET, Key="other-0000.xml", Body=b"<x/>")
+
+    keys = [s3_object["Key"]
+            for s3_object in extract.list_pubmed_objects(s3, BUCKET, "c14-gem-lo", ".xml")]
+
+    assert len(keys) == 1005
+    assert len(set(keys)) == 1005
+
+
+def test_unchanged_objects_are_skipped_by_etag_and_size(s3, manifest):
+    for key in ("c14-gem-lo-a.xml", "c14-gem-lo-b.xml", "c14-gem-lo-c.xml"):
+        s3.put_object(Bucket=BUCKET, Key=key, Body=b"<PubmedArticleSet/>")
+    first_run = extract.select_unprocessed(
+        BUCKET, extract.list_pubmed_objects(s3, BUCKET, "c14-gem-lo", ".xml"), manifest)
+    manifest.commit()
+    assert len(first_run) == 3
+
+    # New content of the same size changes only the ETag, other content changes both
+    s3.put_object(Bucket=BUCKET, Key="c14-gem-lo-b.xml", Body=b"<PubmedArticleSex/>")
+    s3.put_object(Bucket=BUCKET, Key="c14-gem-lo-c.xml",
+                  Body=b"<PubmedArticleSet></PubmedArticleSet>")
+    s3.put_object(Bucket=BUCKET, Key="c14-gem-lo-d.xml", Body=b"<PubmedArticleSet/>")
+    second_run = extract.select_unprocessed(
+        BUCKET, extract.list_pubmed_objects(s3, BUCKET, "c14-gem-lo", ".xml"), manifest)
+
+    assert [s3_object["Key"] for s3_object in second_run] == [
+        "c14-gem-lo-b.xml", "c14-gem-lo-c.xml", "c14-gem-lo-d.xml"]
+
+
+def test_single_part_local_copy_is_compared_by_etag(s3, tmp_path, capsys):
+    content = b"<PubmedArticleSet/>" * 1000
+    s3.put_object(Bucket=BUCKET, Key="c14-gem-lo-a.xml", Body=content)
+    s3_object = listed_object(s3, "c14-gem-lo-a.xml")
+    local_path = tmp_path / "c14-gem-lo-a.xml"
+    local_path.write_bytes(content)
+
+    # Hashed in pieces smaller than the file, the ETag is still the MD5 of the whole of it
+    assert extract.local_etag(str(local_path), 1, 1000) == s3_object["ETag"]
+    assert extract.download_pubmed_object(s3, BUCKET, s3_object, str(tmp_path)) == str(local_path)
+    assert "already up to date" in capsys.readouterr().out
+
+    local_path.write_bytes(content.replace(b"Set", b"Sex", 1))
+    assert not extract.is_local_copy_current(str(local_path), s3_object)
+    extract.download_pubmed_object(s3, BUCKET, s3_object, str(tmp_path))
+    assert local_path.read_bytes() == content
+
+
+def test_multipart_local_copy_is_compared_by_etag(s3, tmp_path):
+    source_path = tmp_path / "upload.xml"
+    source_path.write_bytes(bytes(range(256)) * (PART_SIZE * 2 // 256 + 100))
+    s3.upload_file(str(source_path), BUCKET, "c14-gem-lo-big.xml",
+                   Config=TransferConfig(multipart_threshold=PART_SIZE,
+                                         multipart_chunksize=PART_SIZE))
+    s3_object = listed_object(s3, "c14-gem-lo-big.xml")
+    assert s3_object["ETag"].endswith('-3"')
+
+    assert extract.is_local_copy_current(str(source_path), s3_object, chunk_size=PART_SIZE)
+    # Another part size gives another ETag, so the object is downloaded again
+    assert not extract.is_local_copy_current(str(source_path), s3_object,
+                                             chunk_size=PART_SIZE * 2)
+
+    with open(source_path, "r+b") as file:
+        file.seek(PART_SIZE + 1)
+        file.write(b"\0")
+    assert not extract.is_local_copy_current(str(source_path), s3_object, chunk_size=PART_SIZE)
+
+
+def test_stream_yields_object_bodies_without_saving_them(s3, manifest, monkeypatch, tmp_path):
+    monkeypatch.setattr(extract, "INPUT_BUCKET", BUCKET)
+    monkeypatch.setattr(extract, "RAW_DATA_DIR", str(tmp_path / "raw_data"))
+    contents = {"c14-gem-lo-a.xml": b"<PubmedArticleSet>a</PubmedArticleSet>",
+                "c14-gem-lo-b.xml": b"<PubmedArticleSet>b</PubmedArticleSet>"}
+    for key, content in contents.items():
+        s3.put_object(Bucket=BUCKET, Key=key, Body=content)
+
+    bodies = extract.main_extract(manifest, stream=True)
+
+    assert [body.read() for body in bodies] == list(contents.values())
+    assert not (tmp_path / "raw_data").exists()
+    assert sorted(manifest.pending_sources) == [f"s3://{BUCKET}/{key}" for key in contents]
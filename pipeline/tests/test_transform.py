@@ -0,0 +1,40 @@
+"""Tests the incremental parse of the transform stage."""
+import pytest
+import transform
+from manifest import ProcessedManifest
+
+SAMPLE_XML = "../raw_data/c14-gem-lo-pubmed.xml"
+
+
+@pytest.fixture(name="manifest")
+def processed_manifest(tmp_path):
+    """Yields an empty manifest in a temporary directory."""
+    manifest = ProcessedManifest(str(tmp_path / "manifest.sqlite"))
+    yield manifest
+    manifest.close()
+
+
+def emitted_pmids(file_path: str, manifest: ProcessedManifest) -> set[str]:
+    """Returns the PMIDs iter_pubmed_chunks emits for a file, then commits the manifest."""
+    pmids = {pmid for chunk in transform.iter_pubmed_chunks(file_path, manifest=manifest)
+             if not chunk.empty for pmid in chunk["Article PMID"]}
+    manifest.commit()
+    return pmids
+
+
+def test_only_the_changed_article_is_processed_again(tmp_path, manifest):
+    with open(SAMPLE_XML, encoding="utf-8") as file:
+        xml = file.read()
+    pubmed_file = tmp_path / "pubmed.xml"
+    pubmed_file.write_text(xml, encoding="utf-8")
+    first_pmids = emitted_pmids(str(pubmed_file), manifest)
+    assert emitted_pmids(str(pubmed_file), manifest) == set()
+
+    # A longer title moves every later article to a different offset in the file
+    title = "<ArticleTitle>Clinical ultrasonography in systemic autoimmune diseases.</ArticleTitle>"
+    assert xml.count(title) == 1
+    pubmed_file.write_text(xml.replace(title, title.replace("Clinical", "Clinical " * 500)),
+                           encoding="utf-8")
+    changed_pmids = emitted_pmids(str(pubmed_file), manifest)
+    assert len(changed_pmids) == 1
+    assert changed_pmids < first_pmids
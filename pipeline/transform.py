@@ -1,32 +1,119 @@
 # pylint: disable=R1705
 # pylint: disable=W0612
-"""Process PubMed XML file to extract article metadata, author information, and create a structured DataFrame for analysis."""
-import re
+"""Process PubMed XML file to extract article metadata, author information, and create a structured DataFrame for analysis.
+
+Run from the pipeline/ directory, --profile writes per-stage profiles (see profiling.py):
+    python transform.py [--profile [DIR]]
+"""
+import argparse
+import copy
+import os
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Executor
+from functools import cache as cached
+from typing import NamedTuple
 import pandas as pd
-import spacy
-import pycountry
 import xml.etree.ElementTree as ET
-from rapidfuzz import process
-from rapidfuzz.distance import Levenshtein
-from pandarallel import pandarallel
-
-
-pandarallel.initialize(progress_bar=True)
-cache = {}
-nlp = spacy.load("en_core_web_sm")
-
-grid_df = pd.read_csv("../raw_data/institutes.csv")
-grid_map = grid_df.set_index('name').to_dict()['grid_id']
+from affiliation_fields import EMAIL_REGEX, ZIPCODE_REGEX, extract_affiliation_fields
+from cache_store import SQLiteCache, normalise_text
+from compact_columns import as_text, compact_columns, concat_compact, intern_text, parse_year
+from country_resolver import CountryGazetteer
+from executors import EXECUTOR_BACKEND, create_executor, default_workers, map_in_chunks
+from grid_matcher import MATCH_TIERS, GridMatcher
+from instrumentation import run_report
+from manifest import ProcessedManifest, content_hash, local_source
+from match_cache import MatchCache, match_cache_version
+from output_store import (OutputWriter, iter_output_chunks, output_format_of,
+                          processed_output_file, read_output, temporary_output_file,
+                          write_output)
+from profiling import default_profile_dir
+from reference_data import load_reference_data
+from running_stats import MatchStats
+from term_aggregation import TermCounter
+
+
+NER_LABELS = {"GPE", "ORG"}
+# Affiliations per nlp.pipe batch and NER worker processes, for every enrichment path
+NER_BATCH_SIZE = int(os.environ.get("NER_BATCH_SIZE", "256"))
+NER_PROCESSES = int(os.environ.get("NER_PROCESSES", "1"))
+NER_CACHE_PATH = "../cache/ner_cache.sqlite"
+NER_CACHE_MAX_ENTRIES = 500_000
+MATCH_CACHE_PATH = "../cache/match_cache.sqlite"
+
+
+def load_ner_model(model_name: str):
+    """Loads a spaCy model with every component that NER does not depend on disabled."""
+    # spaCy takes seconds to import, so only pay for it when NER actually runs
+    import spacy  # pylint: disable=import-outside-toplevel
+
+    model = spacy.load(model_name)
+    needed = {"ner"}
+    for name, component in model.pipeline:
+        # Keep shared tok2vec layers only if the NER component listens to them
+        if "ner" in getattr(component, "listening_components", []):
+            needed.add(name)
+    model.select_pipes(
+        enable=[name for name in model.pipe_names if name in needed])
+    return model
+
+
+# Reference data is loaded on first use, so importing this module stays cheap
+
+
+@cached
+def get_nlp():
+    """Returns the shared NER model, loading it on first use."""
+    return load_ner_model("en_core_web_sm")
+
+
+@cached
+def get_reference_data() -> dict:
+    """Returns the compiled GRID and country reference data, loading it on first use."""
+    return load_reference_data()
+
+
+def get_grid_matcher() -> GridMatcher:
+    """Returns the shared GRID matcher."""
+    return get_reference_data()["grid_matcher"]
+
+
+def get_country_gazetteer() -> CountryGazetteer:
+    """Returns the shared country gazetteer."""
+    return get_reference_data()["country_gazetteer"]
+
+
+PUBMED_COLUMNS = [
+    "Article PMID", "Article title", "Article keywords",
+    "Article MESH identifiers", "Article Year", "Author full name",
+    "Author email", "Affiliation name", "Affiliation zipcode"
+]
+# Working columns added by enrich_affiliations that are not part of the output
+HELPER_COLUMNS = ["Institution name", "Entities"]
+CHUNK_SIZE = 5000
+# Rows enriched and written per batch, 0 enriches the whole run's rows at once
+ENRICH_CHUNK_ROWS = int(os.environ.get("ENRICH_CHUNK_ROWS", "0"))
+# Distinct ORG names per executor task when GRID matching runs on a thread or process backend
+GRID_CHUNK_SIZE = 1000
+PUBMED_RAW_FILE = "../raw_data/c14-gem-lo-pubmed.xml"
+
+# Direct child paths from PubmedArticle, ElementTree compiles and caches these on first use
+PMID_PATH = "MedlineCitation/PMID"
+TITLE_PATH = "MedlineCitation/Article/ArticleTitle"
+YEAR_PATH = "MedlineCitation/Article/Journal/JournalIssue/PubDate/Year"
+KEYWORD_PATH = "MedlineCitation/KeywordList/Keyword"
+MESH_PATH = "MedlineCitation/MeshHeadingList/MeshHeading/DescriptorName"
+AUTHOR_PATH = "MedlineCitation/Article/AuthorList/Author"
+AFFILIATION_PATH = "AffiliationInfo/Affiliation"
 
 # Functions for parsing article metadata and extracting information
 
 
-def parse_article_metadata(article: ET.Element) -> tuple[str, str, str]:
-    """Returns article pmid, title and year."""
-    pmid_value = article.find(".//PMID").text
-    title_value = article.find(".//ArticleTitle").text
-    year_element = article.find(".//PubDate/Year")
-    year_value = year_element.text if year_element is not None else ""
+def parse_article_metadata(article: ET.Element) -> tuple[str, str, int | None]:
+    """Returns article pmid, title and year, None when the article has no year."""
+    pmid_value = article.find(PMID_PATH).text
+    title_value = article.find(TITLE_PATH).text
+    year_element = article.find(YEAR_PATH)
+    year_value = parse_year(year_element.text) if year_element is not None else None
 
     return pmid_value, title_value, year_value
 
@@ -47,38 +134,98 @@ def parse_author_info(author: ET.Element) -> str:
 
 def get_email(affiliation_text: str) -> str:
     """Extracts the email from affiliation name using regex"""
-    email_address = re.search(r"[\w.]+@[\w.]+\w+", affiliation_text)
+    email_address = EMAIL_REGEX.search(affiliation_text)
     return email_address.group() if email_address else ""
 
 
 def get_zipcode(affiliation_text: str) -> str:
     """Extracts zipcode from affiliation name using regex"""
-    zip_code = re.search(
-        r"[A-Za-z]{1,2}\d[A-Za-z\d]? ?\d[A-Za-z]{2}|\d{5}(-\d{4})?|[A-Z]\d[A-Z] \d[A-Z]\d", affiliation_text)
+    zip_code = ZIPCODE_REGEX.search(affiliation_text)
     return zip_code.group() if zip_code else ""
 
 
 def get_keywords(article: ET.Element) -> list[str]:
     """Returns keywords for each article"""
-    keywords_element = article.findall(".//KeywordList/Keyword")
-    return [keyword.text for keyword in keywords_element] if keywords_element else [""]
+    keywords_element = article.findall(KEYWORD_PATH)
+    return [intern_text(keyword.text) for keyword in keywords_element] if keywords_element else [""]
 
 
 def get_mesh_identifiers(article: ET.Element) -> list[str]:
     """Returns mesh identifiers UI for each article"""
-    mesh_elements = article.findall(
-        ".//MeshHeadingList/MeshHeading/DescriptorName")
-    return [mesh.get("UI") for mesh in mesh_elements] if mesh_elements else [""]
+    mesh_elements = article.findall(MESH_PATH)
+    return [intern_text(mesh.get("UI")) for mesh in mesh_elements] if mesh_elements else [""]
 
 # NER-related functions
 
 
-def extract_entities(affiliation_text: str):
+class EntitySpan(NamedTuple):
+    """GPE/ORG span kept instead of the spaCy Doc, label_ mirrors the spaCy attribute."""
+    text: str
+    label_: str
+
+
+def extract_entity_spans(affiliation_texts: Iterable[str], batch_size: int = NER_BATCH_SIZE,
+                         n_process: int = NER_PROCESSES) -> list[tuple[EntitySpan, ...]]:
+    """Runs NER over affiliation texts in batches, keeping only the GPE and ORG spans."""
+    return [
+        tuple(EntitySpan(entity.text, entity.label_)
+              for entity in doc.ents if entity.label_ in NER_LABELS)
+        for doc in get_nlp().pipe(affiliation_texts, batch_size=batch_size, n_process=n_process)
+    ]
+
+
+def extract_entities(affiliation_text: str) -> tuple[EntitySpan, ...]:
     """Extracts entities from affiliation text."""
-    doc = nlp(affiliation_text)
-    entities = doc.ents
+    return extract_entity_spans([affiliation_text])[0]
+
+
+def open_ner_cache(path: str = NER_CACHE_PATH) -> SQLiteCache:
+    """Opens the on-disk NER cache, invalidated whenever the spaCy model changes."""
+    nlp = get_nlp()
+    model_version = (f"{nlp.meta['lang']}_{nlp.meta['name']}-{nlp.meta['version']}"
+                     f":{','.join(nlp.pipe_names)}")
+    return SQLiteCache(path, namespace="ner", version=model_version,
+                       max_entries=NER_CACHE_MAX_ENTRIES)
+
+
+def open_match_cache(path: str = MATCH_CACHE_PATH) -> MatchCache:
+    """Opens the GRID match cache, persisted in path and invalidated whenever the GRID data changes."""
+    version = match_cache_version(get_reference_data()["fingerprint"],
+                                  get_grid_matcher().score_cutoff)
+    return MatchCache(store=SQLiteCache(path, namespace="grid_match", version=version))
+
+
+@cached
+def get_match_cache() -> MatchCache:
+    """Returns this process's in-memory GRID match cache."""
+    return MatchCache()
+
 
-    return entities
+def resolve_affiliation_entities(affiliations: pd.Series, ner_cache: SQLiteCache = None,
+                                 batch_size: int = NER_BATCH_SIZE,
+                                 n_process: int = NER_PROCESSES) -> pd.Series:
+    """Returns the GPE/ORG spans for each affiliation, running NER once per distinct string."""
+    normalised = {text: normalise_text(text)
+                  for text in affiliations.unique()}
+    distinct_texts = list(dict.fromkeys(normalised.values()))
+
+    entities = {}
+    if ner_cache is not None:
+        entities = {text: tuple(EntitySpan(*span) for span in spans)
+                    for text, spans in ner_cache.get_many(distinct_texts).items()}
+
+    missing = [text for text in distinct_texts if text not in entities]
+    if missing:
+        new_entities = dict(zip(missing, extract_entity_spans(
+            missing, batch_size=batch_size, n_process=n_process)))
+        entities.update(new_entities)
+        if ner_cache is not None:
+            ner_cache.put_many(new_entities)
+
+    print(f"NER ran on {len(missing)} of {len(distinct_texts)} distinct affiliations "
+          f"({len(affiliations)} rows)")
+    # Mapping a categorical to tuples fails, so go through the shared category strings
+    return affiliations.astype(object).map(lambda text: entities[normalised[text]])
 
 
 def extract_gpe_entities(entities) -> set[str]:
@@ -95,84 +242,123 @@ def extract_org_entities(entities) -> set[str]:
     return org_entities
 
 
-valid_countries = {country.name for country in pycountry.countries}
-
-
 def extract_country(gpe_entities: set[str]) -> str:
     """Returns valid country name from GPE entities for each affiliation"""
-    return next((gpe for gpe in gpe_entities if gpe in valid_countries), None)
+    gazetteer = get_country_gazetteer()
+    return next((country for country in map(gazetteer.lookup, gpe_entities) if country), None)
 
-# Function to match institutions to GRID dataset
 
+def resolve_countries(affiliations: pd.Series, entities: pd.Series = None,
+                      ner_cache: SQLiteCache = None) -> tuple[pd.Series, pd.Series]:
+    """Returns each affiliation's country and the path that resolved it: gazetteer, ner or unresolved.
 
-def match_org_to_grid(org_entities: set[str]) -> tuple[str, str]:
-    """Matches the org_entities to GRID dataset institutions with RapidFuzz"""
-    best_match = None
-    best_match_id = None
-
-    for org in org_entities:
-        match = process.extractOne(org, grid_map.keys(
-        ), scorer=Levenshtein.normalized_similarity, score_cutoff=0.9)
-        if match and match[1] >= 0.9:
-            best_match = match[0]
-            best_match_id = grid_map[best_match]
-            break
-
-    return (best_match, best_match_id)
-
-
-def match_org_to_grid_caching(org_entities: set[str]) -> tuple[str, str]:
-    """Matches the org_entities to GRID dataset institutions with RapidFuzz, using caching."""
-    best_match = None
-    best_match_id = None
-
-    for org in org_entities:
-        if org in cache:
-            return cache[org]
-
-        match = process.extractOne(org, grid_map.keys(
-        ), scorer=Levenshtein.normalized_similarity, score_cutoff=0.9)
-        if match and match[1] >= 0.9:
-            best_match = match[0]
-            best_match_id = grid_map[best_match]
-            cache[org] = (best_match, best_match_id)
-            return (best_match, best_match_id)
-
-        cache[org] = (None, None)
-    return (None, None)
+    The gazetteer checks the trailing segments first, GPE entities are only consulted for the
+    affiliations it misses. NER runs on those alone unless their entities are passed in.
+    """
+    countries = get_country_gazetteer().resolve_many(affiliations)
+    sources = pd.Series("gazetteer", index=affiliations.index).where(countries.notna(), "unresolved")
 
-# Above and beyond - Finds the top keywords
+    missed = countries.isna()
+    if missed.any():
+        missed_entities = (entities[missed] if entities is not None else
+                           resolve_affiliation_entities(affiliations[missed], ner_cache=ner_cache))
+        ner_countries = missed_entities.apply(extract_gpe_entities).apply(extract_country)
+        countries[missed] = ner_countries
+        sources[missed & countries.notna()] = "ner"
 
+    return countries, sources
 
-def top_keywords_by_country(pubmed_df: pd.DataFrame) -> None:
-    """Prints the top 5 most frequent keywords for each country."""
+# Function to match institutions to GRID dataset
 
-    process_df = pubmed_df[(pubmed_df["Country"].notna()) &
-                           (pubmed_df["Article keywords"].notna()) &
-                           (pubmed_df["Article keywords"] != "['']")]
 
-    def parse_keywords(keywords):
-        if isinstance(keywords, str):
-            return keywords.strip('[]').replace("'", "").split(', ')
-        elif isinstance(keywords, list):
-            return keywords
+def match_org_to_grid(org_entities: set[str]) -> tuple[str, str]:
+    """Matches the org_entities to GRID dataset institutions with RapidFuzz"""
+    return get_grid_matcher().match_entities(org_entities)
+
+
+def match_org_chunk(orgs: list[str]) -> tuple[dict, dict[str, int]]:
+    """Matches one chunk of distinct orgs on an executor worker, returning its matches and tier counts."""
+    # A shallow copy shares the GRID index but counts this chunk's tiers separately
+    matcher = copy.copy(get_grid_matcher())
+    matcher.tier_counts = dict.fromkeys(MATCH_TIERS, 0)
+    # The executor already runs chunks in parallel, so each cdist call keeps to one thread
+    return matcher.match_many(orgs, workers=1), matcher.tier_counts
+
+
+def match_orgs_to_grid_bulk(org_entities: pd.Series, backend: str = None,
+                            workers: int = None,
+                            match_cache: MatchCache = None,
+                            executor: Executor = None) -> list[tuple[str, str]]:
+    """Matches every row's org_entities at once, scoring each distinct ORG a single time with cdist.
+
+    The serial backend scores every org in one process with a multithreaded cdist, the other
+    executor backends split the distinct orgs into GRID_CHUNK_SIZE tasks. With a match_cache,
+    only orgs it has no result for are matched, and their results are added to it; the tier
+    counts only include the orgs matched here. An executor
+    made by the caller with create_executor(initializer=get_reference_data) is reused across calls.
+    """
+    normalised = {org: normalise_text(org) for orgs in org_entities for org in orgs}
+    distinct_orgs = list(dict.fromkeys(normalised.values()))
+    matches = match_cache.get_many(distinct_orgs) if match_cache is not None else {}
+    missing = [org for org in distinct_orgs if org not in matches]
+
+    matcher = get_grid_matcher()
+    if not missing:
+        new_matches = {}
+    elif (backend or EXECUTOR_BACKEND) == "serial":
+        new_matches = matcher.match_many(missing, workers=workers or default_workers())
+    else:
+        new_matches = {}
+        for chunk_matches, tier_counts in map_in_chunks(
+                match_org_chunk, missing, GRID_CHUNK_SIZE, backend=backend,
+                workers=workers, initializer=get_reference_data, executor=executor):
+            new_matches.update(chunk_matches)
+            for tier, count in tier_counts.items():
+                matcher.tier_counts[tier] += count
+    if match_cache is not None:
+        match_cache.put_many(new_matches)
+    matches.update(new_matches)
+
+    # Same per row rule as match_org_to_grid: the first org with a match wins
+    return [
+        next((matches[normalised[org]] for org in orgs if matches[normalised[org]] is not None),
+             (None, None))
+        for orgs in org_entities
+    ]
+
+
+def print_grid_tiers(match_cache: MatchCache = None):
+    """Prints the tiers of the orgs matched this run and the number answered by match_cache."""
+    cache_hits = match_cache.stats()["hits"] if match_cache is not None else 0
+    print(f"GRID matches by tier: {get_grid_matcher().tier_counts}, "
+          f"from the match cache: {cache_hits}")
+
+
+def match_org_to_grid_caching(org_entities: set[str], match_cache: MatchCache = None) -> tuple[str, str]:
+    """Matches the org_entities to GRID dataset institutions with RapidFuzz, using caching.
+
+    A cached negative result moves on to the next org, like a fresh miss would.
+    """
+    match_cache = match_cache if match_cache is not None else get_match_cache()
+    for org in map(normalise_text, org_entities):
+        cached_match = match_cache.get_many([org])
+        if org in cached_match:
+            match = cached_match[org]
         else:
-            return []
-    process_df["Article keywords"] = process_df["Article keywords"].apply(
-        parse_keywords)
-
-    exploded_df = process_df.explode("Article keywords")
+            match = get_grid_matcher().match(org)
+            match_cache.put_many({org: match})
+        if match is not None:
+            return match
+    return (None, None)
 
-    keyword_counts = exploded_df.groupby(
-        ["Country", "Article keywords"]).size().reset_index(name='count')
+# Above and beyond - Finds the top keywords
 
-    top_keywords = keyword_counts.groupby("Country").apply(
-        lambda x: x.nlargest(5, 'count')).reset_index(drop=True)
 
-    for country, group in top_keywords.groupby("Country"):
-        print(f"\nTop 5 keywords for {country}:")
-        for _, row in group.iterrows():
-            print(f"{row['Article keywords']}: {row['count']}")
+def top_keywords_by_country(pubmed_df: pd.DataFrame, k: int = 5) -> pd.DataFrame:
+    """Returns the k most frequent keywords for each country, counted over integer keyword ids."""
+    counter = TermCounter("Country", "Article keywords")
+    counter.update(pubmed_df)
+    return counter.top_k(k)
 
 
 def calculate_match_percentage(pubmed_df: pd.DataFrame) -> float:
@@ -197,6 +383,11 @@ def extract_samples(pubmed_df: pd.DataFrame):
         min(20, total_records - matched_records), random_state=42
     )
 
+    save_samples(matched_sample, unmatched_sample)
+
+
+def save_samples(matched_sample: pd.DataFrame, unmatched_sample: pd.DataFrame):
+    """Save the samples of matched and unmatched records."""
     matched_sample.to_csv("../cleaned_data/matched_sample.csv", index=False)
     unmatched_sample.to_csv(
         "../cleaned_data/unmatched_sample.csv", index=False)
@@ -204,87 +395,399 @@ def extract_samples(pubmed_df: pd.DataFrame):
 # Main processing
 
 
-def process_pubmed_xml(file_path: str) -> pd.DataFrame:
-    """Process pubmed xml and create base dataframe"""
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-    print(f"Processing {file_path}")
-
-    data = {
-        "Article PMID": [], "Article title": [], "Article keywords": [],
-        "Article MESH identifiers": [], "Article Year": [], "Author full name": [],
-        "Author email": [], "Affiliation name": [], "Affiliation zipcode": []
+def iter_pubmed_articles(file_path) -> Iterator[ET.Element]:
+    """Streams PubmedArticle elements one at a time, clearing each once it has been consumed."""
+    context = ET.iterparse(file_path, events=("start", "end"))
+    first = next(context, None)
+    if first is None:
+        return
+    _, root = first
+
+    for event, element in context:
+        if event == "end" and element.tag == "PubmedArticle":
+            yield element
+            # Drop every finished article from the root so memory stays flat
+            root.clear()
+
+
+def parse_article_fields(article: ET.Element) -> dict:
+    """Returns the article level fields shared by every row of an article."""
+    pmid_value, title_value, year_value = parse_article_metadata(article)
+    return {
+        "Article PMID": pmid_value,
+        "Article title": title_value,
+        "Article Year": year_value,
+        "Article keywords": get_keywords(article),
+        "Article MESH identifiers": get_mesh_identifiers(article),
     }
 
-    for article in root.findall("PubmedArticle"):
-        pmid_value, title_value, year_value = parse_article_metadata(article)
 
-        for author in article.findall(".//AuthorList/Author"):
-            for affiliation in author.findall("AffiliationInfo/Affiliation"):
-                data["Article PMID"].append(pmid_value)
-                data["Article title"].append(title_value)
-                data["Article Year"].append(year_value)
-                data["Author full name"].append(parse_author_info(author))
+def build_article_rows(article: ET.Element) -> dict[str, list]:
+    """Returns one row per author affiliation for a single article.
 
-                affiliation_text = affiliation.text
-                data["Affiliation name"].append(affiliation_text)
-                data["Author email"].append(get_email(affiliation_text))
-                data["Affiliation zipcode"].append(
-                    get_zipcode(affiliation_text))
-                data["Article keywords"].append(get_keywords(article))
-                data["Article MESH identifiers"].append(
-                    get_mesh_identifiers(article))
+    Author email and Affiliation zipcode are left empty, add_contact_fields fills them in batches.
+    """
+    rows = {column: [] for column in PUBMED_COLUMNS}
+    article_fields = parse_article_fields(article)
 
-    return pd.DataFrame(data)
+    for author in article.iterfind(AUTHOR_PATH):
+        author_name = None
+        for affiliation in author.iterfind(AFFILIATION_PATH):
+            if author_name is None:
+                author_name = intern_text(parse_author_info(author))
 
+            # Interned, so repeated names and affiliations share one string
+            affiliation_text = intern_text(affiliation.text)
+            rows["Author full name"].append(author_name)
+            rows["Affiliation name"].append(affiliation_text)
 
-def insert_affiliation_data(pubmed_df: pd.DataFrame, output_file: str) -> pd.DataFrame:
-    """Add NLP and matching results to DataFrame"""
+    # Article level values are computed once and shared by all of its rows
+    row_count = len(rows["Affiliation name"])
+    for column, value in article_fields.items():
+        rows[column] = [value] * row_count
 
-    pubmed_df["Affiliation name"] = pubmed_df["Affiliation name"].astype(str)
-    pubmed_df["nlp"] = pubmed_df["Affiliation name"].apply(
-        extract_entities)
+    return rows
 
-    pubmed_df["Country"] = pubmed_df["nlp"].apply(extract_gpe_entities)
-    pubmed_df["Institution name"] = pubmed_df["nlp"].apply(
-        extract_org_entities)
 
-    pubmed_df["Country"] = pubmed_df["Country"].apply(extract_country)
+def add_contact_fields(data: dict[str, list]) -> dict[str, list]:
+    """Fills Author email and Affiliation zipcode for the rows that do not have them yet."""
+    texts = data["Affiliation name"][len(data["Author email"]):]
+    with run_report.stage("regex extraction", rows_in=len(texts), log=False) as metrics:
+        fields = extract_affiliation_fields(pd.Series(texts, dtype=object))
+        data["Author email"].extend(fields["email"])
+        data["Affiliation zipcode"].extend(fields["zipcode"])
+        metrics.rows_out += len(texts)
+    return data
+
+
+def is_article_processed(article: ET.Element, manifest: ProcessedManifest) -> bool:
+    """Returns True if the manifest already holds this PMID with identical content."""
+    pmid_value = article.find(PMID_PATH).text
+    # The tail is the whitespace before the next article, which changes with its neighbours
+    tail, article.tail = article.tail, None
+    try:
+        return not manifest.should_process_article(pmid_value, content_hash(ET.tostring(article)))
+    finally:
+        article.tail = tail
+
+
+def chunk_frame(data: dict[str, list]) -> pd.DataFrame:
+    """Returns parsed rows as a DataFrame, with the contact fields filled and compact columns."""
+    return compact_columns(pd.DataFrame(add_contact_fields(data)))
+
+
+def iter_pubmed_chunks(file_path, chunk_size: int = CHUNK_SIZE,
+                       manifest: ProcessedManifest = None) -> Iterator[pd.DataFrame]:
+    """Streams the pubmed xml as DataFrames of at most chunk_size rows.
+
+    With a manifest, only articles that are new or changed since they were last processed are emitted.
+    """
+    if isinstance(file_path, str):
+        print(f"Processing {file_path}")
+    data = {column: [] for column in PUBMED_COLUMNS}
+    row_count = 0
 
-    grid = pubmed_df["Institution name"].parallel_apply(
-        match_org_to_grid)
+    for article in iter_pubmed_articles(file_path):
+        if manifest is not None and is_article_processed(article, manifest):
+            continue
 
-    # grid = pubmed_df["Institution name"].parallel_apply(
-    #     match_org_to_grid_caching)
+        rows = build_article_rows(article)
+        for column, values in rows.items():
+            data[column].extend(values)
+        row_count += len(rows["Article PMID"])
+
+        if row_count >= chunk_size:
+            chunk = chunk_frame(data)
+            for start in range(0, row_count - chunk_size + 1, chunk_size):
+                yield chunk.iloc[start:start + chunk_size].reset_index(drop=True)
+            remainder = row_count % chunk_size
+            data = {column: values[len(values) - remainder:]
+                    for column, values in data.items()}
+            row_count = remainder
+
+    if row_count:
+        yield chunk_frame(data)
+
+
+def process_pubmed_xml(file_path: str, manifest: ProcessedManifest = None) -> pd.DataFrame:
+    """Process pubmed xml and create base dataframe"""
+    chunks = list(iter_pubmed_chunks(file_path, manifest=manifest))
+    if not chunks:
+        return compact_columns(pd.DataFrame(columns=PUBMED_COLUMNS))
+    return concat_compact(chunks)
+
+
+def merge_into_output(pubmed_df: pd.DataFrame, output_file: str) -> pd.DataFrame:
+    """Replaces the rows of every PMID in pubmed_df within the existing output, appending new ones."""
+    try:
+        existing_df = read_output(output_file)
+    except FileNotFoundError:
+        return pubmed_df
+
+    updated_pmids = set(pubmed_df["Article PMID"].astype(str))
+    kept_df = existing_df[~existing_df["Article PMID"].isin(updated_pmids)]
+    print(f"Merging {len(pubmed_df)} new rows into {len(kept_df)} existing rows")
+    return concat_compact([kept_df, pubmed_df])
+
+
+def enrich_affiliations(pubmed_df: pd.DataFrame, ner_cache: SQLiteCache = None,
+                        batch_size: int = NER_BATCH_SIZE,
+                        n_process: int = NER_PROCESSES,
+                        executor_backend: str = None, executor_workers: int = None,
+                        match_cache: MatchCache = None,
+                        grid_executor: Executor = None) -> pd.DataFrame:
+    """Adds the NER entities, country and GRID match columns to the DataFrame"""
+
+    pubmed_df["Affiliation name"] = as_text(pubmed_df["Affiliation name"])
+    with run_report.stage("ner", rows_in=len(pubmed_df)) as metrics:
+        pubmed_df["Entities"] = resolve_affiliation_entities(
+            pubmed_df["Affiliation name"], ner_cache=ner_cache,
+            batch_size=batch_size, n_process=n_process)
+        metrics.rows_out += len(pubmed_df)
+
+    pubmed_df["Institution name"] = pubmed_df["Entities"].apply(
+        extract_org_entities)
+
+    with run_report.stage("country resolution", rows_in=len(pubmed_df)) as metrics:
+        pubmed_df["Country"], pubmed_df["Country source"] = resolve_countries(
+            pubmed_df["Affiliation name"], entities=pubmed_df["Entities"])
+        metrics.rows_out += int(pubmed_df["Country"].notna().sum())
+    print(f"Countries by source: {pubmed_df['Country source'].value_counts().to_dict()}")
+
+    with run_report.stage("grid matching", rows_in=len(pubmed_df)) as metrics:
+        grid = match_orgs_to_grid_bulk(pubmed_df["Institution name"], backend=executor_backend,
+                                       workers=executor_workers, match_cache=match_cache,
+                                       executor=grid_executor)
+        metrics.rows_out += sum(match[1] is not None for match in grid)
 
     pubmed_df[["Institution GRID name", "Institution GRID id"]
-              ] = pd.DataFrame(grid.to_list())
+              ] = pd.DataFrame(grid, index=pubmed_df.index)
+
+    return compact_columns(pubmed_df)
+
 
+def save_enriched_output(pubmed_df: pd.DataFrame, output_file: str,
+                         incremental: bool = False) -> pd.DataFrame:
+    """Reports the match rate, saves samples and writes the enriched rows to output_file"""
     calculate_match_percentage(pubmed_df)
 
-    extract_samples(pubmed_df)
+    with run_report.stage("sample extraction", rows_in=len(pubmed_df)):
+        extract_samples(pubmed_df)
 
-    pubmed_df.drop(columns=["Institution name", "nlp"], inplace=True)
+    pubmed_df.drop(columns=HELPER_COLUMNS, inplace=True, errors="ignore")
 
-    pubmed_df.to_csv(output_file, index=False)
+    with run_report.stage("write output", rows_in=len(pubmed_df)) as metrics:
+        output_df = merge_into_output(pubmed_df, output_file) if incremental else pubmed_df
+        write_output(output_df, output_file)
+        metrics.rows_out += len(output_df)
     print(f"{output_file} saved successfully")
 
     return pubmed_df
 
 
-def main_transform():
-    """Processes the pubmed xml data and creates a pubmed dataframe with cleaned data"""
-    pubmed_raw_file = "../raw_data/c14-gem-lo-pubmed.xml"
-    pubmed_df = process_pubmed_xml(pubmed_raw_file)
+def insert_affiliation_data(pubmed_df: pd.DataFrame, output_file: str,
+                            ner_cache: SQLiteCache = None,
+                            batch_size: int = NER_BATCH_SIZE,
+                            n_process: int = NER_PROCESSES,
+                            incremental: bool = False,
+                            match_cache: MatchCache = None) -> pd.DataFrame:
+    """Add NLP and matching results to DataFrame"""
+    enrich_affiliations(pubmed_df, ner_cache=ner_cache,
+                        batch_size=batch_size, n_process=n_process, match_cache=match_cache)
+    print_grid_tiers(match_cache)
+    return save_enriched_output(pubmed_df, output_file, incremental=incremental)
+
+
+def timed_chunks(chunks: Iterable[pd.DataFrame], stage: str) -> Iterator[pd.DataFrame]:
+    """Yields chunks, recording the time spent producing each one under stage."""
+    chunks = iter(chunks)
+    while True:
+        with run_report.stage(stage, log=False) as metrics:
+            chunk_df = next(chunks, None)
+            metrics.rows_out += 0 if chunk_df is None else len(chunk_df)
+        if chunk_df is None:
+            return
+        yield chunk_df
+
+
+def append_kept_rows(writer: OutputWriter, output_file: str, updated_pmids: set[str]) -> int:
+    """Streams the rows of output_file whose PMID was not reprocessed into writer."""
+    kept_rows = 0
+    for chunk in iter_output_chunks(output_file):
+        chunk_df = chunk if isinstance(chunk, pd.DataFrame) else chunk.to_pandas()
+        chunk_df = chunk_df[~chunk_df["Article PMID"].astype(str).isin(updated_pmids)]
+        writer.write(chunk_df)
+        kept_rows += len(chunk_df)
+    return kept_rows
+
+
+def merge_chunked_output(new_file: str, output_file: str, merged_file: str,
+                         updated_pmids: set[str]):
+    """Writes the kept rows of output_file and then the rows of new_file to merged_file.
+
+    Same row order as merge_into_output, one chunk of each file in memory at a time.
+    """
+    with OutputWriter(merged_file, output_format_of(output_file)) as writer:
+        kept_rows = append_kept_rows(writer, output_file, updated_pmids)
+        new_rows = append_kept_rows(writer, new_file, set())
+    print(f"Merged {new_rows} new rows into {kept_rows} existing rows")
+
+
+def enrich_in_chunks(chunks: Iterable[pd.DataFrame], output_file: str,
+                     ner_cache: SQLiteCache = None, incremental: bool = False,
+                     match_cache: MatchCache = None, batch_size: int = NER_BATCH_SIZE,
+                     n_process: int = NER_PROCESSES) -> int:
+    """Enriches each chunk and appends it to output_file, returning the rows enriched.
+
+    Only one chunk is held at a time, so peak memory depends on the chunk size and not on the
+    number of rows. The match percentage and samples are accumulated as the chunks pass.
+    With incremental=True the new rows are merged into the existing output like
+    merge_into_output does, streaming both files.
+    """
+    stats = MatchStats()
+    updated_pmids = set()
+    # Written beside the output and renamed at the end, so a failed run leaves the old output
+    new_file = temporary_output_file(output_file, "new")
+    merged_file = temporary_output_file(output_file, "merged")
+    try:
+        # One GRID matching pool for every chunk, so its workers start and load the reference
+        # data once per run rather than once per chunk
+        with OutputWriter(new_file, output_format_of(output_file)) as writer, \
+                create_executor(initializer=get_reference_data) as grid_executor:
+            for chunk_df in timed_chunks(chunks, "xml parse"):
+                enrich_affiliations(chunk_df, ner_cache=ner_cache, batch_size=batch_size,
+                                    n_process=n_process, match_cache=match_cache,
+                                    grid_executor=grid_executor)
+                chunk_df["Match status"] = chunk_df["Institution GRID id"].notna()
+                with run_report.stage("sample extraction", rows_in=len(chunk_df), log=False):
+                    stats.update(chunk_df)
+                chunk_df = chunk_df.drop(columns=HELPER_COLUMNS)
+                with run_report.stage("write output", rows_in=len(chunk_df), log=False) as metrics:
+                    writer.write(chunk_df)
+                    metrics.rows_out += len(chunk_df)
+                if incremental:
+                    updated_pmids.update(chunk_df["Article PMID"].astype(str))
+
+        if incremental and not writer.rows:
+            print("No new or changed articles to process")
+            return 0
+
+        print_grid_tiers(match_cache)
+        stats.match_percentage()
+        save_samples(stats.matched_sample.sample, stats.unmatched_sample.sample)
+        if incremental and os.path.exists(output_file):
+            with run_report.stage("write output", log=False):
+                merge_chunked_output(new_file, output_file, merged_file, updated_pmids)
+            os.replace(merged_file, output_file)
+        else:
+            os.replace(new_file, output_file)
+    finally:
+        for path in (new_file, merged_file):
+            if os.path.exists(path):
+                os.remove(path)
 
-    processed_csv_file = "../cleaned_data/pubmed_output.csv"
-    pubmed_df = insert_affiliation_data(pubmed_df, processed_csv_file)
+    print(f"{output_file} saved successfully")
+    return writer.rows
+
+
+def iter_raw_chunks(pubmed_raw_files: Iterable, manifest: ProcessedManifest = None,
+                    chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """Streams every raw file path or file object as DataFrames of at most chunk_size rows.
+
+    With a manifest, unchanged local files and unchanged articles are skipped.
+    """
+    for pubmed_raw_file in pubmed_raw_files:
+        if manifest is not None and isinstance(pubmed_raw_file, str):
+            source = local_source(pubmed_raw_file)
+            if manifest.is_source_unchanged(source):
+                print(f"Skipping unchanged {pubmed_raw_file}")
+                continue
+            manifest.stage_source(source)
+        yield from iter_pubmed_chunks(pubmed_raw_file, chunk_size=chunk_size, manifest=manifest)
+
+    if manifest is not None:
+        print(f"Skipped {manifest.skipped_articles} unchanged articles")
+
+
+def read_raw_files(pubmed_raw_files: Iterable, manifest: ProcessedManifest = None) -> pd.DataFrame:
+    """Parses every raw file path or file object into one DataFrame.
+
+    With a manifest, unchanged local files and unchanged articles are skipped.
+    """
+    frames = list(iter_raw_chunks(pubmed_raw_files, manifest=manifest))
+    if not frames:
+        return compact_columns(pd.DataFrame(columns=PUBMED_COLUMNS))
+    return concat_compact(frames)
+
+
+def main_transform(pubmed_raw_files: Iterable = None, manifest: ProcessedManifest = None,
+                   chunk_rows: int = ENRICH_CHUNK_ROWS, batch_size: int = NER_BATCH_SIZE,
+                   n_process: int = NER_PROCESSES):
+    """Processes the pubmed xml data and creates a pubmed dataframe with cleaned data
+
+    With a manifest the run is incremental: only new or changed articles are enriched and merged
+    into the existing output. The caller commits the manifest once the output has been stored.
+    With chunk_rows, batches of that many rows are parsed, enriched and written one at a time,
+    except for normalised output, whose tables are built from every row at once.
+    batch_size and n_process are the nlp.pipe batch size and processes.
+    """
+    if pubmed_raw_files is None:
+        pubmed_raw_files = [PUBMED_RAW_FILE]
+    if manifest is not None and not manifest.is_empty() \
+            and not os.path.exists(processed_output_file()):
+        # Merging into nothing would write only the new rows, which then replace the full output
+        raise FileNotFoundError(f"The manifest lists processed articles but "
+                                f"{processed_output_file()} is missing, restore the output "
+                                "or reset the manifest")
+    if chunk_rows and output_format_of(processed_output_file()) == "normalized":
+        print("Normalised output is built from every row at once, enriching in memory")
+        chunk_rows = 0
+    if chunk_rows:
+        ner_cache = open_ner_cache()
+        match_cache = open_match_cache()
+        try:
+            chunks = iter_raw_chunks(pubmed_raw_files, manifest=manifest, chunk_size=chunk_rows)
+            enrich_in_chunks(chunks, processed_output_file(), ner_cache=ner_cache,
+                             incremental=manifest is not None, match_cache=match_cache,
+                             batch_size=batch_size, n_process=n_process)
+            print(f"NER cache: {ner_cache.stats()}")
+            print(f"GRID match cache: {match_cache.stats()}")
+        finally:
+            ner_cache.close()
+            match_cache.close()
+        return
+
+    # Includes the regex extraction stage, which runs on each parsed chunk
+    with run_report.stage("xml parse") as metrics:
+        pubmed_df = read_raw_files(pubmed_raw_files, manifest=manifest)
+        metrics.rows_out += len(pubmed_df)
+
+    if pubmed_df.empty and manifest is not None:
+        print("No new or changed articles to process")
+        return
+
+    processed_output = processed_output_file()
+    ner_cache = open_ner_cache()
+    match_cache = open_match_cache()
+    pubmed_df = insert_affiliation_data(
+        pubmed_df, processed_output, ner_cache=ner_cache, batch_size=batch_size,
+        n_process=n_process, incremental=manifest is not None, match_cache=match_cache)
+    print(f"NER cache: {ner_cache.stats()}")
+    print(f"GRID match cache: {match_cache.stats()}")
+    ner_cache.close()
+    match_cache.close()
 
     # Additional task: Uncomment the line below to get the top frequent keywords:
-    # top_keywords_by_country(pubmed_df)
+    # print(top_keywords_by_country(pubmed_df))
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profile", nargs="?", const=default_profile_dir(), metavar="DIR",
+                        help="profile every stage into DIR, by default a new ../profiles/<time>")
+    args = parser.parse_args()
+    if args.profile:
+        run_report.enable_profiling(args.profile)
     main_transform()
 
 
@@ -0,0 +1,232 @@
+"""Transforms many PubMed XML files in parallel, one file per process pool task.
+
+Run from the pipeline/ directory with a directory, a glob or an S3 prefix:
+    python transform_driver.py ../raw_data [workers]
+    python transform_driver.py "../raw_data/pubmed25n*.xml" [workers]
+    python transform_driver.py s3://sigma-pharmazer-input/c14-gem-lo [workers]
+With --profile [DIR], the parent and every worker write per-stage profiles (see profiling.py).
+"""
+import argparse
+import glob
+import os
+import tempfile
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import pandas as pd
+import transform
+from compact_columns import concat_compact
+from executors import available_cpus
+from instrumentation import run_report
+from output_store import (OutputWriter, output_format_of, processed_output_file,
+                          temporary_output_file)
+from profiling import default_profile_dir
+from running_stats import MatchStats
+
+# Tasks queued per worker, bounds how many parsed files wait in memory at once
+TASKS_PER_WORKER = 2
+LIST_COLUMNS = ["Article keywords", "Article MESH identifiers"]
+
+worker_state = {}
+
+
+def split_s3_uri(uri: str) -> tuple[str, str]:
+    """Returns the bucket and key (or prefix) of an s3:// uri."""
+    bucket, _, key = uri.removeprefix("s3://").partition("/")
+    return bucket, key
+
+
+def resolve_inputs(source: str) -> list[str]:
+    """Returns the sorted XML files under a directory, matching a glob, or under an S3 prefix."""
+    if source.startswith("s3://"):
+        from extract import connect_to_s3, list_pubmed_objects  # pylint: disable=import-outside-toplevel
+
+        bucket, prefix = split_s3_uri(source)
+        return sorted(f"s3://{bucket}/{s3_object['Key']}"
+                      for s3_object in list_pubmed_objects(connect_to_s3(), bucket, prefix, ".xml"))
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, "*.xml")))
+    return sorted(glob.glob(source))
+
+
+def init_worker():
+    """Loads the NER model, GRID index, NER cache and GRID match cache once per worker process."""
+    transform.get_nlp()
+    transform.get_reference_data()
+    worker_state["ner_cache"] = transform.open_ner_cache()
+    worker_state["match_cache"] = transform.open_match_cache()
+
+
+def open_input(source: str):
+    """Returns a path for a local file, or a streaming body for an S3 object."""
+    if not source.startswith("s3://"):
+        return source
+    if "s3" not in worker_state:
+        from extract import connect_to_s3  # pylint: disable=import-outside-toplevel
+
+        worker_state["s3"] = connect_to_s3()
+    bucket, key = split_s3_uri(source)
+    return worker_state["s3"].get_object(Bucket=bucket, Key=key)["Body"]
+
+
+def transform_file(source: str, part_path: str) -> int:
+    """Parses and enriches one file, writing its rows to part_path, and returns the row count."""
+    with run_report.stage("xml parse", log=False) as metrics:
+        pubmed_df = transform.process_pubmed_xml(open_input(source))
+        metrics.rows_out += len(pubmed_df)
+    if pubmed_df.empty:
+        return 0
+
+    # Files already run one per process, so NER and GRID matching stay on this worker's core
+    transform.enrich_affiliations(pubmed_df, ner_cache=worker_state["ner_cache"],
+                                  batch_size=transform.NER_BATCH_SIZE, n_process=1,
+                                  executor_backend="serial", executor_workers=1,
+                                  match_cache=worker_state["match_cache"])
+    pubmed_df["Match status"] = pubmed_df["Institution GRID id"].notna()
+    pubmed_df.drop(columns=transform.HELPER_COLUMNS, inplace=True)
+    pubmed_df.to_parquet(part_path, index=False)
+    return len(pubmed_df)
+
+
+def run_task(source: str, part_path: str) -> tuple[int, str]:
+    """Runs transform_file, returning (rows, "") or (0, traceback) so one bad file fails alone."""
+    try:
+        return transform_file(source, part_path), ""
+    except Exception:  # pylint: disable=broad-except
+        return 0, traceback.format_exc()
+    finally:
+        # Pool workers exit without running atexit, so profiles are written after every file
+        if run_report.profiler is not None:
+            run_report.profiler.write()
+
+
+def run_pool(sources: list[str], part_dir: str, workers: int) -> dict[int, tuple[int, str]]:
+    """Runs every source through the pool, at most TASKS_PER_WORKER * workers in flight.
+
+    When a worker dies outright the pool breaks and every file in flight with it. A file is only
+    failed if it was alone in flight, the others are requeued to run one at a time in a new pool
+    until the file that kills it is found, and the rest then continue in parallel.
+    """
+    results = {}
+    pending = list(enumerate(sources))
+    pending.reverse()
+    # In flight when a pool broke, retried alone before anything else is submitted
+    suspects = []
+    suspect_indexes = set()
+
+    while pending or suspects:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            in_flight = {}
+            try:
+                while pending or suspects or in_flight:
+                    if suspects and not in_flight:
+                        index, source = suspects.pop()
+                        part_path = os.path.join(part_dir, f"{index:06d}.parquet")
+                        in_flight[executor.submit(run_task, source, part_path)] = index
+                    # Nothing runs beside a suspect, so a pool it breaks is its own doing
+                    while not suspect_indexes and pending \
+                            and len(in_flight) < workers * TASKS_PER_WORKER:
+                        index, source = pending.pop()
+                        part_path = os.path.join(part_dir, f"{index:06d}.parquet")
+                        in_flight[executor.submit(run_task, source, part_path)] = index
+
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results[in_flight[future]] = future.result()
+                        index = in_flight.pop(future)
+                        suspect_indexes.discard(index)
+                        print(f"[{len(results)}/{len(sources)}] {sources[index]}: "
+                              f"{results[index][0]} rows" + (" FAILED" if results[index][1] else ""))
+            except BrokenProcessPool:
+                if len(in_flight) == 1:
+                    index, = in_flight.values()
+                    suspect_indexes.discard(index)
+                    results[index] = (0, "worker process died")
+                    print(f"[{len(results)}/{len(sources)}] {sources[index]}: worker process died")
+                else:
+                    print(f"A worker died with {len(in_flight)} files in flight, retrying each")
+                    suspects.extend((index, sources[index])
+                                    for index in sorted(in_flight.values(), reverse=True))
+                    suspect_indexes.update(in_flight.values())
+
+    return results
+
+
+def read_part(part_path: str) -> pd.DataFrame:
+    """Reads a worker's rows back with plain list columns."""
+    part_df = pd.read_parquet(part_path)
+    for column in LIST_COLUMNS:
+        part_df[column] = part_df[column].map(list)
+    return part_df
+
+
+def write_parts(part_paths: list[str], output_file: str) -> int:
+    """Streams the parts into output_file in order, one part in memory at a time, returning rows.
+
+    The match percentage and samples are accumulated as the parts pass, like enrich_in_chunks.
+    """
+    stats = MatchStats()
+    # Written beside the output and renamed at the end, so a failed run leaves the old output
+    new_file = temporary_output_file(output_file, "new")
+    try:
+        with OutputWriter(new_file, output_format_of(output_file)) as writer:
+            for part_path in part_paths:
+                part_df = read_part(part_path)
+                with run_report.stage("sample extraction", rows_in=len(part_df), log=False):
+                    stats.update(part_df)
+                with run_report.stage("write output", rows_in=len(part_df), log=False) as metrics:
+                    writer.write(part_df)
+                    metrics.rows_out += len(part_df)
+        os.replace(new_file, output_file)
+    finally:
+        if os.path.exists(new_file):
+            os.remove(new_file)
+
+    stats.match_percentage()
+    transform.save_samples(stats.matched_sample.sample, stats.unmatched_sample.sample)
+    print(f"{output_file} saved successfully")
+    return writer.rows
+
+
+def main_parallel_transform(source: str, workers: int = None, output_file: str = None) -> int:
+    """Transforms every file in source in parallel into one output in input order, returns rows."""
+    sources = resolve_inputs(source)
+    workers = workers or available_cpus()
+    output_file = output_file or processed_output_file()
+    print(f"Transforming {len(sources)} files with {workers} workers")
+    # Build the reference data artifact once here rather than racing to build it in every worker
+    transform.get_reference_data()
+
+    with tempfile.TemporaryDirectory() as part_dir:
+        results = run_pool(sources, part_dir, workers)
+
+        failures = {sources[index]: error for index, (_, error) in sorted(results.items()) if error}
+        for failed_source, error in failures.items():
+            print(f"Failed to transform {failed_source}:\n{error}")
+
+        # Parts are merged by input position, so the output does not depend on completion order
+        part_paths = [os.path.join(part_dir, f"{index:06d}.parquet")
+                      for index, (rows, error) in sorted(results.items()) if rows and not error]
+        rows = sum(rows for rows, error in results.values() if not error)
+        print(f"{len(sources) - len(failures)} of {len(sources)} files transformed, {rows} rows")
+        if not part_paths:
+            return 0
+        if output_format_of(output_file) == "normalized":
+            # Normalised tables are built from every row at once
+            pubmed_df = concat_compact([read_part(part_path) for part_path in part_paths])
+            transform.save_enriched_output(pubmed_df, output_file)
+            return len(pubmed_df)
+        return write_parts(part_paths, output_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="directory, glob or s3:// prefix of XML files")
+    parser.add_argument("workers", nargs="?", type=int,
+                        help="worker processes, the CPU count by default")
+    parser.add_argument("--profile", nargs="?", const=default_profile_dir(), metavar="DIR",
+                        help="profile every stage into DIR, by default a new ../profiles/<time>")
+    args = parser.parse_args()
+    if args.profile:
+        run_report.enable_profiling(args.profile)
+    main_parallel_transform(args.source, args.workers)